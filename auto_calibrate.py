@@ -1,14 +1,18 @@
 #! /usr/bin/env python
-import pyfits
 import argparse
 import numpy as np
-import matplotlib.pyplot as plt
+import os
+import pipeline
+import fitsaccess
+import instrument
 
 parser = argparse.ArgumentParser(
     description='Find the pixel location of the zero order center')
-parser.add_argument('filename', type=str, help='FITS filename')
-parser.add_argument('--outfile', type=str, help='Output filename',
-    required=True)
+parser.add_argument('filename', type=str, nargs='+', help='FITS filenames')
+parser.add_argument('--outfile', type=str,
+    help='Output filename, for a single input file')
+parser.add_argument('--outdir', type=str,
+    help='Output directory, for one or more input files')
 parser.add_argument('--spacing', type=float, required=True,
     help='Channel spacing (Angstrom / pixel')
 parser.add_argument('--samplewidth', type=int, default=20,
@@ -17,43 +21,72 @@ parser.add_argument('--maxx', type=int,
     help='Maximum X value for finding first order peak.')
 parser.add_argument('--degree', type=int, default=7,
     help='Degree of polynomial fit')
+parser.add_argument('--method', type=str, default='parabolic',
+    choices=pipeline.ZERO_ORDER_METHODS,
+    help='Zero order peak estimator: closed form parabolic or gaussian, or the polynomial fit (default: parabolic)')
+parser.add_argument('--dtype', type=str, default='float32',
+    choices=fitsaccess.OUTPUT_DTYPES,
+    help='Output data type (default: float32)')
 parser.add_argument('--visualise', action='store_true',
     help='Visualise the zero order peak and fitted curve')
 
 args = parser.parse_args()
 
-f = pyfits.open(args.filename)
-data = f[0].data
-s = data
+if bool(args.outfile) == bool(args.outdir):
+  parser.error('Specify one of --outfile or --outdir')
+if args.outfile and len(args.filename) > 1:
+  parser.error('--outfile can only be used with a single input file')
 
-if args.maxx:
-  s = s[:args.maxx]
+with instrument.stage('auto_calibrate', args.filename[0]) as timer:
+  # Each file is read and closed in turn, so any number can be calibrated
+  # without running out of file descriptors
+  spectra = []
+  headers = []
+  for filename in args.filename:
+    with fitsaccess.open_image(filename) as image:
+      spectra.append(image.data(fitsaccess.WORKING_DTYPE))
+      headers.append(image.scaled_header())
 
-header = f[0].header
+  # Spectra of the same length are located together in one 2D array
+  by_length = {}
+  for i, data in enumerate(spectra):
+    by_length.setdefault(data.shape[-1], []).append(i)
 
-datamax = s.argmax()
-left = datamax - args.samplewidth
-right = datamax + args.samplewidth
+  positions = [None] * len(spectra)
+  for indices in by_length.values():
+    datamax, maxpos = pipeline.find_zero_orders(
+        np.array([spectra[i] for i in indices]), args.samplewidth,
+        args.maxx, args.degree, args.method)
+    for i, peak, position in zip(indices, datamax, maxpos):
+      positions[i] = (peak, position)
 
-if left < 0:
-  left = 0
+  # Every file is located together, so each output gets the batch total
+  timer.note(files=len(spectra))
+  history = timer.history()
 
-y = s[left:right]
-x = np.arange(len(y))
-z = np.polyfit(x, y, args.degree)
-p = np.poly1d(z)
-xp = np.linspace(0, len(y), 100)
-maxpos = xp[p(xp).argmax()] + left
+  if args.outdir and not os.path.isdir(args.outdir):
+    os.makedirs(args.outdir)
 
-print '%s: Data peak: %d, polyfit peak: %f' % (args.filename, datamax, maxpos)
+  for filename, data, header, (peak, position) in zip(args.filename, spectra,
+      headers, positions):
+    print '%s: Data peak: %d, %s peak: %f' % (filename, peak, args.method,
+        position)
+    pipeline.set_calibration_headers(header, position, args.spacing)
+    timer.add_history(header, history)
+
+    if args.outfile:
+      outfile = args.outfile
+    else:
+      outfile = os.path.join(args.outdir, os.path.basename(filename))
+    fitsaccess.write(outfile, data, header, dtype=args.dtype)
 
 if args.visualise:
-  plt.plot(x, y, '.', xp, p(xp), '-')
+  import matplotlib.pyplot as plt
+  for data, (peak, position) in zip(spectra, positions):
+    datamax, left, y, p = pipeline.fit_zero_order(data, args.samplewidth,
+        args.maxx, args.degree)
+    x = np.arange(len(y))
+    xp = np.linspace(0, len(y), 100)
+    plt.plot(x, y, '.', xp, p(xp), '-')
+    plt.axvline(x=position - left, color='red')
   plt.show()
-
-header.update('CRVAL1', 0.0)
-header.update('CRPIX1', float(maxpos))
-header.update('CDELT1', args.spacing)
-header.update('CUNIT1', 'Angstrom')
-header.update('CTYPE1', 'Wavelength')
-pyfits.writeto(args.outfile, data.astype('int32'), header, output_verify='fix')
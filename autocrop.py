@@ -1,51 +1,66 @@
 #!/usr/bin/env python
-import pyfits
 import numpy as np
 import argparse
+import os
+import pipeline
+import fitsaccess
+import instrument
 
 parser = argparse.ArgumentParser(description='Automatically crop the binning area of a spectra')
-parser.add_argument('filename', type=str, help='FITS filename')
+parser.add_argument('filename', type=str, nargs='+', help='FITS filenames')
 parser.add_argument('--filterfactor', type=float, default=0.5,
     help='Factor for selecting the start of the crop area, based on the maximum binned value.')
 parser.add_argument('--padding', type=int, default=10,
     help='Number of rows to pad either side of the binning area.')
-parser.add_argument('--outfile', '-o', type=str, required=True)
+parser.add_argument('--outfile', '-o', type=str,
+    help='Output filename, for a single input file')
+parser.add_argument('--outdir', type=str,
+    help='Output directory, for one or more input files')
+parser.add_argument('--reference', type=str,
+    help='Reuse the crop area of this frame for frames whose band has not moved')
+parser.add_argument('--tolerance', type=int, default=2,
+    help='Rows the band may move from the reference before it is detected again (default: 2)')
 
 args = parser.parse_args()
 
-f = pyfits.open(args.filename)
-d = f[0].data
-header = f[0].header
-s = d.sum(axis=1)
+if bool(args.outfile) == bool(args.outdir):
+  parser.error('Specify one of --outfile or --outdir')
+if args.outfile and len(args.filename) > 1:
+  parser.error('--outfile can only be used with a single input file')
 
-maxima = s.max()
-filterfactor = args.filterfactor
-top = np.argmax(s>maxima*filterfactor)
-bottom = top + np.argmax(s[top:]<maxima*filterfactor)
+with instrument.stage('autocrop', args.filename[0]) as timer:
+  # Files are only open while their row profiles or crops are read, so any
+  # number can be cropped without running out of file descriptors
+  images = [fitsaccess.ImageFile(filename) for filename in args.filename]
+  reference = fitsaccess.ImageFile(args.reference) if args.reference \
+    else None
 
-print 'detected maxima: %d top: %d bottom: %d' % (maxima, top, bottom)
+  windows = pipeline.autocrop_frames(images, args.filterfactor, args.padding,
+      args.filename, reference, args.tolerance)
 
-top = top - args.padding
-bottom = bottom + args.padding
+  # Every band is detected together, so each output gets the batch total
+  timer.note(files=len(images))
+  history = timer.history()
 
-if top < 0:
-  print 'WARN: Crop extends past top of image'
-  top = 0
+  if args.outdir and not os.path.isdir(args.outdir):
+    os.makedirs(args.outdir)
 
-if bottom > d.shape[1]:
-  print 'WARN: Crop extends past bottom of image'
-  bottom = d.shape[1]
+  for filename, window in zip(args.filename, windows):
+    if window is None:
+      continue
+    top, bottom = window
+    with fitsaccess.open_image(filename) as image:
+      header = image.scaled_header()
+      cropped = image.rows(top, bottom)
+      dtype = image.input_dtype()
+    pipeline.set_crop_headers(header, top, bottom, args.filterfactor)
+    timer.add_history(header, history)
 
-crop_height = bottom - top
+    if args.outfile:
+      outfile = args.outfile
+    else:
+      outfile = os.path.join(args.outdir, os.path.basename(filename))
+    fitsaccess.write(outfile, cropped, header, dtype=dtype)
 
-print 'calculated crop %d rows (%d:%d) from %s' % (crop_height, top, bottom, args.filename)
-
-if crop_height <= args.padding * 2:
-  print 'ERR: %s has zero height area to crop' % (args.filename)
+if None in windows:
   exit(1)
-
-cropped = d[top:bottom]
-header.update('croptop', top, 'top of crop area in raw image')
-header.update('cropbot', bottom, 'bottom of crop area in raw image')
-header.update('cropfac', filterfactor, 'filterfactor for autocrop.py')
-pyfits.writeto(args.outfile, cropped, header, output_verify='fix')
@@ -0,0 +1,284 @@
+#! /usr/bin/env python
+#
+# Benchmark every reduction stage on synthetic frames and spectra.
+#
+#   bench_stages.py --size 640x480:8 --size 4096x4096:16 --json today.json
+#   bench_stages.py --compare yesterday.json
+#
+# Each stage runs in its own forked process so its peak memory can be
+# measured, and reports the median time over --repeat runs.
+#
+import pyfits
+import numpy as np
+import argparse
+import json
+import multiprocessing
+import os
+import platform
+import sys
+import time
+from StringIO import StringIO
+
+import calibration_library
+import colourize
+import instrument
+import pipeline
+import specreduce
+import stacking
+
+DEFAULT_SIZES = ['640x480:8', '1280x1024:16']
+
+
+def parse_size(size):
+  dimensions, bits = size.split(':') if ':' in size else (size, '16')
+  width, height = dimensions.split('x')
+  return int(width), int(height), int(bits)
+
+
+def storage_dtype(bits):
+  # Smallest unsigned type a camera with this bit depth stores pixels in
+  for size in (8, 16, 32):
+    if bits <= size:
+      return np.dtype('uint%d' % (size))
+  raise ValueError('%d bit pixels are not supported' % (bits))
+
+
+def synthetic_frame(width, height, bits, seed = 0):
+  # A horizontal spectrum band with a zero order peak near the left edge, a
+  # broad first order continuum with a few absorption lines, and noise.
+  random = np.random.RandomState(seed)
+  maximum = 2 ** bits - 1
+  columns = np.arange(width, dtype=float)
+  rows = np.arange(height, dtype=float)
+
+  zero_order = width // 10
+  profile = 0.9 * np.exp(-0.5 * ((columns - zero_order) / 1.5) ** 2)
+  continuum = np.exp(-0.5 * ((columns - width * 0.55) / (width * 0.2)) ** 2)
+  for line in (0.4, 0.5, 0.65, 0.8):
+    continuum *= 1 - 0.5 * np.exp(-0.5 * ((columns - width * line) / 3) ** 2)
+  profile += 0.5 * continuum * (columns > zero_order + 10)
+
+  band = np.exp(-0.5 * ((rows - height * 0.5) / 3) ** 2)
+  frame = np.outer(band, profile) * maximum * 0.8
+  frame += random.normal(maximum * 0.02, maximum * 0.005, frame.shape)
+  return frame.clip(0, maximum).astype(storage_dtype(bits))
+
+
+def synthetic_dark(width, height, bits, seed = 1):
+  random = np.random.RandomState(seed)
+  maximum = 2 ** bits - 1
+  dark = random.normal(maximum * 0.02, maximum * 0.002, (height, width))
+  return dark.clip(0, maximum).astype(storage_dtype(bits))
+
+
+def exptime_header(exptime = 30.0):
+  header = pyfits.Header()
+  header['EXPTIME'] = exptime
+  return header
+
+
+class Quiet:
+  # Silence the diagnostics the stages print
+
+  def __enter__(self):
+    self.stdout = sys.stdout
+    sys.stdout = open(os.devnull, 'w')
+
+  def __exit__(self, *args):
+    sys.stdout.close()
+    sys.stdout = self.stdout
+
+
+def prepare(width, height, bits, frames):
+  # Run the chain once to get the input of every stage
+  state = {}
+  state['frame'] = synthetic_frame(width, height, bits)
+  state['dark'] = synthetic_dark(width, height, bits)
+  state['spacing'] = 9000.0 / (width * 0.85)
+
+  library = calibration_library.CalibrationLibrary()
+  library.add(calibration_library.MasterFrame(
+    'dark', state['dark'], exptime_header()))
+  state['library'] = library
+
+  header = exptime_header()
+  with Quiet():
+    subtracted = library.calibrate(state['frame'], header)
+    cropped = pipeline.autocrop(subtracted, header, 0.95, 30)
+    binned = pipeline.bin_frame(cropped, header)
+    calibrated = pipeline.auto_calibrate(binned, header, state['spacing'])
+    calibrated_header = header.copy()
+    wavelength_cropped = pipeline.wavelength_crop(calibrated, header)
+
+  state.update({
+    'subtracted': subtracted,
+    'cropped': cropped,
+    'binned': binned,
+    'calibrated': calibrated,
+    'calibrated_header': calibrated_header,
+    'wavelength_cropped': wavelength_cropped,
+    'spectra_header': header,
+    'stack': [synthetic_frame(width, height, bits, seed) for seed in
+      range(frames)],
+  })
+  return state
+
+
+def quicklook(state):
+  import matplotlib
+  matplotlib.use('Agg')
+  import matplotlib.pyplot as plt
+
+  hdulist = pyfits.HDUList([pyfits.PrimaryHDU(
+    state['wavelength_cropped'], state['spectra_header'])])
+  spectra = specreduce.BessSpectra(hdulist)
+  image = specreduce.ImageSpectra(state['frame'])
+
+  figure = plt.figure()
+  graph = figure.add_subplot(211)
+  spectra.plot_onto(graph)
+  image.plot_image_onto(figure.add_subplot(212))
+  figure.savefig(StringIO(), format='png')
+  plt.close(figure)
+
+
+def stages(state):
+  frame_bytes = state['frame'].nbytes
+  stack_bytes = frame_bytes * len(state['stack'])
+  h = state['calibrated_header']
+
+  def running_stack():
+    stack = stacking.RunningStack()
+    for frame in state['stack']:
+      stack.add(frame)
+    return stack.mean()
+
+  # name, function, frames processed, bytes of input
+  return [
+    ('dark_subtract', lambda: state['library'].calibrate(
+      state['frame'], exptime_header()), 1, frame_bytes),
+    ('autocrop', lambda: pipeline.autocrop(
+      state['subtracted'], exptime_header(), 0.95, 30), 1,
+      state['subtracted'].nbytes),
+    ('bin', lambda: pipeline.bin_frame(
+      state['cropped'], exptime_header()), 1, state['cropped'].nbytes),
+    ('auto_calibrate', lambda: pipeline.auto_calibrate(
+      state['binned'], exptime_header(), state['spacing']), 1,
+      state['binned'].nbytes),
+    ('wavelength_crop', lambda: pipeline.wavelength_crop(
+      state['calibrated'], h.copy()), 1, state['calibrated'].nbytes),
+    ('normalise', lambda: pipeline.normalise(
+      state['wavelength_cropped'], exptime_header()), 1,
+      state['wavelength_cropped'].nbytes),
+    ('stack_mean', running_stack, len(state['stack']), stack_bytes),
+    ('stack_median', lambda: stacking.combine_array(
+      np.array(state['stack']), 'median'), len(state['stack']), stack_bytes),
+    ('colourize', lambda: colourize.colourize(
+      specreduce.calibration_from_header(state['spectra_header']).angstrom(
+        np.arange(len(state['wavelength_cropped']))),
+      state['wavelength_cropped'], 50), 1,
+      state['wavelength_cropped'].nbytes),
+    ('quicklook', lambda: quicklook(state), 1, frame_bytes),
+  ]
+
+
+def run_stage(function, repeat, queue):
+  before = instrument.peak_rss()
+  times = []
+  with Quiet():
+    for i in range(repeat):
+      start = time.time()
+      function()
+      times.append(time.time() - start)
+  peak = instrument.peak_rss()
+  queue.put((sorted(times), peak, peak - before))
+
+
+def bench_stage(name, function, frames, nbytes, repeat):
+  queue = multiprocessing.Queue()
+  process = multiprocessing.Process(target=run_stage,
+    args=(function, repeat, queue))
+  process.start()
+  times, peak, growth = queue.get()
+  process.join()
+
+  median = times[len(times) // 2]
+  return {
+    'stage': name,
+    'median': median,
+    'min': times[0],
+    'frames_per_second': frames / median if median else None,
+    'mb_per_second': nbytes / 2.0 ** 20 / median if median else None,
+    'peak_rss_mb': peak / 2.0 ** 20,
+    'rss_growth_mb': growth / 2.0 ** 20,
+  }
+
+
+def print_results(size, results, previous = None):
+  print
+  print '%s' % (size)
+  print '%-16s %10s %10s %10s %10s %10s' % (
+    'stage', 'median', 'frames/s', 'MB/s', 'peak MB', 'growth MB')
+  for r in results:
+    line = '%-16s %9.2fms %10.1f %10.1f %10.1f %10.1f' % (
+      r['stage'], r['median'] * 1000, r['frames_per_second'],
+      r['mb_per_second'], r['peak_rss_mb'], r['rss_growth_mb'])
+    if previous and r['stage'] in previous:
+      line += '  %+.0f%%' % (
+        (r['median'] / previous[r['stage']]['median'] - 1) * 100)
+    print line
+
+
+def environment():
+  return {
+    'python': platform.python_version(),
+    'numpy': np.__version__,
+    'platform': platform.platform(),
+    'processor': platform.processor(),
+    'cpus': multiprocessing.cpu_count(),
+    'time': time.strftime('%Y-%m-%dT%H:%M:%S'),
+  }
+
+
+if __name__ == '__main__':
+  parser = argparse.ArgumentParser(
+      description='Benchmark the reduction stages on synthetic data')
+  parser.add_argument('--size', '-s', type=str, action='append',
+      help='Frame size as WIDTHxHEIGHT:BITS, may be repeated (default: %s)'
+      % (' '.join(DEFAULT_SIZES)))
+  parser.add_argument('--repeat', '-r', type=int, default=5,
+      help='Number of runs of each stage (default: 5)')
+  parser.add_argument('--frames', '-f', type=int, default=20,
+      help='Number of frames to stack (default: 20)')
+  parser.add_argument('--stage', type=str, action='append',
+      help='Only run this stage, may be repeated')
+  parser.add_argument('--json', '-j', type=str,
+      help='Write the results to this JSON file')
+  parser.add_argument('--compare', '-c', type=str,
+      help='Show the change in median time from a previous JSON file')
+
+  args = parser.parse_args()
+
+  previous = {}
+  if args.compare:
+    with open(args.compare) as f:
+      for run in json.load(f)['runs']:
+        previous[run['size']] = dict((r['stage'], r) for r in run['results'])
+
+  runs = []
+  for size in args.size or DEFAULT_SIZES:
+    width, height, bits = parse_size(size)
+    state = prepare(width, height, bits, args.frames)
+    results = []
+    for name, function, frames, nbytes in stages(state):
+      if args.stage and name not in args.stage:
+        continue
+      results.append(bench_stage(name, function, frames, nbytes, args.repeat))
+    print_results(size, results, previous.get(size))
+    runs.append({'size': size, 'width': width, 'height': height,
+      'bits': bits, 'results': results})
+
+  if args.json:
+    with open(args.json, 'w') as f:
+      json.dump({'environment': environment(), 'repeat': args.repeat,
+        'frames': args.frames, 'runs': runs}, f, indent=2)
@@ -0,0 +1,94 @@
+#! /usr/bin/env python
+#
+# Measure the start up time of each command line tool, and the import time
+# of the library modules, by running them in a fresh interpreter.
+#
+import argparse
+import glob
+import json
+import os
+import subprocess
+import sys
+import time
+
+SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
+
+MODULES = ['specreduce', 'pipeline', 'stacking', 'resample',
+    'calibration_library']
+
+
+def entry_points():
+  # Every script with a shebang line and a command line parser, apart from
+  # the benchmarks themselves
+  scripts = []
+  for filename in sorted(glob.glob(os.path.join(SCRIPT_DIR, '*.py'))):
+    name = os.path.basename(filename)
+    if name.startswith('bench_') or name.startswith('test_'):
+      continue
+    with open(filename) as f:
+      source = f.read()
+    if source.startswith('#!') and 'argparse' in source:
+      scripts.append(name)
+  return scripts
+
+
+def time_command(command, repeat):
+  env = dict(os.environ)
+  env['PYTHONPATH'] = os.pathsep.join(
+    [SCRIPT_DIR] + [p for p in [env.get('PYTHONPATH')] if p])
+  env.setdefault('MPLBACKEND', 'Agg')
+  devnull = open(os.devnull, 'w')
+  times = []
+  for i in range(repeat):
+    start = time.time()
+    subprocess.call(command, stdout=devnull, stderr=devnull, env=env,
+      cwd=SCRIPT_DIR)
+    times.append(time.time() - start)
+  devnull.close()
+  return sorted(times)
+
+
+def summary(name, times):
+  return {
+    'name': name,
+    'min': times[0],
+    'median': times[len(times) // 2],
+    'max': times[-1],
+  }
+
+
+if __name__ == '__main__':
+  parser = argparse.ArgumentParser(
+      description='Benchmark start up time of the tools')
+  parser.add_argument('--repeat', '-r', type=int, default=5,
+      help='Number of runs of each command (default: 5)')
+  parser.add_argument('--python', type=str, default=sys.executable,
+      help='Python interpreter to run (default: this one)')
+  parser.add_argument('--json', '-j', type=str,
+      help='Also write the results to this JSON file')
+
+  args = parser.parse_args()
+
+  results = []
+
+  baseline = time_command([args.python, '-c', 'pass'], args.repeat)
+  results.append(summary('(interpreter)', baseline))
+
+  for module in MODULES:
+    times = time_command([args.python, '-c', 'import %s' % (module)],
+      args.repeat)
+    results.append(summary('import %s' % (module), times))
+
+  for script in entry_points():
+    times = time_command([args.python, script, '--help'], args.repeat)
+    results.append(summary('%s --help' % (script), times))
+
+  print '%-36s %8s %8s %8s' % ('command', 'min', 'median', 'max')
+  for result in results:
+    print '%-36s %7.0fms %7.0fms %7.0fms' % (result['name'],
+      result['min'] * 1000, result['median'] * 1000, result['max'] * 1000)
+
+  if args.json:
+    with open(args.json, 'w') as f:
+      json.dump({'python': args.python, 'repeat': args.repeat,
+        'results': results}, f, indent=2)
@@ -1,7 +1,9 @@
 #! /usr/bin/env python
-import pyfits
 import argparse
 import numpy as np
+import pipeline
+import fitsaccess
+import instrument
 
 parser = argparse.ArgumentParser(
     description='Bin a 2D spectra to 1D')
@@ -10,16 +12,18 @@ parser.add_argument('--outfile', '-o', type=str, help='Output filename',
     required=True)
 parser.add_argument('--skywidth', '-s', type=int, default=6,
     help='Width of area for sky subtraction')
+parser.add_argument('--dtype', type=str, default='float32',
+    choices=fitsaccess.OUTPUT_DTYPES,
+    help='Output data type (default: float32)')
 
 args = parser.parse_args()
 
-f = pyfits.open(args.filename)
-header = f[0].header
-data = f[0].data.sum(axis=0)
-print data
+with instrument.stage('bin', args.filename) as timer:
+  with fitsaccess.open_image(args.filename) as image:
+    header = image.scaled_header()
+    data = pipeline.bin_sums(image.column_sums(), image.rows(0, args.skywidth),
+        len(image), args.skywidth)
+  print data
 
-sky = np.mean(f[0].data[0:args.skywidth], axis = 0)
-sky *= (len(f[0].data) / args.skywidth)
-data -= sky
-
-pyfits.writeto(args.outfile, data.astype('int32'), header, output_verify='fix')
+  timer.add_history(header)
+  fitsaccess.write(args.outfile, data, header, dtype=args.dtype)
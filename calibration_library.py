@@ -0,0 +1,206 @@
+#! /usr/bin/env python
+#
+# Library of master dark and flat frames.  Masters are read once, kept in
+# memory and matched to each science frame by binning, temperature and
+# exposure time from the FITS headers.
+#
+import numpy as np
+import argparse
+import glob
+import hashlib
+import os
+import stacking
+import fitsaccess
+
+EXPTIME_KEYWORDS = ['EXPTIME', 'EXPOSURE']
+TEMPERATURE_KEYWORDS = ['CCD-TEMP', 'SET-TEMP']
+
+
+def header_value(header, keywords, default = None):
+  for keyword in keywords:
+    if keyword in header:
+      return float(header[keyword])
+  return default
+
+
+def binning(header):
+  return (int(header.get('XBINNING', 1)), int(header.get('YBINNING', 1)))
+
+
+def image_kind(header, default = 'dark'):
+  imagetyp = str(header.get('IMAGETYP', '')).upper()
+  if 'FLAT' in imagetyp:
+    return 'flat'
+  elif 'DARK' in imagetyp:
+    return 'dark'
+  return default
+
+
+class MasterFrame:
+
+  def __init__(self, kind, data, header, filename = None):
+    self.kind = kind
+    self.data = np.asarray(data, dtype=np.float32)
+    self.header = header
+    self.filename = filename
+    self.exptime = header_value(header, EXPTIME_KEYWORDS)
+    self.temperature = header_value(header, TEMPERATURE_KEYWORDS)
+    self.binning = binning(header)
+
+  def __repr__(self):
+    return '<Master %s: exptime: %s, temperature: %s, binning: %dx%d>' % (
+      self.kind, self.exptime, self.temperature,
+      self.binning[0], self.binning[1])
+
+
+class CalibrationLibrary:
+
+  temperature_tolerance = 2.0
+  scale_darks = True
+
+  def __init__(self):
+    self.masters = []
+    self._digest = None
+
+  def add(self, master):
+    self.masters.append(master)
+    self._digest = None
+
+  def digest(self):
+    # Hash of every master and the matching settings, which identifies the
+    # calibration applied to any frame
+    if self._digest is None:
+      sha = hashlib.sha1(repr((self.temperature_tolerance, self.scale_darks)))
+      for master in self.masters:
+        sha.update(repr((master.kind, master.exptime, master.temperature,
+          master.binning, master.data.shape)))
+        sha.update(np.ascontiguousarray(master.data).data)
+      self._digest = sha.hexdigest()
+    return self._digest
+
+  def add_file(self, filename, kind = None, default = 'dark'):
+    # Without a kind it is taken from IMAGETYP, or is default when IMAGETYP
+    # says neither dark nor flat
+    with fitsaccess.open_image(filename) as image:
+      header = image.scaled_header()
+      if kind is None:
+        kind = image_kind(header, default)
+      self.add(MasterFrame(kind, image.data(np.float32), header, filename))
+
+  def add_path(self, path, kind = 'dark'):
+    # Add a single master, or every FITS file in a directory with the kind
+    # taken from their IMAGETYP headers, falling back to kind
+    if os.path.isdir(path):
+      for filename in sorted(glob.glob(os.path.join(path, '*.fit*'))):
+        self.add_file(filename, default=kind)
+    else:
+      self.add_file(path, kind)
+
+  def candidates(self, kind, header, shape):
+    temperature = header_value(header, TEMPERATURE_KEYWORDS)
+    matches = []
+    for master in self.masters:
+      if master.kind != kind or master.data.shape != shape:
+        continue
+      if master.binning != binning(header):
+        continue
+      if temperature is not None and master.temperature is not None and \
+          abs(master.temperature - temperature) > self.temperature_tolerance:
+        continue
+      matches.append(master)
+    return matches
+
+  def find(self, kind, header, shape):
+    # The master closest in exposure time, then in temperature
+    matches = self.candidates(kind, header, shape)
+    if not matches:
+      return None
+    exptime = header_value(header, EXPTIME_KEYWORDS)
+    temperature = header_value(header, TEMPERATURE_KEYWORDS)
+
+    def distance(master):
+      return (
+        abs((master.exptime or 0.0) - (exptime or 0.0)),
+        abs((master.temperature or 0.0) - (temperature or 0.0))
+      )
+
+    return min(matches, key=distance)
+
+  def dark_for(self, header, shape):
+    # Returns the dark for a science frame, scaled to its exposure time when
+    # no master with the same exposure time exists.  Returns None if there
+    # is no usable dark.
+    master = self.find('dark', header, shape)
+    if master is None:
+      return None
+    exptime = header_value(header, EXPTIME_KEYWORDS)
+    if self.scale_darks and exptime and master.exptime and \
+        exptime != master.exptime:
+      return master.data * np.float32(exptime / master.exptime), master
+    return master.data, master
+
+  def calibrate(self, data, header, out = None):
+    # Dark subtract and flat field a science frame in float32, into out if
+    # given, which may be data itself
+    shape = np.shape(data)
+    match = self.dark_for(header, shape)
+    if match is None:
+      raise ValueError('No matching dark for frame')
+    dark, master = match
+    if out is None:
+      out = np.empty(shape, dtype=np.float32)
+    np.subtract(data, dark, out=out)
+    header.add_history('Dark subtracted with %s' % (master.filename or master))
+
+    flat = self.find('flat', header, shape)
+    if flat is not None:
+      np.divide(out, flat.data, out=out)
+      header.add_history('Flat fielded with %s' % (flat.filename or flat))
+
+    return out
+
+
+def build_master(kind, filenames, dark = None, method = 'median'):
+  # Combine raw calibration frames into a master.  Flats are dark subtracted
+  # with the given dark array and normalised to a mean of 1.
+  cube = stacking.FrameCube(filenames)
+  header = cube.output_header()
+  data = cube.combine(method).astype(np.float32)
+  cube.close()
+
+  # A master has the exposure time of its frames, not their sum
+  if 'EXPTIME' in cube.headers[0]:
+    header.update('EXPTIME', float(cube.headers[0]['EXPTIME']))
+  if kind == 'flat':
+    if dark is not None:
+      data -= dark
+    data /= data.mean()
+
+  header.update('IMAGETYP', 'Master %s' % (kind.capitalize()))
+  header.update('NCOMBINE', len(filenames), 'Number of frames combined')
+  return data, header
+
+
+if __name__ == '__main__':
+  parser = argparse.ArgumentParser(
+      description='Build a master dark or flat frame')
+  parser.add_argument('file', type=str, nargs='+')
+  parser.add_argument('--outfile', '-o', type=str, required=True)
+  parser.add_argument('--kind', '-k', type=str, default='dark',
+      choices=['dark', 'flat'], help='Type of master (default: dark)')
+  parser.add_argument('--dark', type=str,
+      help='Master dark to subtract from flat frames')
+  parser.add_argument('--method', type=str, default='median',
+      choices=stacking.COMBINE_METHODS, help='Combine method (default: median)')
+
+  args = parser.parse_args()
+
+  dark = None
+  if args.dark:
+    dark = fitsaccess.open_image(args.dark).data(np.float32)
+
+  data, header = build_master(args.kind, args.file, dark, args.method)
+
+  print 'Combined %d frames into master %s' % (len(args.file), args.kind)
+
+  fitsaccess.write(args.outfile, data, header)
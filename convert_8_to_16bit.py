@@ -1,9 +1,8 @@
 #! /usr/bin/env python
 
-import pyfits
+import fitsaccess
 import numpy as np
 import argparse
-import specreduce
 
 parser = argparse.ArgumentParser(description='Convert 8 to 16 bit fits')
 parser.add_argument('file', type=str)
@@ -11,9 +10,11 @@ parser.add_argument('--outfile', '-o', type=str, required=True)
 
 args = parser.parse_args()
 
-hdulist = pyfits.open(args.file)
-header = hdulist[0].header
+image = fitsaccess.open_image(args.file)
+header = image.scaled_header()
 
-data = hdulist[0].data.astype('uint16') * 256
+# Widened once on read and scaled in place
+data = image.data(np.uint16)
+data *= 256
 
-pyfits.writeto(args.outfile, data, header, output_verify = 'fix')
+fitsaccess.write(args.outfile, data, header)
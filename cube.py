@@ -0,0 +1,270 @@
+#! /usr/bin/env python
+#
+# A store for a monitoring campaign's reduced spectra, resampled onto one
+# wavelength grid and kept as the rows of a single memory mapped float32
+# array, with their headers in a SQLite table keyed by DATE-OBS.  A time
+# range and wavelength window of the whole campaign is then one read rather
+# than a file open per spectra.
+#
+#   cube.py create season.cube --min 6400 --max 6700 --step 0.5
+#   cube.py add season.cube reduced/*.fit
+#   cube.py export season.cube --after 2013-08-01 --min 6540 --max 6590 \
+#     --outdir halpha
+#
+# The store is a directory holding:
+#
+#   spectra.f32      rows of float32 flux, appended as spectra are added
+#   headers.sqlite   the grid, and each row's DATE-OBS and original header
+#
+# Grid pixels outside the wavelength range of a spectra are NaN.
+#
+import pyfits
+import numpy as np
+import argparse
+import os
+import sqlite3
+import fitsaccess
+import resample
+import specreduce
+
+DATA_NAME = 'spectra.f32'
+DATABASE_NAME = 'headers.sqlite'
+DTYPE = np.dtype(np.float32)
+
+
+def create(path, min, max, step):
+  # A new empty store with a grid from min to max angstrom
+  if os.path.exists(path):
+    raise IOError('%s already exists' % (path))
+  length = int(round((max - min) / step)) + 1
+  if length < 2:
+    raise ValueError('Grid %s to %s in steps of %s is empty' % (min, max, step))
+  os.makedirs(path)
+  open(os.path.join(path, DATA_NAME), 'wb').close()
+  connection = sqlite3.connect(os.path.join(path, DATABASE_NAME))
+  connection.execute(
+    'CREATE TABLE grid (crval1 REAL, cdelt1 REAL, length INTEGER)')
+  connection.execute('INSERT INTO grid VALUES (?, ?, ?)', (min, step, length))
+  connection.execute(
+    'CREATE TABLE spectra (date_obs TEXT PRIMARY KEY, row INTEGER UNIQUE, '
+    'path TEXT, header TEXT)')
+  connection.commit()
+  connection.close()
+  return SpectralCube(path)
+
+
+class SpectralCube:
+
+  def __init__(self, path):
+    self.path = path
+    database = os.path.join(path, DATABASE_NAME)
+    if not os.path.exists(database):
+      raise IOError('%s is not a spectral cube' % (path))
+    self.connection = sqlite3.connect(database)
+    self.start, self.step, self.length = self.connection.execute(
+      'SELECT crval1, cdelt1, length FROM grid').fetchone()
+    self.calibration = specreduce.SinglePointCalibration(
+      specreduce.CalibrationReference(0, self.start), self.step)
+    self._resamplers = {}
+    self._data = None
+
+  def __enter__(self):
+    return self
+
+  def __exit__(self, *args):
+    self.close()
+
+  def __len__(self):
+    return self.connection.execute('SELECT COUNT(*) FROM spectra').fetchone()[0]
+
+  def wavelengths(self):
+    return self.calibration.angstrom(np.arange(self.length))
+
+  def columns(self, min = None, max = None):
+    # Slice of the grid from min to max angstrom inclusive
+    left = 0
+    right = self.length
+    if min is not None:
+      left = int(np.ceil((min - self.start) / self.step - 1e-9))
+    if max is not None:
+      right = int(np.floor((max - self.start) / self.step + 1e-9)) + 1
+    return slice(np.clip(left, 0, self.length), np.clip(right, 0, self.length))
+
+  def resampled(self, spectra):
+    # Flux of a BessSpectra on the grid, NaN outside its wavelengths
+    key = resample.calibration_key(spectra)
+    if key not in self._resamplers:
+      wavelengths = spectra.wavelengths()
+      grid = self.wavelengths()
+      self._resamplers[key] = (resample.Resampler(wavelengths, grid),
+        (grid < wavelengths.min()) | (grid > wavelengths.max()))
+    resampler, outside = self._resamplers[key]
+    data = resampler.apply(spectra.data()).astype(DTYPE)
+    data[outside] = np.nan
+    return data
+
+  def add(self, filenames):
+    # Append the spectra in filenames, skipping those whose DATE-OBS is
+    # already stored.  Returns the number added.
+    row = len(self)
+    added = 0
+    data_file = open(os.path.join(self.path, DATA_NAME), 'r+b')
+    try:
+      # Anything past the last stored row is left from an interrupted add
+      data_file.seek(row * self.length * DTYPE.itemsize)
+      for filename in filenames:
+        spectra = specreduce.BessSpectra(pyfits.open(filename))
+        try:
+          header = spectra.header()
+          if 'DATE-OBS' not in header:
+            print 'WARN: %s: no DATE-OBS, skipping' % (filename)
+            continue
+          if self.connection.execute(
+              'SELECT 1 FROM spectra WHERE date_obs = ?',
+              (header['DATE-OBS'],)).fetchone():
+            continue
+          data_file.write(self.resampled(spectra).tostring())
+          self.connection.execute('INSERT INTO spectra VALUES (?, ?, ?, ?)',
+            (header['DATE-OBS'], row, os.path.abspath(filename),
+            header.tostring()))
+        finally:
+          spectra.hdulist.close()
+        row += 1
+        added += 1
+      data_file.truncate()
+    finally:
+      data_file.close()
+    self.connection.commit()
+    self._data = None
+    return added
+
+  def data(self):
+    # Every stored row, memory mapped
+    if self._data is None:
+      rows = len(self)
+      if rows == 0:
+        return np.empty((0, self.length), dtype=DTYPE)
+      self._data = np.memmap(os.path.join(self.path, DATA_NAME), dtype=DTYPE,
+        mode='r', shape=(rows, self.length))
+    return self._data
+
+  def rows(self, after = None, before = None):
+    # Rows with DATE-OBS from after up to before, and their DATE-OBS, in
+    # DATE-OBS order
+    conditions = []
+    values = []
+    for condition, value in [
+        ('date_obs >= ?', after),
+        ('date_obs < ?', before)]:
+      if value is not None:
+        conditions.append(condition)
+        values.append(value)
+
+    sql = 'SELECT row, date_obs FROM spectra'
+    if conditions:
+      sql += ' WHERE ' + ' AND '.join(conditions)
+    sql += ' ORDER BY date_obs'
+    selected = self.connection.execute(sql, values).fetchall()
+    return [row for row, _ in selected], [date for _, date in selected]
+
+  def query(self, after = None, before = None, min = None, max = None):
+    # DATE-OBS values, wavelengths and a 2D array of flux for a time range
+    # and wavelength window.  Rows added in time order are read as one
+    # contiguous slice.
+    rows, dates = self.rows(after, before)
+    columns = self.columns(min, max)
+    data = self.data()
+    if rows and rows == range(rows[0], rows[-1] + 1):
+      flux = data[rows[0]:rows[-1] + 1, columns]
+    else:
+      flux = data[rows][:, columns]
+    return dates, self.wavelengths()[columns], np.array(flux)
+
+  def header(self, date_obs):
+    (header,) = self.connection.execute(
+      'SELECT header FROM spectra WHERE date_obs = ?', (date_obs,)).fetchone()
+    return pyfits.Header.fromstring(header)
+
+  def export(self, date_obs, flux, columns, filename, compression = None):
+    # Write one row of a query as a BESS FITS file with its original header
+    # and a calibration for the wavelength window
+    header = self.header(date_obs)
+    header.update('CRVAL1', self.calibration.angstrom(columns.start + 1))
+    header.update('CRPIX1', 1.0)
+    header.update('CDELT1', self.step)
+    header.update('CUNIT1', 'Angstrom')
+    header.update('CTYPE1', 'Wavelength')
+    fitsaccess.write(filename, flux, header, compression, clobber=True)
+
+  def close(self):
+    self._data = None
+    self.connection.close()
+
+
+def export_filename(date_obs):
+  return date_obs.replace(':', '') + '.fit'
+
+
+if __name__ == '__main__':
+  parser = argparse.ArgumentParser(
+      description='Store spectra on a common wavelength grid for fast queries')
+  subparsers = parser.add_subparsers(dest='command')
+
+  create_parser = subparsers.add_parser('create', help='Create an empty store')
+  create_parser.add_argument('cube', type=str)
+  create_parser.add_argument('--min', type=float, default=3800,
+      help='First wavelength of the grid (default: 3800)')
+  create_parser.add_argument('--max', type=float, default=8000,
+      help='Last wavelength of the grid (default: 8000)')
+  create_parser.add_argument('--step', type=float, required=True,
+      help='Grid spacing in angstrom')
+
+  add_parser = subparsers.add_parser('add',
+      help='Resample and append reduced spectra')
+  add_parser.add_argument('cube', type=str)
+  add_parser.add_argument('file', type=str, nargs='+')
+
+  info_parser = subparsers.add_parser('info',
+      help='Print the grid and DATE-OBS range')
+  info_parser.add_argument('cube', type=str)
+
+  export_parser = subparsers.add_parser('export',
+      help='Write a time range and wavelength window as BESS FITS files')
+  export_parser.add_argument('cube', type=str)
+  export_parser.add_argument('--after', type=str,
+      help='Earliest DATE-OBS, e.g. 2013-08-01 or 2013-08-01T20:00:00')
+  export_parser.add_argument('--before', type=str, help='DATE-OBS before this')
+  export_parser.add_argument('--min', type=float, help='Minimum angstrom value')
+  export_parser.add_argument('--max', type=float, help='Maximum angstrom value')
+  export_parser.add_argument('--outdir', '-o', type=str, default='.',
+      help='Directory for the exported files (default: .)')
+  export_parser.add_argument('--compress', type=str,
+      choices=fitsaccess.COMPRESSION_MODES,
+      help='Tile compress the output (default: $%s or none)' % (
+        fitsaccess.COMPRESSION_ENVIRONMENT))
+
+  args = parser.parse_args()
+
+  if args.command == 'create':
+    create(args.cube, args.min, args.max, args.step).close()
+  else:
+    with SpectralCube(args.cube) as cube:
+      if args.command == 'add':
+        print 'Added %d of %d spectra' % (cube.add(args.file), len(args.file))
+      elif args.command == 'info':
+        rows, dates = cube.rows()
+        print '%d spectra on %d pixels from %.2f to %.2f step %.3f' % (
+          len(rows), cube.length, cube.start,
+          cube.wavelengths()[-1], cube.step)
+        if dates:
+          print 'DATE-OBS %s to %s' % (dates[0], dates[-1])
+      else:
+        dates, wavelengths, flux = cube.query(args.after, args.before,
+          args.min, args.max)
+        columns = cube.columns(args.min, args.max)
+        if not os.path.isdir(args.outdir):
+          os.makedirs(args.outdir)
+        for date_obs, row in zip(dates, flux):
+          cube.export(date_obs, row, columns,
+            os.path.join(args.outdir, export_filename(date_obs)), args.compress)
+        print 'Exported %d spectra' % (len(dates))
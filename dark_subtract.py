@@ -1,26 +1,38 @@
 #! /usr/bin/env python
 
-import pyfits
 import numpy as np
 import argparse
+import pipeline
+import fitsaccess
+import instrument
 
 parser = argparse.ArgumentParser(description='Dark subtract FITS file')
-parser.add_argument('dark', type=str)
+parser.add_argument('dark', type=str,
+    help='Master dark, or a directory of master darks and flats')
 parser.add_argument('file', type=str)
 parser.add_argument('--outfile', '-o', type=str, required=True)
+parser.add_argument('--flat', type=str,
+    help='Master flat to divide by, or a directory of master flats')
+parser.add_argument('--dtype', type=str, default='input',
+    choices=['input'] + fitsaccess.OUTPUT_DTYPES,
+    help='Output data type, negative values are clipped for unsigned types '
+      '(default: same as the input frame)')
 
 args = parser.parse_args()
 
-f = pyfits.open(args.file)
-data = f[0].data.astype('int16')
-header = f[0].header
+with instrument.stage('dark_subtract', args.file) as timer:
+  library = pipeline.load_library(args.dark, args.flat)
 
-if args.dark:
-  dark = pyfits.getdata(args.dark).astype('int16')
-  subtracted = np.subtract(data, dark)
-  # Replace all negative values with 0
-  subtracted = subtracted.clip(0, 255)
+  with fitsaccess.open_image(args.file) as image:
+    header = image.scaled_header()
+    data = image.data(fitsaccess.WORKING_DTYPE)
+    dtype = fitsaccess.output_dtype(image.input_dtype(), args.dtype)
 
-pyfits.writeto(
-  args.outfile, subtracted.astype(np.uint8), header, output_verify='fix'
-)
+  try:
+    subtracted = library.calibrate(data, header, out=data)
+  except ValueError as e:
+    print 'ERR: %s: %s' % (args.file, e)
+    exit(1)
+
+  timer.add_history(header)
+  fitsaccess.write(args.outfile, subtracted, header, dtype=dtype)
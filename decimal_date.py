@@ -1,5 +1,5 @@
 #! /usr/bin/env python
-import pyfits
+import fitsaccess
 import argparse
 import dateutil.parser
 
@@ -11,9 +11,7 @@ parser.add_argument('--keyword', '-k', type=str, default='DATE-OBS',
 
 args = parser.parse_args()
 
-f = pyfits.open(args.filename)
-
-header = f[0].header
+header = fitsaccess.header(args.filename)
 timestamp = dateutil.parser.parse(header[args.keyword])
 
 month = timestamp.strftime('%b')
@@ -0,0 +1,151 @@
+#
+# Shape preserving downsampling of spectra for plotting.  A trace only needs
+# about as many points as the axes are wide in pixels, so long or many
+# overlaid spectra are reduced to that before being handed to matplotlib,
+# and reduced again from the full data whenever the x limits change.
+#
+import numpy as np
+
+METHODS = ['minmax', 'lttb', 'none']
+
+# Points kept per pixel of axes width, two buckets of a low and a high point
+# for minmax
+POINTS_PER_PIXEL = 4
+
+
+def minmax(x, y, buckets):
+  # The lowest and highest point of each of buckets equal slices, in x
+  # order, so the drawn envelope matches the full resolution line.
+  n = len(y)
+  if buckets < 1 or n <= 2 * buckets:
+    return x, y
+  size = -(-n // buckets)
+  buckets = -(-n // size)
+  padded = np.empty(buckets * size, dtype=y.dtype)
+  padded[:n] = y
+  padded[n:] = y[-1]
+  padded = padded.reshape(buckets, size)
+
+  start = np.arange(buckets) * size
+  low = start + padded.argmin(axis=1)
+  high = start + padded.argmax(axis=1)
+  index = np.sort(np.column_stack((low, high)), axis=1).ravel()
+  index = np.minimum(index, n - 1)
+  return x[index], y[index]
+
+
+def lttb(x, y, threshold):
+  # Largest triangle three buckets: keeps the first and last points and
+  # from each bucket between them the point forming the largest triangle
+  # with the point kept from the previous bucket and the mean of the next.
+  n = len(y)
+  if threshold < 3 or n <= threshold:
+    return x, y
+  x = np.asarray(x, dtype=float)
+  y = np.asarray(y, dtype=float)
+  edges = (np.linspace(1, n - 1, threshold - 1)).astype(int)
+
+  # Means of every bucket, with the last point as the final "bucket"
+  counts = np.append(np.diff(edges), 1)
+  means_x = np.add.reduceat(x, edges) / counts
+  means_y = np.add.reduceat(y, edges) / counts
+  means_x[-1] = x[-1]
+  means_y[-1] = y[-1]
+
+  index = np.empty(threshold, dtype=int)
+  index[0] = 0
+  index[-1] = n - 1
+  previous = 0
+  for i in range(threshold - 2):
+    left, right = edges[i], edges[i + 1]
+    area = np.abs(
+      (x[previous] - means_x[i + 1]) * (y[left:right] - y[previous]) -
+      (x[previous] - x[left:right]) * (means_y[i + 1] - y[previous]))
+    previous = left + area.argmax()
+    index[i + 1] = previous
+  return x[index], y[index]
+
+
+def downsample(x, y, points, method = 'minmax'):
+  if method == 'minmax':
+    return minmax(x, y, points // 2)
+  elif method == 'lttb':
+    return lttb(x, y, points)
+  elif method == 'none':
+    return x, y
+  raise ValueError('Unknown downsampling method %s' % (method))
+
+
+def visible(x, left, right):
+  # Slice of the sorted x values between left and right, with one point
+  # either side so the line runs to the edges of the axes
+  if len(x) < 2 or x[0] > x[-1]:
+    return slice(None)
+  start = max(np.searchsorted(x, left) - 1, 0)
+  stop = np.searchsorted(x, right, side='right') + 1
+  return slice(start, stop)
+
+
+def axes_width(axes):
+  return int(axes.get_window_extent().width)
+
+
+def interactive_backend():
+  # Whether figures are drawn on a window that can be resized and zoomed
+  import matplotlib
+  import matplotlib.rcsetup
+  return matplotlib.get_backend().lower() not in \
+    [backend.lower() for backend in matplotlib.rcsetup.non_interactive_bk]
+
+
+class DownsampledLine:
+  # A line on axes drawn from a downsampled copy of x, y that is rebuilt for
+  # the visible range whenever the x limits change.
+
+  def __init__(self, axes, x, y, method = 'minmax', **plot_args):
+    self.axes = axes
+    self.x = np.asarray(x)
+    self.y = np.asarray(y)
+    self.method = method
+    self.line, = axes.plot(*self.points(None), **plot_args)
+    # Functions rather than bound methods, which the callback registries
+    # would only hold weakly
+    axes.callbacks.connect('xlim_changed', lambda axes: self.update())
+    # The canvas outlives its axes when a figure is cleared and drawn again,
+    # so the resize callback disconnects itself once the line is gone.  It
+    # is not needed at all where the canvas is never resized.
+    self.resize_id = None
+    if interactive_backend():
+      self.resize_id = axes.figure.canvas.mpl_connect('resize_event',
+        lambda event: self.resized())
+
+  def points(self, xlim):
+    if xlim is None:
+      section = slice(None)
+    else:
+      section = visible(self.x, *sorted(xlim))
+    return downsample(self.x[section], self.y[section],
+      POINTS_PER_PIXEL * axes_width(self.axes), self.method)
+
+  def update(self):
+    self.line.set_data(*self.points(self.axes.get_xlim()))
+
+  def resized(self):
+    if self.line not in self.axes.lines or \
+        self.axes not in self.axes.figure.axes:
+      self.axes.figure.canvas.mpl_disconnect(self.resize_id)
+    else:
+      self.update()
+
+
+def decimate_image(data, max_pixels):
+  # Block means of an image with at most max_pixels pixels, and the block
+  # size.  Partial blocks at the right and bottom edges are dropped.
+  factor = int(np.ceil(np.sqrt(float(data.size) / max_pixels)))
+  if factor <= 1:
+    return data, 1
+  rows = data.shape[0] // factor
+  columns = data.shape[1] // factor
+  blocks = np.asarray(data[:rows * factor, :columns * factor], dtype=float)
+  blocks = blocks.reshape(rows, factor, columns, factor)
+  return blocks.mean(axis=3).mean(axis=1), factor
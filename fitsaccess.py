@@ -0,0 +1,223 @@
+#
+# Memory mapped access to FITS images shared by the reduction tools.  Files
+# are opened unscaled, so reading a row band or a column range only pages
+# in those bytes, and BSCALE/BZERO are applied to the section read rather
+# than pyfits scaling the whole image on first access.
+#
+#   with fitsaccess.open_image(filename) as image:
+#     band = image.rows(458, 520)
+#
+# Images may also be tile compressed, in which case they are stored in the
+# first extension.  write() compresses its output when asked to, or when
+# the SPECREDUCE_COMPRESS environment variable is set, to one of:
+#
+#   none      uncompressed (the default)
+#   lossless  Rice for integer data, GZIP for floating point data
+#   quantize  as lossless, but floating point spectra are quantized to
+#             QUANTIZE_LEVEL levels per standard deviation of their noise
+#             before compression
+#
+# The reduction stages work in WORKING_DTYPE.  Frames are converted to it
+# once when read and the stages update their buffers in place, and the type
+# written is chosen with write(dtype=...), one of OUTPUT_DTYPES.  Frame
+# stages default to writing the input frame's type, see output_dtype().
+#
+import pyfits
+import numpy as np
+import os
+
+COMPRESSION_ENVIRONMENT = 'SPECREDUCE_COMPRESS'
+COMPRESSION_MODES = ['none', 'lossless', 'quantize']
+QUANTIZE_LEVEL = 16.0
+
+WORKING_DTYPE = np.dtype(np.float32)
+OUTPUT_DTYPES = ['float32', 'float64', 'int32', 'int16', 'uint16', 'uint8']
+
+
+def image_hdu(hdulist):
+  # The image is in the primary HDU, or the first extension when compressed
+  if hdulist[0].header.get('NAXIS', 0) == 0 and len(hdulist) > 1 and \
+      isinstance(hdulist[1], pyfits.CompImageHDU):
+    return hdulist[1]
+  return hdulist[0]
+
+
+def header(filename):
+  # Image header only, without reading any data
+  hdulist = pyfits.open(filename)
+  try:
+    return image_hdu(hdulist).header
+  finally:
+    hdulist.close()
+
+
+def open_image(filename, memmap = True):
+  # Compressed images are decompressed as a whole when first read
+  hdulist = pyfits.open(filename, memmap=memmap, do_not_scale_image_data=True)
+  return FitsImage(image_hdu(hdulist), hdulist, filename)
+
+
+def compression_mode(compression = None):
+  mode = compression or os.environ.get(COMPRESSION_ENVIRONMENT) or 'none'
+  if mode not in COMPRESSION_MODES:
+    raise ValueError('Unknown compression %s, expected one of %s' % (
+      mode, ', '.join(COMPRESSION_MODES)))
+  return mode
+
+
+def compressed_hdu(data, header, mode):
+  # CompImageHDU needs a complete image header to start from
+  header = pyfits.ImageHDU(header=header).header
+  if data.dtype.kind in 'iu':
+    if data.dtype == np.uint8:
+      # pyfits reads compressed 8 bit images back as signed
+      data = data.astype(np.int16)
+    return pyfits.CompImageHDU(data, header, compression_type='RICE_1')
+  # Only 1D spectra are quantized.  Frames often have flat rows which can't
+  # be quantized, and pyfits can't read back the tiles cfitsio then writes.
+  quantize_level = 0.0
+  if mode == 'quantize' and data.ndim == 1:
+    quantize_level = QUANTIZE_LEVEL
+  return pyfits.CompImageHDU(data, header, compression_type='GZIP_1',
+    quantize_level=quantize_level)
+
+
+def cast_to(data, dtype):
+  # Round and clip into the range of integer types rather than wrapping
+  dtype = np.dtype(dtype)
+  if data.dtype == dtype:
+    return data
+  if dtype.kind in 'iu':
+    info = np.iinfo(dtype)
+    return np.rint(data).clip(info.min, info.max).astype(dtype)
+  return data.astype(dtype)
+
+
+def output_dtype(input_dtype, name = 'input'):
+  # 'input' keeps the type the frame was read as, see FitsImage.input_dtype()
+  if name == 'input':
+    return np.dtype(input_dtype)
+  return np.dtype(name)
+
+
+def write(filename, data, header = None, compression = None, clobber = False,
+    dtype = None):
+  mode = compression_mode(compression)
+  if dtype is not None:
+    data = cast_to(data, dtype)
+  if mode == 'none':
+    pyfits.writeto(filename, data, header, output_verify='fix',
+      clobber=clobber)
+  else:
+    hdulist = pyfits.HDUList([pyfits.PrimaryHDU(),
+      compressed_hdu(data, header, mode)])
+    hdulist.writeto(filename, output_verify='fix', clobber=clobber)
+
+
+class FitsImage:
+
+  def __init__(self, hdu, hdulist = None, filename = None):
+    self.hdulist = hdulist
+    self.filename = filename
+    self.header = hdu.header
+    self.raw = hdu.data
+    self.shape = self.raw.shape
+    self.bscale = self.header.get('BSCALE', 1)
+    self.bzero = self.header.get('BZERO', 0)
+
+  def __enter__(self):
+    return self
+
+  def __exit__(self, *args):
+    self.close()
+
+  def __len__(self):
+    return self.shape[0]
+
+  def scaled(self):
+    return self.bscale != 1 or self.bzero != 0
+
+  def dtype(self):
+    # The type pyfits gives the scaled data
+    if not self.scaled():
+      return self.raw.dtype
+    return np.dtype(np.float32 if self.raw.dtype.itemsize <= 2 else np.float64)
+
+  def input_dtype(self):
+    # The type of the values the file holds.  Unsigned 16 and 32 bit data is
+    # stored as signed with a BZERO offset, and other scaled data is taken
+    # as float32.
+    dtype = self.raw.dtype
+    if not self.scaled():
+      return dtype
+    elif self.bscale == 1 and dtype.kind == 'i' and \
+        self.bzero == 2 ** (dtype.itemsize * 8 - 1):
+      return np.dtype('uint%d' % (dtype.itemsize * 8))
+    return np.dtype(np.float32)
+
+  def scaled_header(self):
+    # A copy of the header describing the scaled data
+    header = self.header.copy()
+    for keyword in ('BSCALE', 'BZERO'):
+      if keyword in header:
+        del header[keyword]
+    return header
+
+  def _scale(self, section, dtype):
+    if dtype is None:
+      dtype = self.dtype()
+    section = np.array(section, dtype=dtype)
+    if self.bscale != 1:
+      section *= self.bscale
+    if self.bzero != 0:
+      section += self.bzero
+    return section
+
+  def section(self, rows = slice(None), columns = slice(None), dtype = None):
+    # rows is ignored for 1D spectra
+    if self.raw.ndim == 1:
+      return self._scale(self.raw[columns], dtype)
+    return self._scale(self.raw[rows, columns], dtype)
+
+  def rows(self, top = None, bottom = None, dtype = None):
+    return self.section(slice(top, bottom), dtype=dtype)
+
+  def columns(self, left = None, right = None, dtype = None):
+    return self.section(columns=slice(left, right), dtype=dtype)
+
+  def data(self, dtype = None):
+    return self.section(dtype=dtype)
+
+  def sums(self, axis, top = None, bottom = None):
+    # Sums of the scaled data along an axis of rows top:bottom, computed
+    # from the raw values without a scaled copy of the image
+    raw = self.raw[top:bottom]
+    if not self.scaled():
+      return raw.sum(axis=axis)
+    sums = raw.sum(axis=axis, dtype=np.float64)
+    sums *= self.bscale
+    sums += self.bzero * raw.shape[axis]
+    return sums
+
+  def row_profile(self, top = None, bottom = None):
+    return self.sums(1, top, bottom)
+
+  def column_sums(self, top = None, bottom = None):
+    return self.sums(0, top, bottom)
+
+  def close(self):
+    if self.hdulist is not None:
+      self.hdulist.close()
+
+
+class ImageFile:
+  # Row profiles of an image file, opening it only for each read, so any
+  # number of files can be worked through without holding a file descriptor
+  # for each
+
+  def __init__(self, filename):
+    self.filename = filename
+
+  def row_profile(self, top = None, bottom = None):
+    with open_image(self.filename) as image:
+      return image.row_profile(top, bottom)
@@ -0,0 +1,161 @@
+#! /usr/bin/env python
+#
+# Index the primary headers of every FITS file under a directory in a SQLite
+# database, so frames can be selected without opening them.
+#
+#   header_index.py scan /data/spectra
+#   header_index.py query --object Fomalhaut --after 2013-08-01 | \
+#     xargs stack.py -o stacked.fit
+#
+import fitsaccess
+import argparse
+import os
+import sys
+import sqlite3
+
+DEFAULT_DATABASE = 'headers.sqlite'
+EXTENSIONS = ('.fit', '.fits', '.fts')
+
+# FITS keyword and the column it is stored in
+KEYWORDS = [
+  ('DATE-OBS', 'date_obs', 'TEXT'),
+  ('EXPTIME', 'exptime', 'REAL'),
+  ('OBJECT', 'object', 'TEXT'),
+  ('IMAGETYP', 'imagetyp', 'TEXT'),
+  ('NAXIS', 'naxis', 'INTEGER'),
+  ('NAXIS1', 'naxis1', 'INTEGER'),
+  ('NAXIS2', 'naxis2', 'INTEGER'),
+  ('CRPIX1', 'crpix1', 'REAL'),
+  ('CRVAL1', 'crval1', 'REAL'),
+  ('CDELT1', 'cdelt1', 'REAL'),
+  ('CCD-TEMP', 'ccd_temp', 'REAL'),
+]
+
+
+def connect(database):
+  connection = sqlite3.connect(database)
+  columns = ', '.join('%s %s' % (column, kind) for _, column, kind in KEYWORDS)
+  connection.execute(
+    'CREATE TABLE IF NOT EXISTS frames '
+    '(path TEXT PRIMARY KEY, size INTEGER, mtime REAL, %s)' % (columns))
+  connection.execute(
+    'CREATE INDEX IF NOT EXISTS frames_date_obs ON frames (date_obs)')
+  return connection
+
+
+def fits_files(root):
+  for directory, dirnames, filenames in os.walk(root):
+    dirnames.sort()
+    for filename in sorted(filenames):
+      if filename.lower().endswith(EXTENSIONS):
+        yield os.path.abspath(os.path.join(directory, filename))
+
+
+def header_row(path, stat):
+  header = fitsaccess.header(path)
+  return [path, stat.st_size, stat.st_mtime] + \
+    [header.get(keyword) for keyword, _, _ in KEYWORDS]
+
+
+def scan(connection, root):
+  # Add new and changed files, and remove files that no longer exist.
+  # Returns the number of files (re)indexed and removed.
+  known = dict(
+    (path, (size, mtime)) for path, size, mtime in
+    connection.execute('SELECT path, size, mtime FROM frames')
+  )
+  placeholders = ', '.join(['?'] * (len(KEYWORDS) + 3))
+  indexed = 0
+  seen = set()
+
+  for path in fits_files(root):
+    seen.add(path)
+    stat = os.stat(path)
+    if known.get(path) == (stat.st_size, stat.st_mtime):
+      continue
+    try:
+      row = header_row(path, stat)
+    except (IOError, ValueError) as e:
+      print 'WARN: %s: %s' % (path, e)
+      continue
+    connection.execute(
+      'INSERT OR REPLACE INTO frames VALUES (%s)' % (placeholders), row)
+    indexed += 1
+
+  prefix = os.path.join(os.path.abspath(root), '')
+  removed = [(path,) for path in known
+    if path.startswith(prefix) and path not in seen]
+  connection.executemany('DELETE FROM frames WHERE path = ?', removed)
+  connection.commit()
+  return indexed, len(removed)
+
+
+def query(connection, object = None, after = None, before = None,
+    exptime_min = None, exptime_max = None, crval1_min = None,
+    crval1_max = None, naxis = None, where = None):
+  conditions = []
+  values = []
+  for condition, value in [
+      ('object = ?', object),
+      ('date_obs >= ?', after),
+      ('date_obs < ?', before),
+      ('exptime >= ?', exptime_min),
+      ('exptime <= ?', exptime_max),
+      ('crval1 >= ?', crval1_min),
+      ('crval1 <= ?', crval1_max),
+      ('naxis = ?', naxis)]:
+    if value is not None:
+      conditions.append(condition)
+      values.append(value)
+  if where:
+    conditions.append('(%s)' % (where))
+
+  sql = 'SELECT path FROM frames'
+  if conditions:
+    sql += ' WHERE ' + ' AND '.join(conditions)
+  sql += ' ORDER BY date_obs, path'
+  return [path for (path,) in connection.execute(sql, values)]
+
+
+if __name__ == '__main__':
+  parser = argparse.ArgumentParser(
+      description='Index FITS headers and select frames from the index')
+  parser.add_argument('--database', '-d', type=str, default=DEFAULT_DATABASE,
+      help='SQLite database (default: %s)' % (DEFAULT_DATABASE))
+  subparsers = parser.add_subparsers(dest='command')
+
+  scan_parser = subparsers.add_parser('scan',
+      help='Index new and changed files under directories')
+  scan_parser.add_argument('directory', type=str, nargs='+')
+
+  query_parser = subparsers.add_parser('query',
+      help='Print the paths of matching frames, ordered by DATE-OBS')
+  query_parser.add_argument('--object', type=str, help='OBJECT header value')
+  query_parser.add_argument('--after', type=str,
+      help='Earliest DATE-OBS, e.g. 2013-08-01 or 2013-08-01T20:00:00')
+  query_parser.add_argument('--before', type=str, help='DATE-OBS before this')
+  query_parser.add_argument('--exptime-min', type=float)
+  query_parser.add_argument('--exptime-max', type=float)
+  query_parser.add_argument('--crval1-min', type=float)
+  query_parser.add_argument('--crval1-max', type=float)
+  query_parser.add_argument('--naxis', type=int,
+      help='1 for spectra, 2 for images')
+  query_parser.add_argument('--where', type=str,
+      help='Extra SQL condition, e.g. "ccd_temp < -10"')
+  query_parser.add_argument('--null', '-0', action='store_true',
+      help='Separate paths with NUL characters, for xargs -0')
+
+  args = parser.parse_args()
+
+  connection = connect(args.database)
+
+  if args.command == 'scan':
+    for directory in args.directory:
+      indexed, removed = scan(connection, directory)
+      print '%s: indexed %d files, removed %d' % (directory, indexed, removed)
+  else:
+    paths = query(connection, args.object, args.after, args.before,
+      args.exptime_min, args.exptime_max, args.crval1_min, args.crval1_max,
+      args.naxis, args.where)
+    separator = '\0' if args.null else '\n'
+    sys.stdout.write(''.join(path + separator for path in paths))
@@ -0,0 +1,178 @@
+#! /usr/bin/env python
+#
+# Per stage timing and resource instrumentation.
+#
+#   with instrument.stage('autocrop', filename) as timer:
+#     ...
+#     timer.add_history(header)
+#     pyfits.writeto(outfile, data, header)
+#
+# Each stage records wall and CPU time, bytes read and written and peak RSS.
+# add_history() writes the figures so far as a HISTORY card, with io giving
+# the bytes read/written, and when the SPECREDUCE_LOG environment variable
+# names a file the complete record, including the final write, is appended
+# to it as a JSON line.  Tools that process a batch of files in one stage
+# note files=N and give every output the same batch total from history().
+#
+#   instrument.py report reduction.jsonl
+#
+import argparse
+import json
+import os
+import resource
+import sys
+import time
+
+LOG_ENVIRONMENT = 'SPECREDUCE_LOG'
+
+_log = os.environ.get(LOG_ENVIRONMENT)
+_active = []
+
+
+def set_log(path):
+  global _log
+  _log = path
+
+
+def io_counters():
+  # Bytes read and written by this process, from /proc on Linux
+  try:
+    with open('/proc/self/io') as f:
+      counters = dict(line.split(':') for line in f)
+    return int(counters['rchar']), int(counters['wchar'])
+  except (IOError, KeyError, ValueError):
+    return None, None
+
+
+def peak_rss():
+  # ru_maxrss is in kilobytes on Linux and bytes on OS X
+  rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+  return rss if sys.platform == 'darwin' else rss * 1024
+
+
+def cpu_time():
+  times = os.times()
+  return times[0] + times[1]
+
+
+class StageTimer:
+
+  def __init__(self, name, filename = None):
+    self.name = name
+    self.filename = filename
+    self.notes = {}
+
+  def __enter__(self):
+    self.start_wall = time.time()
+    self.start_cpu = cpu_time()
+    self.start_read, self.start_written = io_counters()
+    _active.append(self)
+    return self
+
+  def __exit__(self, kind, value, traceback):
+    _active.remove(self)
+    record = self.record()
+    if kind is not None:
+      record['error'] = str(value)
+    if _log:
+      with open(_log, 'a') as f:
+        f.write(json.dumps(record) + '\n')
+
+  def note(self, **values):
+    self.notes.update(values)
+
+  def record(self):
+    read, written = io_counters()
+    record = {
+      'stage': self.name,
+      'file': self.filename,
+      'pid': os.getpid(),
+      'time': self.start_wall,
+      'wall': time.time() - self.start_wall,
+      'cpu': cpu_time() - self.start_cpu,
+      'read': read - self.start_read if read is not None else None,
+      'written': written - self.start_written if written is not None else None,
+      'peak_rss': peak_rss(),
+    }
+    record.update(self.notes)
+    return record
+
+  def history(self):
+    # The figures so far as the text of a HISTORY card.  A stage noted with
+    # files=N over several files is labelled as the total for the batch.
+    record = self.record()
+    name = self.name
+    if self.notes.get('files', 1) > 1:
+      name = '%s batch of %d files' % (name, self.notes['files'])
+    return '%s: wall %.3fs cpu %.3fs io %s/%s rss %s' % (
+      name, record['wall'], record['cpu'], megabytes(record['read']),
+      megabytes(record['written']), megabytes(record['peak_rss']))
+
+  def add_history(self, header, history = None):
+    # history is the text from an earlier call to history(), to give every
+    # file of a batch the same card
+    header.add_history(history or self.history())
+
+
+def stage(name, filename = None):
+  return StageTimer(name, filename)
+
+
+def note(**values):
+  # Attach structured diagnostics to the innermost running stage, if any
+  if _active:
+    _active[-1].note(**values)
+
+
+def megabytes(value):
+  if value is None:
+    return '-'
+  return '%.1fMB' % (value / 2.0 ** 20)
+
+
+def report(filenames):
+  stages = {}
+  order = []
+  for filename in filenames:
+    with open(filename) as f:
+      for line in f:
+        record = json.loads(line)
+        name = record['stage']
+        if name not in stages:
+          stages[name] = []
+          order.append(name)
+        stages[name].append(record)
+
+  def total(records, key):
+    return sum(r[key] for r in records if r.get(key) is not None)
+
+  rows = []
+  for name in order:
+    records = stages[name]
+    rows.append((
+      name, len(records), total(records, 'wall'), total(records, 'cpu'),
+      total(records, 'read'), total(records, 'written'),
+      max(r['peak_rss'] for r in records),
+      len([r for r in records if 'error' in r])
+    ))
+  rows.sort(key=lambda row: row[2], reverse=True)
+
+  print '%-16s %6s %10s %10s %10s %10s %10s %10s %6s' % ('stage', 'count',
+    'wall s', 'mean ms', 'cpu s', 'read MB', 'written MB', 'peak MB', 'errors')
+  for name, count, wall, cpu, read, written, peak, errors in rows:
+    print '%-16s %6d %10.2f %10.1f %10.2f %10.1f %10.1f %10.1f %6d' % (
+      name, count, wall, wall / count * 1000, cpu, read / 2.0 ** 20,
+      written / 2.0 ** 20, peak / 2.0 ** 20, errors)
+
+
+if __name__ == '__main__':
+  parser = argparse.ArgumentParser(
+      description='Summarise stage timings logged to %s' % (LOG_ENVIRONMENT))
+  subparsers = parser.add_subparsers(dest='command')
+  report_parser = subparsers.add_parser('report',
+      help='Aggregate JSON lines logs by stage')
+  report_parser.add_argument('log', type=str, nargs='+')
+
+  args = parser.parse_args()
+
+  report(args.log)
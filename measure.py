@@ -0,0 +1,192 @@
+#! /usr/bin/env python
+#
+# Equivalent width, flux, centroid and FWHM of spectral lines in many
+# spectra on a shared wavelength grid.
+#
+#   measure.py --lines Ha,Hb,6678:HeI reduced/*.fit
+#   measure.py --lines Ha --cube season.cube --after 2013-08-01 --csv
+#
+# Each line is measured in a window of --width angstrom centred on it,
+# against a straight continuum fitted to bands of --continuum angstrom
+# either side of the window.  Pixel ranges and the least squares fit depend
+# only on the grid, so they are worked out once per line and applied to
+# every spectra as array operations.
+#
+#   ew        equivalent width, positive for absorption
+#   flux      integrated flux above the continuum, negative for absorption
+#   centroid  flux weighted mean wavelength of the line
+#   fwhm      full width at half maximum of the continuum subtracted line,
+#             NaN when it does not fall to half its peak inside the window
+#
+import pyfits
+import numpy as np
+import argparse
+import fitsaccess
+import resample
+import specreduce
+
+QUANTITIES = ['ew', 'flux', 'centroid', 'fwhm']
+
+
+class LineWindow:
+  # Pixels of a line and its continuum bands on a wavelength grid
+
+  def __init__(self, line, wavelengths, width = 100.0, continuum = 50.0):
+    self.line = line
+    half = width / 2.0
+    low = line.angstrom - half
+    high = line.angstrom + half
+    self.pixels = np.flatnonzero((wavelengths >= low) & (wavelengths <= high))
+    continuum_pixels = np.flatnonzero(
+      ((wavelengths >= low - continuum) & (wavelengths < low)) |
+      ((wavelengths > high) & (wavelengths <= high + continuum)))
+    if len(self.pixels) < 3 or len(continuum_pixels) < 2:
+      raise ValueError('%s is too close to the end of the spectra' % (line))
+    self.continuum_pixels = continuum_pixels
+
+    self.wavelengths = wavelengths[self.pixels]
+    # Pixel widths in angstrom, for integrating over the window
+    self.step = np.gradient(wavelengths)[self.pixels]
+
+    # Continuum at the line pixels is a linear function of the continuum
+    # band fluxes, so the whole fit is one matrix
+    x = wavelengths[continuum_pixels] - line.angstrom
+    design = np.column_stack((np.ones_like(x), x))
+    line_design = np.column_stack((np.ones(len(self.pixels)),
+      self.wavelengths - line.angstrom))
+    self.continuum = np.dot(line_design, np.linalg.pinv(design))
+
+  def measure(self, flux):
+    # Every quantity for each row of flux, as a dict of 1D arrays
+    profile = flux[:, self.pixels]
+    continuum = np.dot(flux[:, self.continuum_pixels], self.continuum.T)
+    residual = profile - continuum
+
+    ew = ((1 - profile / continuum) * self.step).sum(axis=1)
+    line_flux = (residual * self.step).sum(axis=1)
+    weights = residual * self.step
+    centroid = (weights * self.wavelengths).sum(axis=1) / weights.sum(axis=1)
+
+    return {
+      'ew': ew,
+      'flux': line_flux,
+      'centroid': centroid,
+      'fwhm': self.fwhm(residual * np.sign(line_flux)[:, np.newaxis]),
+    }
+
+  def fwhm(self, profile):
+    # Width between the points either side of each row's peak where it
+    # crosses half the peak, interpolated between pixels
+    rows, length = profile.shape
+    row = np.arange(rows)
+    index = np.arange(length)
+    peak = profile.argmax(axis=1)
+    half = profile[row, peak] / 2.0
+    below = profile < half[:, np.newaxis]
+
+    # Last pixel below half before the peak and first after it
+    left = np.where(below & (index < peak[:, np.newaxis]), index, -1).max(axis=1)
+    right = np.where(below & (index > peak[:, np.newaxis]), index,
+      length).min(axis=1)
+    found = (left >= 0) & (right < length)
+    left = left.clip(0, length - 2)
+    right = right.clip(1, length - 1)
+
+    def crossing(below, above):
+      y0 = profile[row, below]
+      y1 = profile[row, above]
+      x0 = self.wavelengths[below]
+      x1 = self.wavelengths[above]
+      return x0 + (half - y0) * (x1 - x0) / (y1 - y0)
+
+    width = crossing(right, right - 1) - crossing(left, left + 1)
+    return np.where(found, width, np.nan)
+
+
+def measure(wavelengths, flux, lines, width = 100.0, continuum = 50.0):
+  # Measurements of every line in every row of flux on the grid wavelengths,
+  # as a dict of quantity to an array of shape (spectra, lines)
+  flux = np.atleast_2d(np.asarray(flux, dtype=float))
+  results = dict((quantity, np.empty((len(flux), len(lines))))
+    for quantity in QUANTITIES)
+  for i, line in enumerate(lines):
+    measured = LineWindow(line, wavelengths, width, continuum).measure(flux)
+    for quantity in QUANTITIES:
+      results[quantity][:, i] = measured[quantity]
+  return results
+
+
+def table(labels, names, lines, results):
+  # One row per spectra and line
+  rows = []
+  for i, label in enumerate(labels):
+    for j, line in enumerate(lines):
+      rows.append([label, names[j], line.angstrom] +
+        [results[quantity][i, j] for quantity in QUANTITIES])
+  return rows
+
+
+def read_spectra(filename):
+  # A spectra held in memory, so its file is closed once it has been read
+  with fitsaccess.open_image(filename) as image:
+    return specreduce.BessSpectra(pyfits.HDUList(
+      [pyfits.PrimaryHDU(image.data(), image.scaled_header())]))
+
+
+def load_files(filenames):
+  # Labels, wavelengths and flux of spectra files, resampled onto the first
+  spectra = [read_spectra(f) for f in filenames]
+  labels = []
+  for f, s in zip(filenames, spectra):
+    labels.append(s.header().get('DATE-OBS', f))
+  flux = resample.resample_many(spectra, spectra[0])
+  return labels, spectra[0].wavelengths(), flux
+
+
+if __name__ == '__main__':
+  parser = argparse.ArgumentParser(
+      description='Measure spectral lines in many spectra')
+  parser.add_argument('file', type=str, nargs='*', help='BESS FITS spectra')
+  parser.add_argument('--lines', '-l', type=str, default='Ha,Hb',
+      help='Lines to measure, by name or as wavelength:label (default: Ha,Hb)')
+  parser.add_argument('--width', type=float, default=100.0,
+      help='Width of the window measured around each line (default: 100)')
+  parser.add_argument('--continuum', type=float, default=50.0,
+      help='Width of the continuum band either side of the window '
+        '(default: 50)')
+  parser.add_argument('--cube', type=str,
+      help='Measure the spectra in this cube.py store instead of files')
+  parser.add_argument('--after', type=str,
+      help='Earliest DATE-OBS to measure from --cube')
+  parser.add_argument('--before', type=str,
+      help='DATE-OBS before this to measure from --cube')
+  parser.add_argument('--csv', action='store_true',
+      help='Print comma separated values')
+
+  args = parser.parse_args()
+
+  lines = [specreduce.element_line(l) for l in args.lines.split(',')]
+  # Catalogue labels are for matplotlib, so name those lines by their key
+  names = [l if l in specreduce.element_lines else line.label
+    for l, line in zip(args.lines.split(','), lines)]
+
+  if args.cube:
+    import cube
+    with cube.SpectralCube(args.cube) as store:
+      labels, wavelengths, flux = store.query(args.after, args.before)
+  elif args.file:
+    labels, wavelengths, flux = load_files(args.file)
+  else:
+    parser.error('Give spectra files or --cube')
+
+  results = measure(wavelengths, flux, lines, args.width, args.continuum)
+
+  columns = ['spectra', 'line', 'angstrom'] + QUANTITIES
+  if args.csv:
+    print ','.join(columns)
+    for row in table(labels, names, lines, results):
+      print '%s,%s,%.2f,%.4f,%.4f,%.3f,%.3f' % tuple(row)
+  else:
+    print '%-24s %-12s %8s %10s %10s %10s %8s' % tuple(columns)
+    for row in table(labels, names, lines, results):
+      print '%-24s %-12s %8.2f %10.4f %10.4f %10.3f %8.3f' % tuple(row)
@@ -1,7 +1,8 @@
 #! /usr/bin/env python
-import pyfits
 import argparse
-import specreduce
+import pipeline
+import fitsaccess
+import instrument
 import numpy as np
 
 parser = argparse.ArgumentParser(
@@ -9,16 +10,17 @@ parser = argparse.ArgumentParser(
 parser.add_argument('filename', type=str, help='FITS filename')
 parser.add_argument('--outfile', '-o', type=str, help='Output filename',
     required=True)
+parser.add_argument('--dtype', type=str, default='float32',
+    choices=fitsaccess.OUTPUT_DTYPES,
+    help='Output data type (default: float32)')
 
 args = parser.parse_args()
 
-f = pyfits.open(args.filename)
-header = f[0].header
-data = f[0].data.astype('float')
+with instrument.stage('normalise', args.filename) as timer:
+  with fitsaccess.open_image(args.filename) as image:
+    header = image.scaled_header()
+    data = image.data(fitsaccess.WORKING_DTYPE)
+    pipeline.normalise(data, header, args.filename, out=data)
 
-factor = data.max()
-data = data / factor
-
-print '%s: Normalising with factor %f' % (args.filename, factor)
-
-pyfits.writeto(args.outfile, data, header, output_verify='fix')
+  timer.add_history(header)
+  fitsaccess.write(args.outfile, data, header, dtype=args.dtype)
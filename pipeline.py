@@ -0,0 +1,512 @@
+#! /usr/bin/env python
+#
+# In-process reduction pipeline.  Runs the same stages as specreduce.mk
+# (dark subtract, vertical crop, bin, calibrate, wavelength crop, normalise)
+# as functions over numpy arrays, so a frame is read once and only the final
+# reduced FITS is written.
+#
+# Each stage takes the frame data and its header, updates the header in
+# place and returns the new data.  The frame is converted to float32 once
+# when read and the stages work in that buffer or views of it, so the only
+# other full frame allocations are the ones numpy makes for reductions.
+# The written type is chosen with --dtype.
+#
+# With --cache, every stage's result is kept in a stagecache.StageCache, so
+# rerunning with one parameter changed only redoes the stages from the one
+# that uses it.
+#
+import numpy as np
+import argparse
+import multiprocessing
+import os
+import sys
+import specreduce
+import calibration_library
+import fitsaccess
+import instrument
+import stacking
+import stagecache
+
+# Stage names and the directories specreduce.mk writes their output to.
+STAGES = [
+  ('dark_subtract', 'dark_subtracted'),
+  ('autocrop', 'vcropped'),
+  ('bin', 'binned'),
+  ('auto_calibrate', 'calibrated'),
+  ('wavelength_crop', 'wavelength_cropped'),
+  ('normalise', 'normalised'),
+]
+
+
+def detect_bands(profiles, filterfactor=0.5):
+  # Rows where each row sum profile first rises above filterfactor of its
+  # maximum, and where it next falls below it, for a 2D array of profiles
+  # in one pass.  Returns the maxima, tops and bottoms.
+  profiles = np.atleast_2d(profiles)
+  maxima = profiles.max(axis=1)
+  threshold = (maxima * filterfactor)[:, np.newaxis]
+
+  top = np.argmax(profiles > threshold, axis=1)
+  below = (profiles < threshold) & \
+    (np.arange(profiles.shape[1]) >= top[:, np.newaxis])
+  bottom = np.where(below.any(axis=1), np.argmax(below, axis=1), top)
+  return maxima, top, bottom
+
+
+def crop_window(maxima, top, bottom, rows, padding=10, filename=''):
+  print 'detected maxima: %d top: %d bottom: %d' % (maxima, top, bottom)
+  instrument.note(maxima=float(maxima), detected_top=int(top),
+    detected_bottom=int(bottom))
+
+  top = top - padding
+  bottom = bottom + padding
+
+  if top < 0:
+    print 'WARN: Crop extends past top of image'
+    top = 0
+
+  if bottom > rows:
+    print 'WARN: Crop extends past bottom of image'
+    bottom = rows
+
+  crop_height = bottom - top
+
+  print 'calculated crop %d rows (%d:%d) from %s' % (crop_height, top, bottom, filename)
+  instrument.note(crop_top=int(top), crop_bottom=int(bottom))
+
+  if crop_height <= padding * 2:
+    raise ValueError('%s has zero height area to crop' % (filename))
+
+  return int(top), int(bottom)
+
+
+def set_crop_headers(header, top, bottom, filterfactor):
+  header.update('croptop', top, 'top of crop area in raw image')
+  header.update('cropbot', bottom, 'bottom of crop area in raw image')
+  header.update('cropfac', filterfactor, 'filterfactor for autocrop.py')
+
+
+def autocrop(data, header, filterfactor=0.5, padding=10, filename=''):
+  maxima, top, bottom = detect_bands(data.sum(axis=1), filterfactor)
+  top, bottom = crop_window(maxima[0], top[0], bottom[0], len(data), padding,
+    filename)
+  set_crop_headers(header, top, bottom, filterfactor)
+  return data[top:bottom]
+
+
+def autocrop_frames(images, filterfactor=0.5, padding=10, filenames=None,
+    reference=None, tolerance=2):
+  # Crop windows for a sequence of fitsaccess images.  The row profiles
+  # of frames of the same height are stacked and their bands detected
+  # together.  Each profile is read once, and the frame heights are taken
+  # from them, so images that open their file only to read need not be held
+  # open.
+  #
+  # With a reference frame, its window is used for every frame whose band,
+  # detected from the rows inside that window alone, lies within tolerance
+  # rows of the reference band.  Only the window is read from those frames;
+  # the others fall back to detecting their own band from the whole frame.
+  #
+  # Returns a (top, bottom) window for each frame, or None for frames with
+  # no band to crop.
+  filenames = filenames or [''] * len(images)
+  windows = [None] * len(images)
+  pending = range(len(images))
+
+  if reference is not None:
+    profile = reference.row_profile()
+    maxima, top, bottom = detect_bands(profile, filterfactor)
+    window = crop_window(maxima[0], top[0], bottom[0],
+      len(profile), padding, 'reference')
+    band = np.array([top[0], bottom[0]]) - window[0]
+
+    # Frames shorter than the reference window give shorter profiles
+    profiles = dict((i, images[i].row_profile(*window)) for i in pending)
+    candidates = [i for i in pending
+      if len(profiles[i]) == window[1] - window[0]]
+    if candidates:
+      maxima, top, bottom = detect_bands(
+        np.array([profiles[i] for i in candidates]), filterfactor)
+      stable = (np.abs(top - band[0]) <= tolerance) & \
+        (np.abs(bottom - band[1]) <= tolerance)
+      for i, accepted in zip(candidates, stable):
+        if accepted:
+          print 'using reference crop (%d:%d) for %s' % (window[0], window[1],
+            filenames[i])
+          windows[i] = window
+      pending = [i for i in pending if windows[i] is None]
+      instrument.note(reference_frames=len(images) - len(pending))
+
+  profiles = dict((i, images[i].row_profile()) for i in pending)
+  by_height = {}
+  for i in pending:
+    by_height.setdefault(len(profiles[i]), []).append(i)
+
+  for height, indices in by_height.items():
+    maxima, top, bottom = detect_bands(
+      np.array([profiles[i] for i in indices]), filterfactor)
+    for j, i in enumerate(indices):
+      try:
+        windows[i] = crop_window(maxima[j], top[j], bottom[j], height, padding,
+          filenames[i])
+      except ValueError as e:
+        print 'ERR: %s' % (e)
+
+  return windows
+
+
+def bin_frame(data, header, skywidth=6):
+  return bin_sums(data.sum(axis=0), data[0:skywidth], len(data), skywidth)
+
+
+def bin_sums(binned, sky_rows, rows, skywidth=6):
+  # Sky subtracted spectra from the column sums of a frame of rows rows and
+  # its first skywidth rows, so a memory mapped frame need not be scaled
+  # and held in memory to be binned.  Float32 column sums are subtracted
+  # from in place.
+  binned = np.asarray(binned, dtype=fitsaccess.WORKING_DTYPE)
+  sky = np.mean(sky_rows, axis = 0)
+  sky *= (rows / skywidth)
+  np.subtract(binned, sky, out=binned)
+
+  return binned
+
+
+def fit_zero_order(data, samplewidth=20, maxx=None, degree=7):
+  s = data
+
+  if maxx:
+    s = s[:maxx]
+
+  datamax = s.argmax()
+  left = datamax - samplewidth
+  right = datamax + samplewidth
+
+  if left < 0:
+    left = 0
+
+  y = s[left:right]
+  x = np.arange(len(y))
+  z = np.polyfit(x, y, degree)
+  return datamax, left, y, np.poly1d(z)
+
+
+ZERO_ORDER_METHODS = ['parabolic', 'gaussian', 'poly']
+
+def subpixel_peak(spectra, index, method='parabolic'):
+  # Closed form sub-pixel position of the peak at index in each row of
+  # spectra, from the peak pixel and its two neighbours.  The gaussian
+  # estimator fits a parabola to the log of the values, which is exact for
+  # a gaussian profile.
+  rows = np.arange(len(spectra))
+  index = np.clip(index, 1, spectra.shape[1] - 2)
+  left = spectra[rows, index - 1].astype(float)
+  centre = spectra[rows, index].astype(float)
+  right = spectra[rows, index + 1].astype(float)
+
+  if method == 'gaussian':
+    tiny = np.finfo(float).tiny
+    left, centre, right = [np.log(np.maximum(v, tiny)) for v in
+      (left, centre, right)]
+
+  denominator = left - 2 * centre + right
+  safe = np.where(denominator == 0, 1, denominator)
+  offset = np.where(denominator == 0, 0, 0.5 * (left - right) / safe)
+  return index + offset.clip(-0.5, 0.5)
+
+
+def find_zero_orders(spectra, samplewidth=20, maxx=None, degree=7,
+    method='parabolic'):
+  # Zero order peak of each row of a 2D array of binned spectra.  Returns
+  # the peak pixels and their sub-pixel positions.
+  s = np.atleast_2d(spectra)
+
+  if maxx:
+    s = s[:, :maxx]
+
+  datamax = s.argmax(axis=1)
+
+  if method == 'poly':
+    positions = [find_zero_order(row, samplewidth, None, degree, method)[1]
+      for row in s]
+    return datamax, np.array(positions)
+  elif method in ZERO_ORDER_METHODS:
+    return datamax, subpixel_peak(s, datamax, method)
+  else:
+    raise ValueError('Unknown zero order method %s' % (method))
+
+
+def find_zero_order(data, samplewidth=20, maxx=None, degree=7,
+    method='parabolic'):
+  if method == 'poly':
+    datamax, left, y, p = fit_zero_order(data, samplewidth, maxx, degree)
+    xp = np.linspace(0, len(y), 100)
+    return datamax, xp[p(xp).argmax()] + left
+  datamax, positions = find_zero_orders(data, samplewidth, maxx, degree, method)
+  return datamax[0], positions[0]
+
+
+def auto_calibrate(data, header, spacing, samplewidth=20, maxx=None,
+    degree=7, filename='', method='parabolic'):
+  datamax, maxpos = find_zero_order(data, samplewidth, maxx, degree, method)
+
+  print '%s: Data peak: %d, %s peak: %f' % (filename, datamax, method, maxpos)
+  instrument.note(data_peak=int(datamax), zero_order=float(maxpos),
+    zero_order_method=method)
+
+  set_calibration_headers(header, maxpos, spacing)
+  return data
+
+
+def set_calibration_headers(header, maxpos, spacing):
+  header.update('CRVAL1', 0.0)
+  header.update('CRPIX1', float(maxpos))
+  header.update('CDELT1', spacing)
+  header.update('CUNIT1', 'Angstrom')
+  header.update('CTYPE1', 'Wavelength')
+
+
+def wavelength_crop(data, header, min=3800, max=8000, filename=''):
+  left, right = wavelength_window(header, len(data), min, max, filename)
+  return data[left:right]
+
+
+def wavelength_window(header, length, min=3800, max=8000, filename=''):
+  # Pixel range of a spectra of length pixels between min and max angstrom,
+  # from its header alone.  The header is updated for the cropped spectra.
+  calibration = specreduce.calibration_from_header(header)
+  wl = calibration.angstrom(np.arange(length))
+  left = np.argmax(wl>min)
+  right = np.argmax(wl>max)
+
+  print '%s: Cropping %d to %d' % (filename, left, right)
+  instrument.note(crop_left=int(left), crop_right=int(right))
+
+  header.update('CRVAL1', calibration.angstrom(left+1))
+  header.update('CRPIX1', 1.0)
+  header.update('CRPLFT', left, 'Left of crop area from wavelength_crop.py')
+  header.update('CRPRGT', right, 'Right of crop area from wavelength_crop.py')
+  return left, right
+
+
+def normalise(data, header, filename='', out=None):
+  # Divides into out if given, which may be data itself
+  factor = data.max()
+
+  print '%s: Normalising with factor %f' % (filename, factor)
+  instrument.note(factor=float(factor))
+
+  return np.divide(data, factor, out=out, dtype=fitsaccess.WORKING_DTYPE)
+
+
+# The master darks and flats are loaded once per worker process rather than
+# per frame.
+_library = None
+
+def load_library(dark = None, flat = None):
+  # Flats are divided into dark subtracted frames, so need a dark
+  if flat and not dark:
+    raise ValueError('A flat needs a dark to calibrate with')
+  if not dark:
+    return None
+  library = calibration_library.CalibrationLibrary()
+  library.add_path(dark, 'dark')
+  if flat:
+    library.add_path(flat, 'flat')
+  return library
+
+def _init_worker(dark, flat):
+  global _library
+  _library = load_library(dark, flat)
+
+
+def _write_stage(args, stage_dir, name, data, header, input_dtype):
+  # Frame stages are written in the raw frame's type, spectra as float32
+  dtype = input_dtype if data.ndim == 2 else None
+  path = os.path.join(args.intermediates, stage_dir)
+  if not os.path.isdir(path):
+    os.makedirs(path)
+  fitsaccess.write(os.path.join(path, name), data, header, args.compress,
+      clobber=True, dtype=dtype)
+
+
+# Per process stage result cache, see stagecache.py
+_cache = None
+
+def stage_cache(args):
+  global _cache
+  if not args.cache:
+    return None
+  if _cache is None or _cache.directory != args.cache:
+    # Every module with code the cached stages run, so editing any of them
+    # invalidates the cached results
+    _cache = stagecache.StageCache(args.cache, args.cache_size * 2 ** 20,
+      [sys.modules[__name__], calibration_library, specreduce, stacking,
+        fitsaccess])
+  return _cache
+
+
+def reduce_file(filename, args, library=None):
+  # Run every stage on a raw frame, returning the reduced data and header
+  with instrument.stage('read', filename) as timer:
+    with fitsaccess.open_image(filename) as image:
+      data = image.data(fitsaccess.WORKING_DTYPE)
+      header = image.scaled_header()
+      input_dtype = image.input_dtype()
+    cache = stage_cache(args)
+    if cache:
+      input_key = cache.input_key(data, header)
+    timer.add_history(header)
+  name = os.path.basename(filename)
+
+  # Each stage with the parameters its result depends on
+  stages = [
+    (lambda d, h: library.calibrate(d, h, out=d) if library else d,
+      {'library': library.digest() if library and cache else None}),
+    (lambda d, h: autocrop(d, h, args.filterfactor, args.padding, filename),
+      {'filterfactor': args.filterfactor, 'padding': args.padding}),
+    (lambda d, h: bin_frame(d, h, args.skywidth),
+      {'skywidth': args.skywidth}),
+    (lambda d, h: auto_calibrate(d, h, args.spacing, args.samplewidth,
+      args.maxx, args.degree, filename, args.method),
+      {'spacing': args.spacing, 'samplewidth': args.samplewidth,
+        'maxx': args.maxx, 'degree': args.degree, 'method': args.method}),
+    (lambda d, h: wavelength_crop(d, h, args.min, args.max, filename),
+      {'min': args.min, 'max': args.max}),
+    (lambda d, h: normalise(d, h, filename, out=d), {}),
+  ]
+
+  first = 0
+  if cache:
+    keys = cache.chain(input_key, [(stage_name, parameters) for
+      (_, parameters), (stage_name, _) in zip(stages, STAGES)])
+    # Without intermediates to write, start after the last cached stage
+    if not args.intermediates:
+      latest = cache.latest(keys)
+      if latest is not None:
+        first, data, header = latest
+        first += 1
+
+  for i in range(first, len(stages)):
+    stage, parameters = stages[i]
+    stage_name, stage_dir = STAGES[i]
+    with instrument.stage(stage_name, filename) as timer:
+      cached = cache.get(keys[i]) if cache else None
+      if cached is not None:
+        data, header = cached
+        timer.note(cached=True)
+      else:
+        data = stage(data, header)
+        timer.add_history(header)
+        if cache:
+          cache.put(keys[i], data, header)
+      if args.intermediates:
+        _write_stage(args, stage_dir, name, data, header, input_dtype)
+
+  return data, header
+
+
+def reduce_frame(filename, args, library=None):
+  data, header = reduce_file(filename, args, library)
+  name = os.path.basename(filename)
+
+  with instrument.stage('write', filename):
+    fitsaccess.write(os.path.join(args.outdir, name), data, header,
+        args.compress, clobber=True, dtype=args.dtype)
+  return name
+
+
+def _reduce_worker(job):
+  filename, args = job
+  # Any error in one frame is reported and counted as failed, so the rest
+  # of the run is still written
+  try:
+    return reduce_frame(filename, args, _library)
+  except Exception as e:
+    print 'ERR: %s: %s' % (filename, e)
+    return None
+
+
+def add_reduction_arguments(parser):
+  # Options for every stage, shared with watch.py
+  parser.add_argument('--intermediates', type=str,
+      help='Also write the output of each stage under this directory')
+  parser.add_argument('--dark', type=str,
+      help='Master dark to subtract, or a directory of master darks and flats')
+  parser.add_argument('--flat', type=str,
+      help='Master flat to divide by, or a directory of master flats')
+  parser.add_argument('--filterfactor', type=float, default=0.95,
+      help='Factor for selecting the start of the crop area.')
+  parser.add_argument('--padding', type=int, default=30,
+      help='Number of rows to pad either side of the binning area.')
+  parser.add_argument('--skywidth', type=int, default=6,
+      help='Width of area for sky subtraction')
+  parser.add_argument('--spacing', type=float, required=True,
+      help='Channel spacing (Angstrom / pixel')
+  parser.add_argument('--samplewidth', type=int, default=20,
+      help='Width each side of zero order peak to sample.')
+  parser.add_argument('--maxx', type=int,
+      help='Maximum X value for finding first order peak.')
+  parser.add_argument('--degree', type=int, default=7,
+      help='Degree of polynomial fit')
+  parser.add_argument('--method', type=str, default='parabolic',
+      choices=ZERO_ORDER_METHODS,
+      help='Zero order peak estimator (default: parabolic)')
+  parser.add_argument('--min', type=int, default=3800,
+      help='Minimum angstrom value')
+  parser.add_argument('--max', type=int, default=8000,
+      help='Maximum angstrom value')
+  parser.add_argument('--compress', type=str,
+      choices=fitsaccess.COMPRESSION_MODES,
+      help='Tile compress the output (default: $%s or none)' % (
+        fitsaccess.COMPRESSION_ENVIRONMENT))
+  parser.add_argument('--dtype', type=str, default='float32',
+      choices=fitsaccess.OUTPUT_DTYPES,
+      help='Data type of the reduced files (default: float32)')
+  parser.add_argument('--cache', type=str,
+      help='Reuse stage results stored in this directory, and store new ones')
+  parser.add_argument('--cache-size', type=int, default=2048,
+      help='Size in MB above which the least recently used results are '
+        'removed from --cache (default: 2048)')
+
+
+def check_reduction_arguments(parser, args):
+  if args.flat and not args.dark:
+    parser.error('--flat needs --dark')
+
+
+def main():
+  parser = argparse.ArgumentParser(
+      description='Reduce raw spectra frames in a single process pool')
+  parser.add_argument('file', type=str, nargs='+', help='FITS filenames')
+  parser.add_argument('--outdir', '-o', type=str, default='reduced',
+      help='Directory for reduced files (default: reduced)')
+  add_reduction_arguments(parser)
+  parser.add_argument('--log', type=str,
+      help='Append per stage timings to this JSON lines file')
+  parser.add_argument('--jobs', '-j', type=int,
+      help='Number of worker processes (default: number of CPUs)')
+
+  args = parser.parse_args()
+  check_reduction_arguments(parser, args)
+
+  if args.log:
+    instrument.set_log(args.log)
+
+  if not os.path.isdir(args.outdir):
+    os.makedirs(args.outdir)
+
+  pool = multiprocessing.Pool(args.jobs, _init_worker, (args.dark, args.flat))
+  results = pool.map(_reduce_worker, [(f, args) for f in args.file])
+  pool.close()
+  pool.join()
+
+  failed = results.count(None)
+  print 'Reduced %d frames, %d failed' % (len(results) - failed, failed)
+
+  if failed:
+    exit(1)
+
+
+if __name__ == '__main__':
+  main()
@@ -1,103 +1,44 @@
 #! /usr/bin/env python
 import specreduce
 import argparse
+import glob
+import multiprocessing
+import os
 import pyfits
-import matplotlib.pyplot as plt
+import fitsaccess
+import downsampling
+import matplotlib
 import numpy as np
 
-element_lines = {
-  'Ha': specreduce.ElementLine(6563, r'H$\alpha$'),
-  'Hb': specreduce.ElementLine(4861, r'H$\beta$'),
-  'Hg': specreduce.ElementLine(4341, r'H$\gamma$'),
-  'Hd': specreduce.ElementLine(4102, r'H$\delta$'),
-  'CaH': specreduce.ElementLine(3968, 'Ca H'),
-  'CaK': specreduce.ElementLine(3934, 'Ca K'),
-}
-
 # These linestyles are used for grayscale plots.
 dashes = [ '-', '--', '-.', ':' ]
 
 def get_spectra(filename, legend_keyword = 'DATE-OBS'):
   hdulist = pyfits.open(filename)
+  hdu = fitsaccess.image_hdu(hdulist)
 
-  if hdulist[0].header['NAXIS'] == 1:
+  if hdu.header['NAXIS'] == 1:
     s = specreduce.BessSpectra(hdulist)
   else:
-    s = specreduce.ImageSpectra(hdulist[0].data)
+    s = specreduce.ImageSpectra(hdu.data)
 
   s.set_label_header(legend_keyword)
   return s
 
 
-def get_line(line_definition):
-  if ":" in line_definition:
-    wavelength, label = line_definition.split(":")
-    return specreduce.ElementLine(float(wavelength), label)
-  else:
-    return element_lines[line_definition]
-
 def calibration_reference_from_arg(arg):
   pixel, angstrom = arg.split(':')
 
-  if angstrom in element_lines:
-    angstrom = element_lines[angstrom].angstrom
+  if angstrom in specreduce.element_lines:
+    angstrom = specreduce.element_lines[angstrom].angstrom
 
   return specreduce.CalibrationReference(float(pixel), float(angstrom))
 
 
-parser = argparse.ArgumentParser(description='Plot spectra')
-parser.add_argument('filename', type=str, help='FITS filename',
-    nargs='+')
-parser.add_argument('--calibrate', '-c', dest='calibration', type=str,
-    help='Calibration pixel position.  Format pixel:angstrom,pixel:angstrom or pixel,angstrom,angstrom_per_pixel')
-parser.add_argument('--lines', '-l', dest='lines', type=str,
-                    help='Plot specified lines.')
-parser.add_argument('--title', '-t', dest='title', type=str, help='Plot title')
-parser.add_argument('--suptitle', '-s', dest='suptitle', type=str, help='Plot super-title, appears above title')
-parser.add_argument('--listlines', '-L', action='store_true',
-    help='List available lines')
-parser.add_argument('--crop', '-C', action='store_true', help='Crop spectra')
-parser.add_argument('--croprange', type=str, default='3900:7000',
-    help='Set crop range (default: 3900:7000)')
-parser.add_argument('--headerlabel', '-H', type=str, default='DATE-OBS',
-    help='Use the value of the specified FITS header as the legend (default: DATE-OBS)')
-parser.add_argument('--offset', '-o', type=float, default=0.0,
-    help='Offset each plot by offset in the Y axes.  Default: 0.0')
-parser.add_argument('--grayscale', '-g', action='store_true',
-    help='Plot chart grayscale')
-
-
-args = parser.parse_args()
-
-if args.listlines:
-  for k, v in element_lines.iteritems():
-    print "%4s %s" % (k, v)
-  exit()
-
-base_spectra = get_spectra(args.filename[0], args.headerlabel)
-
-if base_spectra.can_plot_image:
-  graph_subplot = plt.subplot(211)
-  image_subplot = plt.subplot(212)
-  image_subplot.set_xlabel('x px')
-  image_subplot.set_ylabel('y px')
-  base_spectra.plot_image_onto(image_subplot)
-else:
-  graph_subplot = plt.subplot(111)
-
-if args.crop:
-  crop_left, crop_right = args.croprange.split(':')
-  graph_subplot.set_xlim(left=int(crop_left),right=int(crop_right))
-
-graph_subplot.set_ylabel('Relative intensity')
-
-plots = []
-plots.append(base_spectra)
-
-if args.calibration:
-  calibration_elements = args.calibration.split(',')
-
-  if ':' in args.calibration:
+def parse_calibration(arg):
+  calibration_elements = arg.split(',')
+
+  if ':' in arg:
     if len(calibration_elements) == 2:
       calibration = specreduce.DoublePointCalibration(
         calibration_reference_from_arg(calibration_elements[0]),
@@ -112,8 +53,8 @@ if args.calibration:
       raise ValueError('Unable to parse calibration argument')
   elif len(calibration_elements) == 3:
     pixel, angstrom, angstrom_per_pixel = calibration_elements
-    if angstrom in element_lines:
-      angstrom = element_lines[angstrom].angstrom
+    if angstrom in specreduce.element_lines:
+      angstrom = specreduce.element_lines[angstrom].angstrom
     calibration = specreduce.SinglePointCalibration(
       specreduce.CalibrationReference(float(pixel), float(angstrom)),
       float(angstrom_per_pixel)
@@ -121,47 +62,188 @@ if args.calibration:
   else:
     raise ValueError('Unable to parse calibration argument')
 
-  base_spectra.set_calibration(calibration)
+  return calibration
 
-if base_spectra.calibration:
 
-  print base_spectra.calibration
+def plot(figure, filenames, args):
+  # Draw filenames onto figure, the first with an image of it if it has
+  # one and the rest overlaid on its graph.
+  base_spectra = get_spectra(filenames[0], args.headerlabel)
 
-  if args.lines:
-    lines_to_plot = args.lines.split(',')
+  if base_spectra.can_plot_image:
+    graph_subplot = figure.add_subplot(211)
+    image_subplot = figure.add_subplot(212)
+    image_subplot.set_xlabel('x px')
+    image_subplot.set_ylabel('y px')
+    base_spectra.plot_image_onto(image_subplot, args.preview_pixels)
+    title_subplot = image_subplot
+  else:
+    graph_subplot = figure.add_subplot(111)
+    title_subplot = graph_subplot
+
+  if args.crop:
+    crop_left, crop_right = args.croprange.split(':')
+    graph_subplot.set_xlim(left=int(crop_left),right=int(crop_right))
 
-    for line_to_plot in lines_to_plot:
-      line = get_line(line_to_plot)
-      plots.append(line)
+  graph_subplot.set_ylabel('Relative intensity')
 
-  graph_subplot.axvline(x=0, color='yellow')
-  graph_subplot.set_xlabel(r'Wavelength ($\AA$)')
+  plots = []
+  plots.append(base_spectra)
 
-else:
-  graph_subplot.set_xlabel('Pixel')
-  
+  if args.calibration:
+    base_spectra.set_calibration(parse_calibration(args.calibration))
 
-if args.title:
-  title = args.title
-else:
-  title = args.filename[0]
+  if base_spectra.calibration:
 
-plt.title(title)
+    print base_spectra.calibration
 
-if args.suptitle:
-  plt.suptitle(args.suptitle)
+    if args.lines:
+      lines_to_plot = args.lines.split(',')
 
-if len(args.filename) > 1:
-  [plots.append(get_spectra(s, args.headerlabel)) for s in args.filename[1:]]
+      for line_to_plot in lines_to_plot:
+        line = specreduce.element_line(line_to_plot)
+        plots.append(line)
 
-for i, plot in enumerate(plots):
-  offset = args.offset * (len(plots) - i)
-  plot.grayscale = args.grayscale
-  if args.grayscale:
-    plot.linestyle = dashes[np.mod(i, len(dashes))]
+    graph_subplot.axvline(x=0, color='yellow')
+    graph_subplot.set_xlabel(r'Wavelength ($\AA$)')
 
-  plot.plot_onto(graph_subplot, offset = offset)
+  else:
+    graph_subplot.set_xlabel('Pixel')
+
+  title_subplot.set_title(args.title or filenames[0])
+
+  if args.suptitle:
+    figure.suptitle(args.suptitle)
+
+  if len(filenames) > 1:
+    [plots.append(get_spectra(s, args.headerlabel)) for s in filenames[1:]]
+
+  for i, plotable in enumerate(plots):
+    offset = args.offset * (len(plots) - i)
+    plotable.grayscale = args.grayscale
+    if args.grayscale:
+      plotable.linestyle = dashes[np.mod(i, len(dashes))]
+
+    plotable.plot_onto(graph_subplot, offset = offset,
+      downsample = args.downsample)
+
+  graph_subplot.legend(loc='best')
+
+
+# In batch mode each worker process draws every file it is given onto the
+# same figure, cleared in between.
+_figure = None
+
+def _init_worker():
+  global _figure
+  import matplotlib.pyplot as plt
+  _figure = plt.figure()
+
+def render(job):
+  filename, outfile, args = job
+  _figure.clf()
+  try:
+    plot(_figure, [filename], args)
+    _figure.savefig(outfile, format=args.format, dpi=args.dpi)
+  except Exception as e:
+    # One bad file is reported and the rest of the batch carries on
+    print 'ERR: %s: %s' % (filename, e)
+    return None
+  return outfile
+
+
+def expand(patterns):
+  # Patterns the shell did not expand, e.g. quoted to avoid a too long
+  # argument list
+  filenames = []
+  for pattern in patterns:
+    matches = sorted(glob.glob(pattern))
+    filenames.extend(matches if matches else [pattern])
+  return filenames
+
+
+def output_names(filenames):
+  # Output names from the input basenames, or when two inputs share a
+  # basename, from every input's path below the directory common to them all
+  names = [os.path.basename(f) for f in filenames]
+  if len(set(names)) < len(names):
+    paths = [os.path.abspath(f) for f in filenames]
+    common = os.path.commonprefix([os.path.dirname(p) + os.sep for p in paths])
+    common = common[:common.rindex(os.sep) + 1]
+    names = [os.path.relpath(p, common) for p in paths]
+  return [os.path.splitext(name)[0] for name in names]
+
+
+def batch(filenames, args):
+  jobs = []
+  for filename, name in zip(filenames, output_names(filenames)):
+    outfile = os.path.join(args.outdir, '%s.%s' % (name, args.format))
+    if not os.path.isdir(os.path.dirname(outfile)):
+      os.makedirs(os.path.dirname(outfile))
+    jobs.append((filename, outfile, args))
+
+  pool = multiprocessing.Pool(args.jobs, _init_worker)
+  results = pool.map(render, jobs, chunksize=max(1, len(jobs) // (4 * (
+    args.jobs or multiprocessing.cpu_count()))))
+  pool.close()
+  pool.join()
+  return results
+
+
+def main():
+  parser = argparse.ArgumentParser(description='Plot spectra')
+  parser.add_argument('filename', type=str, help='FITS filename',
+      nargs='+')
+  parser.add_argument('--calibrate', '-c', dest='calibration', type=str,
+      help='Calibration pixel position.  Format pixel:angstrom,pixel:angstrom or pixel,angstrom,angstrom_per_pixel')
+  parser.add_argument('--lines', '-l', dest='lines', type=str,
+                      help='Plot specified lines.')
+  parser.add_argument('--title', '-t', dest='title', type=str, help='Plot title')
+  parser.add_argument('--suptitle', '-s', dest='suptitle', type=str, help='Plot super-title, appears above title')
+  parser.add_argument('--listlines', '-L', action='store_true',
+      help='List available lines')
+  parser.add_argument('--crop', '-C', action='store_true', help='Crop spectra')
+  parser.add_argument('--croprange', type=str, default='3900:7000',
+      help='Set crop range (default: 3900:7000)')
+  parser.add_argument('--headerlabel', '-H', type=str, default='DATE-OBS',
+      help='Use the value of the specified FITS header as the legend (default: DATE-OBS)')
+  parser.add_argument('--offset', '-o', type=float, default=0.0,
+      help='Offset each plot by offset in the Y axes.  Default: 0.0')
+  parser.add_argument('--grayscale', '-g', action='store_true',
+      help='Plot chart grayscale')
+  parser.add_argument('--downsample', '-d', type=str, default='minmax',
+      choices=downsampling.METHODS,
+      help='Reduce each spectra to the axes width in pixels, recomputed on zoom (default: minmax)')
+  parser.add_argument('--preview-pixels', type=int, default=1000000,
+      help='Show a block averaged preview of images larger than this, 0 for full resolution (default: 1000000)')
+  parser.add_argument('--outdir', '-O', type=str,
+      help='Render each file on its own to an image in this directory instead of showing the plot')
+  parser.add_argument('--format', '-f', type=str, default='png',
+      choices=['png', 'svg'], help='Image format for --outdir (default: png)')
+  parser.add_argument('--dpi', type=int, default=100,
+      help='Resolution of PNG images for --outdir (default: 100)')
+  parser.add_argument('--jobs', '-j', type=int,
+      help='Number of worker processes for --outdir (default: number of CPUs)')
+
+  args = parser.parse_args()
+
+  if args.listlines:
+    for k, v in specreduce.element_lines.iteritems():
+      print "%4s %s" % (k, v)
+    exit()
+
+  if args.outdir:
+    matplotlib.use('Agg')
+    results = batch(expand(args.filename), args)
+    failed = results.count(None)
+    print 'Rendered %d files, %d failed' % (len(results) - failed, failed)
+    if failed:
+      exit(1)
+  else:
+    import matplotlib.pyplot as plt
+    plot(plt.figure(), args.filename, args)
+    plt.show()
 
-graph_subplot.legend(loc='best')
 
-plt.show()
+if __name__ == '__main__':
+  main()
@@ -0,0 +1,165 @@
+#
+# Resampling of spectra onto another wavelength grid.  The index and weight
+# arrays depend only on the two calibrations, so they are built once per
+# pair and applied to every spectra sharing them.
+#
+# Spectra can also be aligned to the target before resampling, by cross
+# correlating them against it to correct small errors in their wavelength
+# calibrations.
+#
+import numpy as np
+
+
+def interpolation_weights(x, xp):
+  # Indices and weights such that np.interp(x, xp, fp) equals
+  # fp[index - 1] * (1 - weight) + fp[index] * weight
+  x = np.asarray(x, dtype=float)
+  xp = np.asarray(xp, dtype=float)
+  index = np.searchsorted(xp, x).clip(1, len(xp) - 1)
+  weight = (x - xp[index - 1]) / (xp[index] - xp[index - 1])
+  return index, weight.clip(0, 1)
+
+
+def pixel_edges(wavelengths):
+  # Edges of each pixel, half way between neighbouring pixel centres
+  wavelengths = np.asarray(wavelengths, dtype=float)
+  middle = (wavelengths[1:] + wavelengths[:-1]) / 2
+  first = wavelengths[0] - (middle[0] - wavelengths[0])
+  last = wavelengths[-1] + (wavelengths[-1] - middle[-1])
+  return np.concatenate(([first], middle, [last]))
+
+
+class Resampler:
+
+  def __init__(self, source, target, flux_conserving = False):
+    self.flux_conserving = flux_conserving
+    if flux_conserving:
+      # The cumulative flux is interpolated at the target pixel edges and
+      # differenced, so the flux in each source pixel is spread over the
+      # target pixels it overlaps.
+      self.index, self.weight = interpolation_weights(
+        pixel_edges(target), pixel_edges(source))
+    else:
+      self.index, self.weight = interpolation_weights(target, source)
+
+  def _apply_weights(self, data):
+    return data[..., self.index - 1] * (1 - self.weight) + \
+      data[..., self.index] * self.weight
+
+  def apply(self, data):
+    # Resample a 1D spectra, or each row of a 2D array of spectra
+    data = np.asarray(data, dtype=float)
+    if self.flux_conserving:
+      cumulative = np.zeros(data.shape[:-1] + (data.shape[-1] + 1,))
+      np.cumsum(data, axis=-1, out=cumulative[..., 1:])
+      return np.diff(self._apply_weights(cumulative), axis=-1)
+    return self._apply_weights(data)
+
+
+def calibration_key(spectra):
+  return (
+    spectra.get_header('CRPIX1'), spectra.get_header('CRVAL1'),
+    spectra.get_header('CDELT1'), len(spectra.data())
+  )
+
+
+_resamplers = {}
+
+def resampler(source, target, flux_conserving = False):
+  # Resampler from source to target BessSpectra, cached on their calibration
+  key = (calibration_key(source), calibration_key(target), flux_conserving)
+  if key not in _resamplers:
+    _resamplers[key] = Resampler(
+      source.wavelengths(), target.wavelengths(), flux_conserving)
+  return _resamplers[key]
+
+
+def resample_many(spectra, target, flux_conserving = False):
+  # Resample every spectra onto the wavelengths of target, returning one
+  # row each.  Spectra sharing a calibration are resampled together.
+  resampled = np.empty((len(spectra), len(target.data())))
+  groups = {}
+  for i, s in enumerate(spectra):
+    groups.setdefault(calibration_key(s), []).append(i)
+
+  for rows in groups.values():
+    r = resampler(spectra[rows[0]], target, flux_conserving)
+    resampled[rows] = r.apply([spectra[i].data() for i in rows])
+
+  return resampled
+
+
+ALIGN_METHODS = ['none', 'linear', 'log']
+
+
+def cross_correlation_shifts(reference, rows, max_shift = None,
+    continuum = 20):
+  # Sub-pixel shift of each row of rows against reference, positive when
+  # the features in a row are at higher pixels.  All rows are correlated
+  # with one rfft of the stacked array.  Each is made zero mean and tapered
+  # first, and variations longer than continuum pixels are filtered out, so
+  # the lines are correlated rather than the continuum shape or the ends.
+  rows = np.atleast_2d(np.asarray(rows, dtype=float))
+  length = rows.shape[1]
+  taper = np.hanning(length)
+  # Zero padded so shifts don't wrap around into each other
+  size = 2 ** int(np.ceil(np.log2(2 * length)))
+
+  def transform(data):
+    data = data - np.nanmean(data, axis=-1)[..., np.newaxis]
+    transformed = np.fft.rfft(np.nan_to_num(data) * taper, size, axis=-1)
+    transformed[..., :size // continuum] = 0
+    return transformed
+
+  correlation = np.fft.irfft(transform(rows) * np.conj(transform(reference)),
+    size, axis=1)
+
+  lags = np.arange(size)
+  lags[lags > size // 2] -= size
+  if max_shift is not None:
+    correlation[:, np.abs(lags) > max_shift] = -np.inf
+
+  # Parabola through the peak and its neighbours
+  index = correlation.argmax(axis=1)
+  row = np.arange(len(rows))
+  left = correlation[row, index - 1]
+  centre = correlation[row, index]
+  right = correlation[row, (index + 1) % size]
+  denominator = left - 2 * centre + right
+  peaked = np.isfinite(denominator) & (denominator < 0)
+  offset = np.where(peaked,
+    0.5 * (left - right) / np.where(peaked, denominator, -1), 0)
+  return lags[index] + offset.clip(-0.5, 0.5)
+
+
+def aligned_resample_many(spectra, target, flux_conserving = False,
+    method = 'linear', max_shift = None):
+  # As resample_many, but each spectra is first shifted onto target by cross
+  # correlation.  The linear method shifts by a constant number of
+  # angstrom, and the log method by a constant velocity, correlating on a
+  # log wavelength grid.  Returns the resampled rows and the shifts in
+  # pixels of the grid correlated on.
+  resampled = resample_many(spectra, target, flux_conserving)
+  if method == 'none':
+    return resampled, np.zeros(len(spectra))
+
+  wavelengths = target.wavelengths()
+  if method == 'log':
+    grid = np.exp(np.linspace(np.log(wavelengths[0]), np.log(wavelengths[-1]),
+      len(wavelengths)))
+    to_grid = Resampler(wavelengths, grid)
+    shifts = cross_correlation_shifts(to_grid.apply(target.data()),
+      to_grid.apply(resampled), max_shift)
+    factors = np.exp(shifts * np.log(grid[1] / grid[0]))
+    corrected = lambda s, i: s.wavelengths() / factors[i]
+  elif method == 'linear':
+    shifts = cross_correlation_shifts(target.data(), resampled, max_shift)
+    offsets = shifts * (wavelengths[-1] - wavelengths[0]) / (len(wavelengths) - 1)
+    corrected = lambda s, i: s.wavelengths() - offsets[i]
+  else:
+    raise ValueError('Unknown alignment method %s' % (method))
+
+  for i, s in enumerate(spectra):
+    resampled[i] = Resampler(corrected(s, i), wavelengths,
+      flux_conserving).apply(s.data())
+  return resampled, shifts
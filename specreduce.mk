@@ -19,6 +19,11 @@ REDUCED_DIR							:= reduced
 
 VPADDING								:= 30
 
+# Set COMPRESS to lossless or quantize to tile compress every stage's output.
+ifdef COMPRESS
+export SPECREDUCE_COMPRESS := $(COMPRESS)
+endif
+
 PATTERN ?= *_[0-9][0-9][0-9][0-9].fit
 
 DARK_SUBTRACTED_TARGETS := $(patsubst %.fit, $(DARK_SUBTRACTED_DIR)/%.fit, $(wildcard $(PATTERN)))
@@ -39,6 +44,24 @@ wavelength_cropped: $(WAVELENGTH_CROPPED_TARGETS)
 normalised: $(NORMALISED_TARGETS)
 reduced: $(REDUCED_TARGETS)
 
+# Run every stage in-process with pipeline.py, writing only the reduced files.
+# Set CACHE to a directory to reuse stage results between runs, so changing
+# SPACING or VPADDING only redoes the stages from the one that uses it.
+pipeline:
+	mkdir -p $(REDUCED_DIR)
+	$(SCRIPT_DIR)/pipeline.py --outdir $(REDUCED_DIR) --filterfactor 0.95 \
+		--padding $(VPADDING) --spacing $(SPACING) \
+		$(if $(DARK),--dark $(DARK)) $(if $(MAXX),--maxx $(MAXX)) \
+		$(if $(CACHE),--cache $(CACHE)) \
+		$(wildcard $(PATTERN))
+
+# Reduce frames as they are captured into CAPTURE_DIR, until interrupted.
+watch:
+	$(SCRIPT_DIR)/watch.py --outdir $(REDUCED_DIR) --filterfactor 0.95 \
+		--padding $(VPADDING) --spacing $(SPACING) \
+		$(if $(DARK),--dark $(DARK)) $(if $(MAXX),--maxx $(MAXX)) \
+		--pattern '$(PATTERN)' $(CAPTURE_DIR)
+
 clean:
 	rm -f $(DARK_SUBTRACTED_DIR)/* $(VCROP_DIR)/* $(BINNED_DIR)/* \
 		$(CALIBRATED_DIR)/* $(WAVELENGTH_CROPPED_DIR)/* $(NORMALISED_DIR)/* \
@@ -1,10 +1,16 @@
 #! /usr/bin/env python
+#
+# Core calibration and spectra classes.  This module is imported by every
+# tool, so it only imports numpy, pyfits, fitsaccess and downsampling up
+# front.  Plotting methods take the matplotlib axes to draw on, and scipy is
+# imported on first use.
+#
+import collections
+import hashlib
 import pyfits
 import numpy as np
-import matplotlib.pyplot as plt
-import scipy.interpolate
-import argparse
-import os
+import fitsaccess
+import downsampling
 
 
 class CalibrationReference:
@@ -28,6 +34,7 @@ class DoublePointCalibration:
     )
 
   def angstrom(self, pixel):
+    pixel = np.asarray(pixel, dtype=float)
     return (self.slope() * (pixel - self.reference1.pixel)) + self.reference1.angstrom
 
   def slope(self):
@@ -49,6 +56,7 @@ class SinglePointCalibration:
     self._angstrom_per_pixel = angstrom_per_pixel
 
   def angstrom(self, pixel):
+    pixel = np.asarray(pixel, dtype=float)
     return (self.angstrom_per_pixel() * (pixel - self.reference.pixel)) + self.reference.angstrom
 
   def angstrom_per_pixel(self):
@@ -62,7 +70,7 @@ class NonLinearCalibration:
     self.poly1d = self._generate_poly1d()
 
   def angstrom(self, pixel):
-    return self.poly1d(pixel)
+    return self.poly1d(np.asarray(pixel, dtype=float))
 
   def _generate_poly1d(self):
     x = []
@@ -74,6 +82,13 @@ class NonLinearCalibration:
     return np.poly1d(z)
 
 
+def calibration_from_header(header):
+  return SinglePointCalibration(
+    CalibrationReference(header['CRPIX1'], header['CRVAL1']),
+    header['CDELT1']
+  )
+
+
 class ElementLine:
 
   def __init__(self, angstrom, label):
@@ -89,7 +104,7 @@ class ElementLine:
   def plot_label(self):
     return '%s (%.02f $\AA$)' % (self.label, self.angstrom)
 
-  def plot_onto(self, axes, offset = 0):
+  def plot_onto(self, axes, offset = 0, downsample = None):
     bottom, top = axes.get_ylim()
     text_y = (top - bottom) * 0.1
     axes.axvline(x=self.angstrom, color=self.color())
@@ -97,13 +112,36 @@ class ElementLine:
         rotation='vertical', verticalalignment='bottom')
 
 
+element_lines = {
+  'Ha': ElementLine(6563, r'H$\alpha$'),
+  'Hb': ElementLine(4861, r'H$\beta$'),
+  'Hg': ElementLine(4341, r'H$\gamma$'),
+  'Hd': ElementLine(4102, r'H$\delta$'),
+  'CaH': ElementLine(3968, 'Ca H'),
+  'CaK': ElementLine(3934, 'Ca K'),
+}
+
+
+def element_line(definition):
+  # A line from the catalogue by name, or given as wavelength:label
+  if ":" in definition:
+    wavelength, label = definition.split(":")
+    return ElementLine(float(wavelength), label)
+  else:
+    return element_lines[definition]
+
+
 class Plotable:
 
   can_plot_image = False
   grayscale = False
   linestyle = '-'
+  calibration = False
+  _wavelengths = None
 
-  def plot_onto(self, axes, offset = 0):
+  def plot_onto(self, axes, offset = 0, downsample = None):
+    # With a downsampling method only about as many points as the axes are
+    # wide are plotted, and they are recomputed when the axes are zoomed.
     plot_args = {'label': self.label, 'linestyle': self.linestyle}
 
     if self.grayscale:
@@ -111,7 +149,11 @@ class Plotable:
 
     data = self.data() + offset
 
-    axes.plot(self.wavelengths(), data, **plot_args)
+    if downsample and downsample != 'none':
+      downsampling.DownsampledLine(axes, self.wavelengths(), data, downsample,
+        **plot_args)
+    else:
+      axes.plot(self.wavelengths(), data, **plot_args)
 
   def max(self):
     return self.data().max()
@@ -124,30 +166,74 @@ class Plotable:
   def interpolate_to(self, spectra):
     return np.interp(spectra.wavelengths(), self.wavelengths(), self.data())
 
+  def set_calibration(self, calibration):
+    self.calibration = calibration
+    self._wavelengths = None
+
+  def wavelengths(self):
+    # The wavelength axis is computed once per calibration and shared by
+    # every caller, so it is returned read only.
+    if self._wavelengths is None:
+      self._wavelengths = self.calculate_wavelengths()
+      self._wavelengths.flags.writeable = False
+    return self._wavelengths
+
+  def calculate_wavelengths(self):
+    pixels = np.arange(len(self.data()), dtype=float)
+    if self.calibration:
+      return self.calibration.angstrom(pixels)
+    else:
+      return pixels
+
 
 class ImageSpectra(Plotable):
 
   label = 'Raw data'
-  calibration = False
   can_plot_image = True
+  region = None
 
   def __init__(self, data):
+    self.set_raw(data)
+
+  def set_raw(self, data):
     self.raw = data
+    self.invalidate()
 
-  def data(self):
-    return self.raw.sum(axis=0)
+  def set_region(self, top, bottom):
+    # Only rows top:bottom of the raw image are summed into the profile
+    self.region = (top, bottom)
+    self.invalidate()
 
-  def set_calibration(self, calibration):
-    self.calibration = calibration
+  def invalidate(self):
+    self._data = None
+    self._wavelengths = None
 
-  def wavelengths(self):
-    if self.calibration:
-      return [self.calibration.angstrom(i) for i in range(len(self.data()))]
+  def data(self):
+    # Collapsing the raw image is the expensive part of every Plotable
+    # method, so the profile is cached until set_raw or set_region.
+    if self._data is None:
+      if self.region:
+        top, bottom = self.region
+        rows = self.raw[top:bottom]
+      else:
+        rows = self.raw
+      self._data = rows.sum(axis=0)
+      self._data.flags.writeable = False
+    return self._data
+
+  def plot_image_onto(self, axes, max_pixels = None):
+    # Large images are shown as a block averaged preview of at most
+    # max_pixels pixels, still in raw pixel coordinates.
+    preview, factor = self.raw, 1
+    if max_pixels:
+      preview, factor = downsampling.decimate_image(self.raw, max_pixels)
+
+    if factor == 1:
+      imgplot = axes.imshow(preview)
     else:
-      return range(len(self.data()))
-
-  def plot_image_onto(self, axes):
-    imgplot = axes.imshow(self.raw)
+      rows, columns = preview.shape
+      imgplot = axes.imshow(preview, extent=(-0.5, columns * factor - 0.5,
+        rows * factor - 0.5, -0.5))
     imgplot.set_cmap('gray')
 
   def set_label_header(self, label_header):
@@ -160,10 +246,7 @@ class BessSpectra(Plotable):
 
   def __init__(self, hdulist):
     self.hdulist = hdulist
-    self.calibration = SinglePointCalibration(
-      CalibrationReference(self.get_header('CRPIX1'), self.get_header('CRVAL1')),
-      self.get_header('CDELT1')
-    )
+    self.calibration = calibration_from_header(self.header())
     self.set_label()
 
   def set_label(self):
@@ -174,20 +257,117 @@ class BessSpectra(Plotable):
     self.label_header = label_header
     self.set_label()
 
-  def plot_image_onto(self, axes):
+  def plot_image_onto(self, axes, max_pixels = None):
     return False
 
   def header(self):
-    return self.hdulist[0].header
+    return fitsaccess.image_hdu(self.hdulist).header
 
   def get_header(self, header):
     return self.header()[header]
 
-  def wavelengths(self):
-    return [self.calibration.angstrom(i) for i in range(len(self.data()))]
-
   def data(self):
-    return self.hdulist[0].data
+    return fitsaccess.image_hdu(self.hdulist).data
+
+def interpolate_rows(x, xp, fp):
+  # np.interp for every row of the 2D arrays xp and fp at once.  Each row is
+  # shifted into its own interval so a single searchsorted finds the
+  # neighbours for all rows.
+  x = np.asarray(x, dtype=float)
+  xp = np.asarray(xp, dtype=float)
+  fp = np.asarray(fp, dtype=float)
+  rows, length = xp.shape
+
+  low = min(xp.min(), x.min())
+  span = max(xp.max(), x.max()) - low + 1
+  shift = (np.arange(rows) * span)[:, np.newaxis]
+  index = np.searchsorted((xp - low + shift).ravel(), (x - low + shift).ravel())
+  index = index.reshape((rows, len(x))) - (np.arange(rows) * length)[:, np.newaxis]
+  index = index.clip(1, length - 1)
+
+  row = np.arange(rows)[:, np.newaxis]
+  x0 = xp[row, index - 1]
+  x1 = xp[row, index]
+  f0 = fp[row, index - 1]
+  f1 = fp[row, index]
+  interpolated = f0 + (x - x0) * (f1 - f0) / (x1 - x0)
+
+  interpolated = np.where(x < xp[:, :1], fp[:, :1], interpolated)
+  return np.where(x > xp[:, -1:], fp[:, -1:], interpolated)
+
+
+def interpolate_many(wavelengths, spectra):
+  # Interpolate every spectra onto wavelengths, returning one row each
+  lengths = set(len(s.data()) for s in spectra)
+  if len(lengths) == 1:
+    return interpolate_rows(
+      wavelengths,
+      [s.wavelengths() for s in spectra],
+      [s.data() for s in spectra]
+    )
+  else:
+    return np.array(
+      [np.interp(wavelengths, s.wavelengths(), s.data()) for s in spectra]
+    )
+
+
+def scipy_interpolate():
+  import scipy.interpolate
+  return scipy.interpolate
+
+
+class ResponseCurve:
+
+  def __init__(self, observed, reference, smoothing = 20, k = 1):
+    self.tck = scipy_interpolate().splrep(
+      observed.wavelengths(), observed.divide_by(reference), s=smoothing, k=k
+    )
+
+  def evaluate(self, wavelengths):
+    return scipy_interpolate().splev(wavelengths, self.tck)
+
+
+# Fitted response curves, keyed on the content of the spectra and the
+# correction parameters, so a curve is refitted when either spectra's data
+# or calibration changes and the spectra themselves are not kept alive.
+# Only the most recently used curves are kept.
+MAX_RESPONSE_CURVES = 32
+_response_curves = collections.OrderedDict()
+
+def spectra_digest(spectra):
+  sha = hashlib.sha1()
+  for values in (spectra.wavelengths(), spectra.data()):
+    sha.update(str(values.dtype))
+    sha.update(str(values.shape))
+    sha.update(np.ascontiguousarray(values).data)
+  return sha.hexdigest()
+
+def response_curve(observed, reference, smoothing = 20, k = 1):
+  key = (spectra_digest(observed), spectra_digest(reference), smoothing, k)
+  curve = _response_curves.pop(key, None)
+  if curve is None:
+    curve = ResponseCurve(observed, reference, smoothing, k)
+  _response_curves[key] = curve
+  while len(_response_curves) > MAX_RESPONSE_CURVES:
+    _response_curves.popitem(last=False)
+  return curve
+
+def clear_response_curves():
+  _response_curves.clear()
+
+
+def correct_many(reference, targets, observed = None, smoothing = 20, k = 1):
+  # Correct every target for the instrument response fitted from observed
+  # (the first target by default) against reference.  Returns the shared
+  # wavelength grid and a 2D array with one corrected spectra per row.
+  if observed is None:
+    observed = targets[0]
+
+  wavelengths = observed.wavelengths()
+  curve = response_curve(observed, reference, smoothing, k)
+  data = interpolate_many(wavelengths, targets)
+  return wavelengths, data / curve.evaluate(wavelengths)
+
 
 class CorrectedSpectra(Plotable):
 
@@ -210,7 +390,7 @@ class CorrectedSpectra(Plotable):
     return np.divide(self.uncorrected.data(), self.smoothed())
 
   def smoothed(self):
-    tck = scipy.interpolate.splrep(
-      self.wavelengths(), self.divided(), s=self.smoothing, k=self.k
+    curve = response_curve(
+      self.uncorrected, self.reference, self.smoothing, self.k
     )
-    return scipy.interpolate.splev(self.wavelengths(), tck)
+    return curve.evaluate(self.wavelengths())
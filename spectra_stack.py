@@ -1,42 +1,71 @@
 #! /usr/bin/env python
 
 import pyfits
+import fitsaccess
 import numpy as np
 import argparse
 import specreduce
+import resample
+import stacking
+import instrument
 
 parser = argparse.ArgumentParser(description='Stack spectra files')
 parser.add_argument('master', type=str)
 parser.add_argument('file', type=str, nargs='+')
 parser.add_argument('--outfile', '-o', type=str, required=True)
+parser.add_argument('--method', type=str, default='mean',
+    choices=stacking.COMBINE_METHODS, help='Combine method (default: mean)')
+parser.add_argument('--sigma', type=float, default=3.0,
+    help='Rejection threshold for sigclip in standard deviations')
+parser.add_argument('--nlow', type=int, default=1,
+    help='Number of low values to reject for minmax')
+parser.add_argument('--nhigh', type=int, default=1,
+    help='Number of high values to reject for minmax')
+parser.add_argument('--flux', action='store_true',
+    help='Use flux conserving rather than linear resampling')
+parser.add_argument('--align', type=str, default='none',
+    choices=resample.ALIGN_METHODS,
+    help='Cross correlate each spectra against the master and shift it by a '
+      'constant wavelength (linear) or velocity (log) before stacking '
+      '(default: none)')
+parser.add_argument('--max-shift', type=float, default=20,
+    help='Largest shift in pixels --align may find (default: 20)')
 
 args = parser.parse_args()
 
-data = []
-master = specreduce.BessSpectra(pyfits.open(args.master))
-header = master.hdulist[0].header
+with instrument.stage('spectra_stack', args.outfile) as timer:
+  master = specreduce.BessSpectra(pyfits.open(args.master))
+  header = master.header()
 
-if 'EXPTIME' in header:
-  exptime = float(header['EXPTIME'])
-else:
-  exptime = 0.0
+  if 'EXPTIME' in header:
+    exptime = float(header['EXPTIME'])
+  else:
+    exptime = 0.0
 
-data.append(master.data())
+  spectra = []
 
-crvals = []
+  for f in args.file:
+    s = specreduce.BessSpectra(pyfits.open(f))
+    spectra.append(s)
+    if 'EXPTIME' in s.header():
+      exptime += float(s.header()['EXPTIME'])
 
-for f in args.file:
-  s = specreduce.BessSpectra(pyfits.open(f))
-  data.append(s.interpolate_to(master))
-  if 'EXPTIME' in s.header():
-    exptime += float(s.header()['EXPTIME'])
+  resampled, shifts = resample.aligned_resample_many(spectra, master,
+    args.flux, args.align, args.max_shift)
+  if args.align != 'none':
+    for f, shift in zip(args.file, shifts):
+      print '%s: shifted %.3f pixels' % (f, shift)
 
-dtype = master.hdulist[0].data.dtype.name
-mean_crval = np.mean(crvals)
+  data = np.vstack((master.data(), resampled))
 
-print 'Stacked %d frames' % (len(data))
+  dtype = master.data().dtype.name
 
-stacked = np.mean(data, axis=0)
-header.update('NBADD', len(data), 'Number of coadded frames')
-header.update('EXPTIME', exptime)
-pyfits.writeto(args.outfile, stacked.astype(dtype), header)
+  print 'Stacked %d frames' % (len(data))
+
+  stacked = stacking.combine_array(data, args.method, sigma=args.sigma,
+    nlow=args.nlow, nhigh=args.nhigh)
+  header.update('NBADD', len(data), 'Number of coadded frames')
+  header.update('EXPTIME', exptime)
+  timer.note(frames=len(data))
+  timer.add_history(header)
+  fitsaccess.write(args.outfile, stacked.astype(dtype), header)
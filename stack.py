@@ -1,34 +1,63 @@
 #! /usr/bin/env python
 
-import pyfits
+import fitsaccess
 import numpy as np
 import argparse
+import stacking
+import instrument
 
 parser = argparse.ArgumentParser(description='Stack FITS files')
 parser.add_argument('file', type=str, nargs='+')
 parser.add_argument('--outfile', '-o', type=str, required=True)
+parser.add_argument('--memmap', '-m', action='store_true',
+    help='Memory map the input files rather than reading them')
+parser.add_argument('--dtype', type=str, default='input',
+    choices=['input', 'float32'],
+    help='Output data type (default: same as the first input frame)')
+parser.add_argument('--stddev', type=str,
+    help='Also write the per pixel standard deviation to this file (mean only)')
+parser.add_argument('--method', type=str, default='mean',
+    choices=stacking.COMBINE_METHODS, help='Combine method (default: mean)')
+parser.add_argument('--sigma', type=float, default=3.0,
+    help='Rejection threshold for sigclip in standard deviations')
+parser.add_argument('--nlow', type=int, default=1,
+    help='Number of low values to reject for minmax')
+parser.add_argument('--nhigh', type=int, default=1,
+    help='Number of high values to reject for minmax')
+parser.add_argument('--memory', type=int, default=256,
+    help='Memory budget in MB for median, sigclip and minmax (default: 256)')
+parser.add_argument('--threads', type=int,
+    help='Number of threads for combining tiles (default: number of CPUs)')
 
 args = parser.parse_args()
 
-exptime = 0.0
-header = False
+with instrument.stage('stack', args.outfile) as timer:
+  if args.method == 'mean':
+    stack = stacking.RunningStack(squares = bool(args.stddev))
 
-data = []
-for f in args.file:
-  hdulist = pyfits.open(f)
-  if header == False:
-    header = hdulist[0].header
-  if 'EXPTIME' in hdulist[0].header:
-    exptime += float(hdulist[0].header['EXPTIME'])
-  data.append(hdulist[0].data)
+    for f in args.file:
+      stack.add_file(f, args.memmap)
 
-if exptime > 0.0:
-  header.update('EXPTIME', exptime)
+    header = stack.output_header()
+    input_dtype = stack.dtype
+    count = stack.count
+    master = stack.mean()
+  else:
+    cube = stacking.FrameCube(args.file)
+    header = cube.output_header()
+    input_dtype = cube.dtype
+    count = len(cube)
+    master = cube.combine(args.method, args.memory * 2**20, args.threads,
+      sigma=args.sigma, nlow=args.nlow, nhigh=args.nhigh)
+    cube.close()
 
-master = np.mean(data, axis=0)
+  dtype = stacking.output_dtype(input_dtype, args.dtype)
 
-print 'Stacked %d frames' % (len(data))
+  print 'Stacked %d frames' % (count)
 
-pyfits.writeto(
-  args.outfile, master.astype(np.uint8), header, output_verify='fix'
-)
+  timer.note(frames=count)
+  timer.add_history(header)
+  fitsaccess.write(args.outfile, stacking.cast_to(master, dtype), header)
+
+  if args.stddev and args.method == 'mean':
+    fitsaccess.write(args.stddev, stack.stddev().astype(np.float32), header)
@@ -0,0 +1,205 @@
+#
+# Frame stacking helpers shared by stack.py and spectra_stack.py.
+#
+import numpy as np
+import fitsaccess
+from multiprocessing import cpu_count
+from multiprocessing.pool import ThreadPool
+
+
+class RunningStack:
+  # Keeps a float64 running sum (and optionally sum of squares) so frames
+  # can be stacked one at a time in constant memory.
+
+  def __init__(self, squares = False):
+    self.squares = squares
+    self.count = 0
+    self.sum = None
+    self.sum_squares = None
+    self.header = None
+    self.dtype = None
+    self.exptime = 0.0
+
+  def add(self, data, header = None, dtype = None):
+    # dtype is the type of the frame as stored, when data has been converted
+    if self.sum is None:
+      self.sum = np.zeros(data.shape, dtype=np.float64)
+      if self.squares:
+        self.sum_squares = np.zeros(data.shape, dtype=np.float64)
+      self.dtype = data.dtype if dtype is None else np.dtype(dtype)
+    elif data.shape != self.sum.shape:
+      raise ValueError('Frame shape %s does not match stack shape %s' % (
+        data.shape, self.sum.shape))
+
+    self.sum += data
+    if self.squares:
+      self.sum_squares += np.square(data, dtype=np.float64)
+
+    if header is not None:
+      if self.header is None:
+        self.header = header
+      if 'EXPTIME' in header:
+        self.exptime += float(header['EXPTIME'])
+
+    self.count += 1
+
+  def add_file(self, filename, memmap = False):
+    # The input dtype is worked out the same way as for FrameCube
+    with fitsaccess.open_image(filename, memmap) as image:
+      self.add(image.data(np.float64), image.scaled_header(),
+        image.input_dtype())
+
+  def mean(self):
+    return self.sum / self.count
+
+  def stddev(self):
+    if not self.squares:
+      raise ValueError('Stack was not created with squares=True')
+    mean = self.mean()
+    variance = self.sum_squares / self.count - np.square(mean)
+    return np.sqrt(variance.clip(0, None))
+
+  def output_header(self):
+    if self.exptime > 0.0:
+      self.header.update('EXPTIME', self.exptime)
+    return self.header
+
+
+output_dtype = fitsaccess.output_dtype
+cast_to = fitsaccess.cast_to
+
+
+COMBINE_METHODS = ['mean', 'median', 'sigclip', 'minmax']
+
+def combine_tile(cube, method = 'mean', sigma = 3.0, iterations = 5,
+    nlow = 1, nhigh = 1):
+  # Combine a (frames, rows, columns) cube along the frame axis
+  if method == 'mean':
+    return cube.mean(axis=0)
+  elif method == 'median':
+    return np.median(cube, axis=0)
+  elif method == 'sigclip':
+    data = np.array(cube, dtype=np.float64)
+    for i in range(iterations):
+      center = np.nanmedian(data, axis=0)
+      spread = np.nanstd(data, axis=0)
+      reject = np.abs(data - center) > sigma * spread
+      if not reject.any():
+        break
+      data[reject] = np.nan
+    return np.nanmean(data, axis=0)
+  elif method == 'minmax':
+    frames = len(cube)
+    if frames <= nlow + nhigh:
+      raise ValueError('Cannot reject %d low and %d high values from %d frames'
+        % (nlow, nhigh, frames))
+    return np.sort(cube, axis=0)[nlow:frames - nhigh].mean(axis=0)
+  else:
+    raise ValueError('Unknown combine method %s' % (method))
+
+
+def tile_rows(frames, columns, memory, copies = 4):
+  # Number of rows per tile so that the float64 tile and the temporary
+  # copies made while combining it fit in memory bytes.
+  row_bytes = frames * columns * 8 * copies
+  return max(1, int(memory // row_bytes))
+
+
+def combine(read_tile, frames, shape, method = 'mean', memory = 256 * 2**20,
+    threads = None, **kwargs):
+  # Combine frames of the given 2D shape in row tiles.  read_tile(top, bottom)
+  # returns the (frames, bottom - top, columns) cube for those rows.  Tiles
+  # are combined on a thread pool, as numpy releases the GIL while sorting
+  # and reducing.
+  rows, columns = shape
+  step = tile_rows(frames, columns, memory / (threads or cpu_count()))
+  tiles = [(top, min(top + step, rows)) for top in range(0, rows, step)]
+  combined = np.empty(shape, dtype=np.float64)
+
+  def combine_rows(tile):
+    top, bottom = tile
+    combined[top:bottom] = combine_tile(read_tile(top, bottom), method, **kwargs)
+
+  pool = ThreadPool(threads)
+  try:
+    pool.map(combine_rows, tiles)
+  finally:
+    pool.close()
+    pool.join()
+
+  return combined
+
+
+def combine_array(cube, method = 'mean', memory = 256 * 2**20, threads = None,
+    **kwargs):
+  # Combine an in memory (frames, rows, columns) or (frames, length) array
+  cube = np.asarray(cube)
+  if cube.ndim == 2:
+    return combine_array(cube[:, np.newaxis, :], method, memory, threads,
+      **kwargs)[0]
+  return combine(
+    lambda top, bottom: cube[:, top:bottom], len(cube), cube.shape[1:],
+    method, memory, threads, **kwargs
+  )
+
+
+class FrameCube:
+  # A stack of FITS frames opened memory mapped, so a row tile only pages in
+  # those rows of each file.  Scaling is applied per tile rather than by
+  # pyfits, which would otherwise read the whole frame.
+
+  def __init__(self, filenames):
+    self.images = []
+    self.headers = []
+    self.shape = None
+
+    for filename in filenames:
+      image = fitsaccess.open_image(filename)
+      shape = self._rows(image.raw).shape
+      if self.shape is None:
+        self.shape = shape
+        self.data_shape = image.shape
+        self.dtype = image.input_dtype()
+      elif shape != self.shape:
+        raise ValueError('%s has shape %s, expected %s' % (
+          filename, shape, self.shape))
+      self.images.append(image)
+      self.headers.append(image.header)
+
+  def _rows(self, data):
+    # 1D spectra are treated as a single row
+    if data.ndim == 1:
+      return data[np.newaxis]
+    return data
+
+  def __len__(self):
+    return len(self.images)
+
+  def read_tile(self, top, bottom):
+    tile = np.empty((len(self), bottom - top, self.shape[1]), dtype=np.float64)
+    for i, image in enumerate(self.images):
+      tile[i] = self._rows(image.rows(top, bottom, np.float64))
+    return tile
+
+  def exptime(self):
+    return sum(float(h['EXPTIME']) for h in self.headers if 'EXPTIME' in h)
+
+  def output_header(self):
+    # The headers still describe the unscaled data, so drop the scaling
+    header = self.headers[0].copy()
+    for keyword in ('BSCALE', 'BZERO'):
+      if keyword in header:
+        del header[keyword]
+    if self.exptime() > 0.0:
+      header.update('EXPTIME', self.exptime())
+    return header
+
+  def combine(self, method = 'mean', memory = 256 * 2**20, threads = None,
+      **kwargs):
+    combined = combine(self.read_tile, len(self), self.shape, method, memory,
+      threads, **kwargs)
+    return combined.reshape(self.data_shape)
+
+  def close(self):
+    for image in self.images:
+      image.close()
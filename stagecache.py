@@ -0,0 +1,141 @@
+#
+# Content addressed cache of pipeline stage results.  A stage's result is
+# stored under a hash of its input, its parameters and the code that runs
+# it, and the input of every stage after the first is identified by the key
+# of the stage before it.  Changing one parameter therefore changes the keys
+# of that stage and the ones after it, and the earlier results are reused.
+#
+#   cache = stagecache.StageCache('cache', 1024 * 2 ** 20, [pipeline])
+#   keys = cache.chain(cache.input_key(data, header),
+#     [('autocrop', {'padding': 30}), ('bin', {'skywidth': 6})])
+#
+# Results are FITS files in one directory.  Reading one touches its
+# modification time, and when the directory grows past its size cap the
+# least recently used results are removed.
+#
+import hashlib
+import numpy as np
+import os
+import tempfile
+import fitsaccess
+
+SUFFIX = '.fit'
+
+
+def digest(*parts):
+  return hashlib.sha1(repr(parts)).hexdigest()
+
+
+def code_version(modules):
+  # Hash of the source of the modules the stages run
+  sha = hashlib.sha1()
+  for module in modules:
+    filename = module.__file__
+    if filename.endswith('.pyc'):
+      filename = filename[:-1]
+    with open(filename, 'rb') as f:
+      sha.update(f.read())
+  return sha.hexdigest()
+
+
+class StageCache:
+
+  def __init__(self, directory, max_bytes, modules = ()):
+    self.directory = directory
+    self.max_bytes = max_bytes
+    self.version = code_version(modules)
+    # Estimate of the directory size from what this process has written.
+    # Other processes writing to the same directory are not counted, so it
+    # is rescanned before anything is evicted
+    self.size = None
+    if not os.path.isdir(directory):
+      os.makedirs(directory)
+
+  def input_key(self, data, header):
+    sha = hashlib.sha1()
+    sha.update(str(data.dtype))
+    sha.update(str(data.shape))
+    sha.update(np.ascontiguousarray(data).data)
+    sha.update(header.tostring())
+    return sha.hexdigest()
+
+  def key(self, stage, input_key, parameters):
+    return digest(stage, input_key, sorted(parameters.items()), self.version)
+
+  def chain(self, input_key, stages):
+    # Keys of a sequence of (name, parameters) stages run on input_key
+    keys = []
+    for stage, parameters in stages:
+      input_key = self.key(stage, input_key, parameters)
+      keys.append(input_key)
+    return keys
+
+  def path(self, key):
+    return os.path.join(self.directory, key + SUFFIX)
+
+  def get(self, key):
+    # The data and header stored under key, or None
+    path = self.path(key)
+    try:
+      with fitsaccess.open_image(path) as image:
+        result = image.data(fitsaccess.WORKING_DTYPE), image.scaled_header()
+      os.utime(path, None)
+    except (IOError, OSError, ValueError):
+      return None
+    return result
+
+  def latest(self, keys):
+    # The index, data and header of the last of keys with a stored result,
+    # or None
+    for index in reversed(range(len(keys))):
+      if os.path.exists(self.path(keys[index])):
+        result = self.get(keys[index])
+        if result is not None:
+          return (index,) + result
+    return None
+
+  def put(self, key, data, header):
+    # Written under a temporary name and renamed, so other processes never
+    # read a partial result
+    handle, temporary = tempfile.mkstemp(suffix='.tmp', dir=self.directory)
+    os.close(handle)
+    try:
+      fitsaccess.write(temporary, data, header, 'none', clobber=True)
+      os.rename(temporary, self.path(key))
+    except:
+      os.remove(temporary)
+      raise
+
+    if self.size is None:
+      self.size = sum(size for _, size, _ in self.entries())
+    else:
+      self.size += os.path.getsize(self.path(key))
+    if self.size > self.max_bytes:
+      self.evict()
+
+  def entries(self):
+    # Modification time, size and path of every stored result
+    entries = []
+    for name in os.listdir(self.directory):
+      if not name.endswith(SUFFIX):
+        continue
+      path = os.path.join(self.directory, name)
+      try:
+        stat = os.stat(path)
+      except OSError:
+        continue
+      entries.append((stat.st_mtime, stat.st_size, path))
+    return entries
+
+  def evict(self):
+    # Remove the least recently used results until under the size cap
+    entries = sorted(self.entries())
+    self.size = sum(size for _, size, _ in entries)
+    for _, size, path in entries:
+      if self.size <= self.max_bytes:
+        break
+      try:
+        os.remove(path)
+      except OSError:
+        pass
+      self.size -= size
@@ -0,0 +1,76 @@
+import unittest
+import numpy as np
+import pyfits
+import pipeline
+import fitsaccess
+
+def band_frame(centre, rows = 100, columns = 40, width = 3.0):
+  y = np.arange(rows, dtype=float)
+  band = 1000 * np.exp(-0.5 * ((y - centre) / width) ** 2) + 5
+  return np.outer(band, np.ones(columns)).astype('int32')
+
+class DetectBandsTests(unittest.TestCase):
+
+  def testMatchesSingleProfile(self):
+    profiles = np.array([band_frame(c).sum(axis=1) for c in (20, 50.5, 80)])
+    maxima, top, bottom = pipeline.detect_bands(profiles, 0.5)
+    for i, s in enumerate(profiles):
+      expected_top = np.argmax(s > s.max() * 0.5)
+      expected_bottom = expected_top + \
+        np.argmax(s[expected_top:] < s.max() * 0.5)
+      self.assertEqual(top[i], expected_top)
+      self.assertEqual(bottom[i], expected_bottom)
+      self.assertEqual(maxima[i], s.max())
+
+  def testBandRunningOffBottom(self):
+    profile = np.zeros(20)
+    profile[15:] = 10
+    maxima, top, bottom = pipeline.detect_bands(profile, 0.5)
+    self.assertEqual((top[0], bottom[0]), (15, 15))
+
+
+class AutocropTests(unittest.TestCase):
+
+  def testCropsToRowsNotColumns(self):
+    # A frame with more columns than rows, band near the bottom
+    data = band_frame(88, rows=100, columns=300)
+    header = pyfits.Header()
+    cropped = pipeline.autocrop(data, header, 0.5, 10)
+    self.assertEqual(header['cropbot'], 100)
+    self.assertEqual(len(cropped), 100 - header['croptop'])
+
+  def testZeroHeight(self):
+    data = np.ones((50, 10))
+    self.assertRaises(ValueError, pipeline.autocrop, data, pyfits.Header(),
+      0.5, 10)
+
+
+class AutocropFramesTests(unittest.TestCase):
+
+  def setUp(self):
+    self.images = [fitsaccess.FitsImage(pyfits.PrimaryHDU(band_frame(c)))
+      for c in (50, 50.4, 70)]
+
+  def testDetectsEachFrame(self):
+    windows = pipeline.autocrop_frames(self.images, 0.5, 10)
+    for image, window in zip(self.images, windows):
+      header = pyfits.Header()
+      pipeline.autocrop(image.data(), header, 0.5, 10)
+      self.assertEqual(window, (header['croptop'], header['cropbot']))
+
+  def testReferenceWindow(self):
+    reference = fitsaccess.FitsImage(pyfits.PrimaryHDU(band_frame(50)))
+    windows = pipeline.autocrop_frames(self.images, 0.5, 10,
+      reference=reference, tolerance=1)
+    self.assertEqual(windows[0], windows[1])
+    self.assertNotEqual(windows[0], windows[2])
+    header = pyfits.Header()
+    pipeline.autocrop(self.images[2].data(), header, 0.5, 10)
+    self.assertEqual(windows[2], (header['croptop'], header['cropbot']))
+
+
+def main():
+  unittest.main()
+
+if __name__ == '__main__':
+  main()
@@ -1,4 +1,5 @@
 import unittest
+import numpy as np
 import specreduce
 
 class MockReference(object):
@@ -13,11 +14,15 @@ class CalibrationTests(unittest.TestCase):
     self.reference1.angstrom = 0
     self.reference2.pixel = 1000
     self.reference2.angstrom = 1000
-    self.c = specreduce.Calibration(self.reference1, self.reference2)
+    self.c = specreduce.DoublePointCalibration(self.reference1, self.reference2)
 
   def testAngstrom(self):
     self.assertEqual(self.c.angstrom(100), 100)
 
+  def testAngstromArray(self):
+    angstroms = self.c.angstrom(np.array([0, 100, 500]))
+    self.assertEqual(angstroms.tolist(), [0, 100, 500])
+
   def testAngstromPerPixel(self):
     self.assertEqual(self.c.angstrom_per_pixel(), 1)
 
@@ -25,6 +30,40 @@ class CalibrationTests(unittest.TestCase):
     self.assertEqual(self.c.__repr__(), "<Calibration angstrom_per_pixel: 1.000000>")
 
 
+class SinglePointCalibrationTests(unittest.TestCase):
+
+  def setUp(self):
+    reference = MockReference()
+    reference.pixel = 100
+    reference.angstrom = 0
+    self.c = specreduce.SinglePointCalibration(reference, 2.0)
+
+  def testAngstrom(self):
+    self.assertEqual(self.c.angstrom(150), 100)
+
+  def testAngstromArray(self):
+    angstroms = self.c.angstrom(np.arange(99, 102))
+    self.assertEqual(angstroms.tolist(), [-2, 0, 2])
+
+
+class SpectraWavelengthTests(unittest.TestCase):
+
+  def setUp(self):
+    self.s = specreduce.ImageSpectra(np.ones((2, 4)))
+
+  def testUncalibrated(self):
+    self.assertEqual(self.s.wavelengths().tolist(), [0, 1, 2, 3])
+
+  def testCached(self):
+    self.assertTrue(self.s.wavelengths() is self.s.wavelengths())
+
+  def testSetCalibrationInvalidates(self):
+    self.s.wavelengths()
+    reference = specreduce.CalibrationReference(0, 4000)
+    self.s.set_calibration(specreduce.SinglePointCalibration(reference, 10))
+    self.assertEqual(self.s.wavelengths().tolist(), [4000, 4010, 4020, 4030])
+
+
 def main():
   unittest.main()
 
@@ -0,0 +1,90 @@
+import unittest
+import os
+import shutil
+import tempfile
+import numpy as np
+import pyfits
+import calibration_library
+import pipeline
+
+def header(**cards):
+  h = pyfits.Header()
+  for keyword, value in cards.items():
+    h[keyword.replace('_', '-')] = value
+  return h
+
+class CalibrationLibraryTests(unittest.TestCase):
+
+  def setUp(self):
+    self.library = calibration_library.CalibrationLibrary()
+    self.short = calibration_library.MasterFrame(
+      'dark', np.ones((2, 2)), header(EXPTIME=10, CCD_TEMP=-10))
+    self.long = calibration_library.MasterFrame(
+      'dark', np.ones((2, 2)) * 4, header(EXPTIME=60, CCD_TEMP=-10))
+    self.library.add(self.short)
+    self.library.add(self.long)
+
+  def testFindClosestExptime(self):
+    found = self.library.find('dark', header(EXPTIME=50, CCD_TEMP=-10), (2, 2))
+    self.assertTrue(found is self.long)
+
+  def testTemperatureTolerance(self):
+    found = self.library.find('dark', header(EXPTIME=10, CCD_TEMP=5), (2, 2))
+    self.assertEqual(found, None)
+
+  def testBinningMustMatch(self):
+    found = self.library.find('dark', header(EXPTIME=10, XBINNING=2), (2, 2))
+    self.assertEqual(found, None)
+
+  def testScaledDark(self):
+    dark, master = self.library.dark_for(header(EXPTIME=45), (2, 2))
+    self.assertTrue(master is self.long)
+    self.assertEqual(dark.tolist(), [[3, 3], [3, 3]])
+
+  def testCalibrateInFloat(self):
+    data = np.array([[0, 10], [20, 30]], dtype=np.uint8)
+    calibrated = self.library.calibrate(data, header(EXPTIME=10))
+    self.assertEqual(calibrated.dtype, np.float32)
+    self.assertEqual(calibrated.tolist(), [[-1, 9], [19, 29]])
+
+  def testCalibrateInPlace(self):
+    data = np.array([[0, 10], [20, 30]], dtype=np.float32)
+    calibrated = self.library.calibrate(data, header(EXPTIME=10), out=data)
+    self.assertTrue(calibrated is data)
+    self.assertEqual(data.tolist(), [[-1, 9], [19, 29]])
+
+  def testCalibrateWithoutDark(self):
+    self.assertRaises(ValueError, self.library.calibrate, np.zeros((3, 3)),
+      header(EXPTIME=10))
+
+
+class AddPathTests(unittest.TestCase):
+
+  def setUp(self):
+    self.directory = tempfile.mkdtemp()
+    for name, imagetyp in (('flat.fit', None), ('dark.fit', 'Master Dark')):
+      cards = header(EXPTIME=10)
+      if imagetyp:
+        cards['IMAGETYP'] = imagetyp
+      pyfits.writeto(os.path.join(self.directory, name),
+        np.ones((2, 2), dtype=np.float32), cards)
+
+  def tearDown(self):
+    shutil.rmtree(self.directory)
+
+  def testDirectoryKind(self):
+    library = calibration_library.CalibrationLibrary()
+    library.add_path(self.directory, 'flat')
+    kinds = dict((os.path.basename(m.filename), m.kind)
+      for m in library.masters)
+    self.assertEqual(kinds, {'flat.fit': 'flat', 'dark.fit': 'dark'})
+
+  def testFlatNeedsDark(self):
+    self.assertRaises(ValueError, pipeline.load_library, None, self.directory)
+
+
+def main():
+  unittest.main()
+
+if __name__ == '__main__':
+  main()
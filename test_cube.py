@@ -0,0 +1,103 @@
+import unittest
+import os
+import shutil
+import tempfile
+import numpy as np
+import pyfits
+import cube
+import specreduce
+
+class SpectralCubeTests(unittest.TestCase):
+
+  def setUp(self):
+    self.directory = tempfile.mkdtemp()
+    self.cube = cube.create(os.path.join(self.directory, 'test.cube'),
+      4000, 5000, 5.0)
+    self.filenames = []
+    # Written out of time order, at two different calibrations
+    for day, crval1 in [(3, 4000.0), (1, 3990.0), (2, 4000.0)]:
+      self.filenames.append(self.write_spectra(day, crval1))
+
+  def tearDown(self):
+    self.cube.close()
+    shutil.rmtree(self.directory)
+
+  def write_spectra(self, day, crval1):
+    header = pyfits.Header()
+    header.update('CRVAL1', crval1)
+    header.update('CRPIX1', 1.0)
+    header.update('CDELT1', 2.0)
+    header.update('DATE-OBS', '2013-08-%02dT21:30:00' % (day))
+    header.update('OBJECT', 'Fomalhaut')
+    filename = os.path.join(self.directory, 'd%d.fit' % (day))
+    pyfits.writeto(filename, np.arange(400, dtype=float) + day, header)
+    return filename
+
+  def testGrid(self):
+    self.assertEqual(self.cube.length, 201)
+    self.assertEqual(self.cube.wavelengths()[-1], 5000)
+    self.assertEqual(self.cube.columns(4012, 4020), slice(3, 5))
+    self.assertEqual(self.cube.columns(None, 9000), slice(0, 201))
+
+  def testAdd(self):
+    self.assertEqual(self.cube.add(self.filenames), 3)
+    self.assertEqual(self.cube.add(self.filenames[:1]), 0)
+    self.assertEqual(len(self.cube), 3)
+    self.assertEqual(self.cube.data().shape, (3, 201))
+
+  def testResampled(self):
+    self.cube.add(self.filenames)
+    spectra = specreduce.BessSpectra(pyfits.open(self.filenames[1]))
+    expected = np.interp(self.cube.wavelengths(), spectra.wavelengths(),
+      spectra.data())
+    inside = self.cube.wavelengths() <= spectra.wavelengths()[-1]
+    self.assertTrue(np.allclose(self.cube.data()[1][inside], expected[inside]))
+    self.assertTrue(np.isnan(self.cube.data()[1][~inside]).all())
+
+  def testOutsideSpectra(self):
+    self.cube.add(self.filenames[:1])
+    # By the CRPIX1 convention the spectra covers 3998 to 4796
+    row = self.cube.data()[0]
+    self.assertFalse(np.isnan(row[0]))
+    self.assertTrue(np.isnan(row[-1]))
+    self.assertEqual(np.isnan(row).sum(), 41)
+
+  def testQuery(self):
+    self.cube.add(self.filenames)
+    dates, wavelengths, flux = self.cube.query(after='2013-08-02',
+      min=4100, max=4200)
+    self.assertEqual(dates, ['2013-08-02T21:30:00', '2013-08-03T21:30:00'])
+    self.assertEqual((wavelengths[0], wavelengths[-1]), (4100, 4200))
+    self.assertEqual(flux.shape, (2, 21))
+    # Day 2 was added after day 3
+    self.assertTrue(np.allclose(flux[1] - flux[0], 1))
+
+  def testReopen(self):
+    self.cube.add(self.filenames)
+    self.cube.close()
+    self.cube = cube.SpectralCube(os.path.join(self.directory, 'test.cube'))
+    self.assertEqual(self.cube.rows()[1][0], '2013-08-01T21:30:00')
+    self.assertEqual(self.cube.data().shape, (3, 201))
+
+  def testExport(self):
+    self.cube.add(self.filenames)
+    columns = self.cube.columns(4100, 4200)
+    dates, wavelengths, flux = self.cube.query(min=4100, max=4200)
+    filename = os.path.join(self.directory, cube.export_filename(dates[0]))
+    self.cube.export(dates[0], flux[0], columns, filename)
+
+    spectra = specreduce.BessSpectra(pyfits.open(filename))
+    self.assertEqual(spectra.header()['OBJECT'], 'Fomalhaut')
+    self.assertTrue(np.allclose(spectra.wavelengths(), wavelengths))
+    self.assertTrue(np.allclose(spectra.data(), flux[0]))
+
+  def testCreateExisting(self):
+    self.assertRaises(IOError, cube.create,
+      os.path.join(self.directory, 'test.cube'), 4000, 5000, 5.0)
+
+
+def main():
+  unittest.main()
+
+if __name__ == '__main__':
+  main()
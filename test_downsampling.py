@@ -0,0 +1,142 @@
+import unittest
+import numpy as np
+import downsampling
+
+class MinMaxTests(unittest.TestCase):
+
+  def setUp(self):
+    self.x = np.arange(10000, dtype=float)
+    self.y = np.random.RandomState(0).normal(0, 1, 10000)
+    self.y[1234] = 50
+    self.y[8765] = -50
+
+  def testKeepsExtremes(self):
+    x, y = downsampling.minmax(self.x, self.y, 100)
+    self.assertTrue(len(y) <= 200)
+    self.assertEqual(y.max(), 50)
+    self.assertEqual(y.min(), -50)
+    self.assertTrue(1234 in x and 8765 in x)
+
+  def testBucketEnvelope(self):
+    x, y = downsampling.minmax(self.x, self.y, 100)
+    for bucket in range(100):
+      values = self.y[bucket * 100:(bucket + 1) * 100]
+      self.assertEqual(sorted(y[bucket * 2:bucket * 2 + 2]),
+        [values.min(), values.max()])
+
+  def testOrdered(self):
+    x, y = downsampling.minmax(self.x[:997], self.y[:997], 50)
+    self.assertTrue(np.all(np.diff(x) >= 0))
+    self.assertTrue(x.max() <= 996)
+
+  def testShortSpectra(self):
+    x, y = downsampling.minmax(self.x[:150], self.y[:150], 100)
+    self.assertEqual(len(y), 150)
+
+
+class LttbTests(unittest.TestCase):
+
+  def testThreshold(self):
+    x = np.arange(5000, dtype=float)
+    y = np.sin(x / 100)
+    y[2500] = 10
+    sx, sy = downsampling.lttb(x, y, 200)
+    self.assertEqual(len(sx), 200)
+    self.assertEqual((sx[0], sx[-1]), (0, 4999))
+    self.assertTrue(np.all(np.diff(sx) > 0))
+    self.assertTrue(2500 in sx)
+
+  def testShortSpectra(self):
+    x = np.arange(100, dtype=float)
+    self.assertEqual(len(downsampling.lttb(x, x, 200)[0]), 100)
+
+
+class DownsampleTests(unittest.TestCase):
+
+  def testVisible(self):
+    x = np.arange(100, dtype=float)
+    section = downsampling.visible(x, 10.5, 20.5)
+    self.assertEqual((x[section][0], x[section][-1]), (10, 21))
+
+  def testUnknownMethod(self):
+    x = np.arange(10)
+    self.assertRaises(ValueError, downsampling.downsample, x, x, 4, 'mean')
+
+  def testDecimateImage(self):
+    data = np.arange(100 * 60, dtype=float).reshape(100, 60)
+    preview, factor = downsampling.decimate_image(data, 1000)
+    self.assertEqual(factor, 3)
+    self.assertEqual(preview.shape, (33, 20))
+    self.assertEqual(preview[0, 0], data[:3, :3].mean())
+
+  def testSmallImage(self):
+    data = np.ones((10, 10))
+    preview, factor = downsampling.decimate_image(data, 1000)
+    self.assertTrue(preview is data)
+    self.assertEqual(factor, 1)
+
+
+class DownsampledLineTests(unittest.TestCase):
+
+  def testZoom(self):
+    import matplotlib
+    matplotlib.use('Agg')
+    import matplotlib.pyplot as plt
+
+    figure = plt.figure()
+    axes = figure.add_subplot(111)
+    x = np.arange(100000, dtype=float)
+    line = downsampling.DownsampledLine(axes, x, np.sin(x / 10))
+    full = len(line.line.get_xdata())
+    self.assertTrue(full < 10000)
+
+    axes.set_xlim(1000, 1100)
+    zoomed = line.line.get_xdata()
+    self.assertTrue(zoomed[0] <= 1000 and zoomed[-1] >= 1100)
+    self.assertEqual(len(zoomed), 103)
+    plt.close(figure)
+
+  def resizeCallbacks(self, figure):
+    return len(figure.canvas.callbacks.callbacks.get('resize_event', {}))
+
+  def testRedrawDoesNotConnect(self):
+    import matplotlib
+    matplotlib.use('Agg')
+    import matplotlib.pyplot as plt
+
+    figure = plt.figure()
+    before = self.resizeCallbacks(figure)
+    x = np.arange(1000, dtype=float)
+    for i in range(5):
+      figure.clf()
+      downsampling.DownsampledLine(figure.add_subplot(111), x, x)
+    self.assertEqual(self.resizeCallbacks(figure), before)
+    plt.close(figure)
+
+  def testResizeDisconnectsClearedLines(self):
+    import matplotlib
+    matplotlib.use('Agg')
+    import matplotlib.pyplot as plt
+
+    interactive_backend = downsampling.interactive_backend
+    downsampling.interactive_backend = lambda: True
+    try:
+      figure = plt.figure()
+      before = self.resizeCallbacks(figure)
+      x = np.arange(1000, dtype=float)
+      for i in range(5):
+        figure.clf()
+        downsampling.DownsampledLine(figure.add_subplot(111), x, x)
+      self.assertEqual(self.resizeCallbacks(figure), before + 5)
+      figure.canvas.resize_event()
+      self.assertEqual(self.resizeCallbacks(figure), before + 1)
+      plt.close(figure)
+    finally:
+      downsampling.interactive_backend = interactive_backend
+
+
+def main():
+  unittest.main()
+
+if __name__ == '__main__':
+  main()
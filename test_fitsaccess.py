@@ -0,0 +1,145 @@
+import unittest
+import os
+import shutil
+import tempfile
+import numpy as np
+import pyfits
+from pyfits.hdu.compressed import COMPRESSION_SUPPORTED
+import fitsaccess
+
+class FitsImageTests(unittest.TestCase):
+
+  def setUp(self):
+    self.directory = tempfile.mkdtemp()
+    self.filename = os.path.join(self.directory, 'frame.fit')
+    # Unsigned 16 bit data is stored with BZERO 32768
+    self.data = (np.arange(60 * 40).reshape(60, 40) * 20).astype('uint16')
+    header = pyfits.Header()
+    header.update('DATE-OBS', '2013-08-20T21:30:00')
+    pyfits.writeto(self.filename, self.data, header)
+    self.image = fitsaccess.open_image(self.filename)
+
+  def tearDown(self):
+    self.image.close()
+    shutil.rmtree(self.directory)
+
+  def testScaledLikePyfits(self):
+    expected = pyfits.getdata(self.filename)
+    data = self.image.data()
+    self.assertEqual(data.dtype, expected.dtype)
+    np.testing.assert_array_equal(data, expected)
+
+  def testRows(self):
+    np.testing.assert_array_equal(self.image.rows(20, 25), self.data[20:25])
+
+  def testColumns(self):
+    np.testing.assert_array_equal(self.image.columns(5, 8), self.data[:, 5:8])
+
+  def testSection(self):
+    np.testing.assert_array_equal(
+      self.image.section(slice(3, 9), slice(10, 12), np.float64),
+      self.data[3:9, 10:12])
+
+  def testSums(self):
+    np.testing.assert_array_equal(self.image.row_profile(),
+      self.data.sum(axis=1))
+    np.testing.assert_array_equal(self.image.column_sums(10, 20),
+      self.data[10:20].sum(axis=0))
+
+  def testScaledHeader(self):
+    self.assertTrue('BZERO' in self.image.header)
+    self.assertFalse('BZERO' in self.image.scaled_header())
+
+  def testHeader(self):
+    header = fitsaccess.header(self.filename)
+    self.assertEqual(header['DATE-OBS'], '2013-08-20T21:30:00')
+
+  def testWriteDtype(self):
+    filename = os.path.join(self.directory, 'int.fit')
+    fitsaccess.write(filename, np.array([-1.0, 1.6, 40000.0]), dtype='int16')
+    self.assertEqual(pyfits.getdata(filename).tolist(), [-1, 2, 32767])
+
+  def testWriteUint8(self):
+    filename = os.path.join(self.directory, 'byte.fit')
+    fitsaccess.write(filename, np.array([-3.0, 7.4, 300.0]), dtype='uint8')
+    self.assertEqual(pyfits.getdata(filename).tolist(), [0, 7, 255])
+
+  def testOutputDtype(self):
+    input_dtype = self.image.input_dtype()
+    self.assertEqual(fitsaccess.output_dtype(input_dtype), np.uint16)
+    self.assertEqual(fitsaccess.output_dtype(input_dtype, 'float32'),
+      np.float32)
+
+  def testSpectraColumns(self):
+    filename = os.path.join(self.directory, 'spectra.fit')
+    spectra = np.arange(100, dtype='int32')
+    pyfits.writeto(filename, spectra)
+    with fitsaccess.open_image(filename) as image:
+      np.testing.assert_array_equal(image.columns(10, 20), spectra[10:20])
+      self.assertEqual(image.data().dtype, pyfits.getdata(filename).dtype)
+
+  def testImageFile(self):
+    image = fitsaccess.ImageFile(self.filename)
+    np.testing.assert_array_equal(image.row_profile(10, 20),
+      self.image.row_profile(10, 20))
+
+
+@unittest.skipIf(not COMPRESSION_SUPPORTED, 'pyfits built without compression')
+class CompressionTests(unittest.TestCase):
+
+  def setUp(self):
+    self.directory = tempfile.mkdtemp()
+    self.filename = os.path.join(self.directory, 'frame.fit')
+    self.header = pyfits.Header()
+    self.header.update('DATE-OBS', '2013-08-20T21:30:00')
+
+  def tearDown(self):
+    shutil.rmtree(self.directory)
+
+  def roundTrip(self, data, compression):
+    fitsaccess.write(self.filename, data, self.header, compression,
+      clobber=True)
+    with fitsaccess.open_image(self.filename) as image:
+      return image.data()
+
+  def testLosslessFrames(self):
+    for dtype in ('uint8', 'int16', 'uint16', 'int32', 'float32'):
+      data = (np.arange(30 * 20).reshape(30, 20) * 7 % 251).astype(dtype)
+      np.testing.assert_array_equal(self.roundTrip(data, 'lossless'), data)
+
+  def testLosslessSpectra(self):
+    spectra = np.sin(np.linspace(0, 10, 500))
+    np.testing.assert_array_equal(self.roundTrip(spectra, 'lossless'), spectra)
+
+  def testQuantizedSpectra(self):
+    noise = np.random.RandomState(0).normal(0, 0.01, 500)
+    spectra = np.sin(np.linspace(0, 10, 500)) + noise
+    quantized = self.roundTrip(spectra, 'quantize')
+    self.assertFalse(np.array_equal(quantized, spectra))
+    self.assertTrue(np.abs(quantized - spectra).max() < 0.01)
+
+  def testHeader(self):
+    self.roundTrip(np.zeros(10, dtype='int32'), 'lossless')
+    self.assertEqual(pyfits.open(self.filename)[0].header['NAXIS'], 0)
+    header = fitsaccess.header(self.filename)
+    self.assertEqual(header['DATE-OBS'], '2013-08-20T21:30:00')
+
+  def testEnvironment(self):
+    os.environ[fitsaccess.COMPRESSION_ENVIRONMENT] = 'lossless'
+    try:
+      fitsaccess.write(self.filename, np.zeros(10, dtype='int32'))
+    finally:
+      del os.environ[fitsaccess.COMPRESSION_ENVIRONMENT]
+    self.assertTrue(isinstance(pyfits.open(self.filename)[1],
+      pyfits.CompImageHDU))
+
+  def testUnknownMode(self):
+    self.assertRaises(ValueError, fitsaccess.write, self.filename,
+      np.zeros(10), None, 'zip')
+
+
+def main():
+  unittest.main()
+
+if __name__ == '__main__':
+  main()
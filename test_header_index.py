@@ -0,0 +1,40 @@
+import unittest
+import header_index
+
+class QueryTests(unittest.TestCase):
+
+  def setUp(self):
+    self.connection = header_index.connect(':memory:')
+    rows = [
+      ('/a.fit', 'Vega', '2013-08-02T20:00:00', 30.0, 1),
+      ('/b.fit', 'Vega', '2013-08-01T20:00:00', 60.0, 1),
+      ('/c.fit', 'Deneb', '2013-08-03T20:00:00', 30.0, 2),
+    ]
+    for path, object, date_obs, exptime, naxis in rows:
+      self.connection.execute(
+        'INSERT INTO frames (path, object, date_obs, exptime, naxis) '
+        'VALUES (?, ?, ?, ?, ?)', (path, object, date_obs, exptime, naxis))
+
+  def testAllOrderedByDate(self):
+    self.assertEqual(header_index.query(self.connection),
+      ['/b.fit', '/a.fit', '/c.fit'])
+
+  def testObject(self):
+    self.assertEqual(header_index.query(self.connection, object='Vega'),
+      ['/b.fit', '/a.fit'])
+
+  def testDateRange(self):
+    paths = header_index.query(self.connection, after='2013-08-02',
+      before='2013-08-03')
+    self.assertEqual(paths, ['/a.fit'])
+
+  def testExptimeAndNaxis(self):
+    paths = header_index.query(self.connection, exptime_max=30, naxis=1)
+    self.assertEqual(paths, ['/a.fit'])
+
+
+def main():
+  unittest.main()
+
+if __name__ == '__main__':
+  main()
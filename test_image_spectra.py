@@ -0,0 +1,33 @@
+import unittest
+import numpy as np
+import specreduce
+
+class ImageSpectraTests(unittest.TestCase):
+
+  def setUp(self):
+    self.raw = np.arange(12).reshape((3, 4))
+    self.s = specreduce.ImageSpectra(self.raw)
+
+  def testData(self):
+    self.assertEqual(self.s.data().tolist(), [12, 15, 18, 21])
+
+  def testDataCached(self):
+    self.assertTrue(self.s.data() is self.s.data())
+
+  def testSetRegion(self):
+    self.s.data()
+    self.s.set_region(1, 3)
+    self.assertEqual(self.s.data().tolist(), [12, 14, 16, 18])
+
+  def testSetRaw(self):
+    self.s.data()
+    self.s.set_raw(np.ones((2, 2)))
+    self.assertEqual(self.s.data().tolist(), [2, 2])
+    self.assertEqual(self.s.wavelengths().tolist(), [0, 1])
+
+
+def main():
+  unittest.main()
+
+if __name__ == '__main__':
+  main()
@@ -0,0 +1,66 @@
+import json
+import os
+import tempfile
+import unittest
+import pyfits
+import instrument
+
+class StageTimerTests(unittest.TestCase):
+
+  def setUp(self):
+    handle, self.log = tempfile.mkstemp()
+    os.close(handle)
+    instrument.set_log(self.log)
+
+  def tearDown(self):
+    instrument.set_log(None)
+    os.remove(self.log)
+
+  def records(self):
+    with open(self.log) as f:
+      return [json.loads(line) for line in f]
+
+  def testLogsRecord(self):
+    with instrument.stage('bin', 'a.fit'):
+      instrument.note(top=3)
+    record = self.records()[0]
+    self.assertEqual(record['stage'], 'bin')
+    self.assertEqual(record['file'], 'a.fit')
+    self.assertEqual(record['top'], 3)
+    self.assertTrue(record['wall'] >= 0)
+    self.assertTrue(record['peak_rss'] > 0)
+
+  def testLogsError(self):
+    try:
+      with instrument.stage('autocrop'):
+        raise ValueError('zero height')
+    except ValueError:
+      pass
+    self.assertEqual(self.records()[0]['error'], 'zero height')
+
+  def testNoteOutsideStage(self):
+    instrument.note(ignored=True)
+    self.assertEqual(self.records(), [])
+
+  def testAddHistory(self):
+    header = pyfits.Header()
+    with instrument.stage('normalise') as timer:
+      timer.add_history(header)
+    self.assertTrue(str(header['HISTORY']).startswith('normalise: wall'))
+
+  def testBatchHistory(self):
+    headers = [pyfits.Header(), pyfits.Header()]
+    with instrument.stage('autocrop') as timer:
+      timer.note(files=2)
+      history = timer.history()
+      for header in headers:
+        timer.add_history(header, history)
+    self.assertTrue(history.startswith('autocrop batch of 2 files: wall'))
+    self.assertEqual(str(headers[0]['HISTORY']), str(headers[1]['HISTORY']))
+
+
+def main():
+  unittest.main()
+
+if __name__ == '__main__':
+  main()
@@ -0,0 +1,114 @@
+import unittest
+import os
+import shutil
+import tempfile
+import numpy as np
+import pyfits
+import measure
+import specreduce
+
+class MeasureTests(unittest.TestCase):
+
+  def setUp(self):
+    self.wavelengths = np.arange(4000, 7000, 0.5)
+    self.lines = [specreduce.element_lines['Hb'], specreduce.element_lines['Ha']]
+    # Absorption at Hb and emission at Ha, both Gaussian with sigma 4 on a
+    # sloping continuum, with the depth and height varying by spectra
+    self.depths = np.array([0.2, 0.4, 0.6])
+    self.sigma = 4.0
+    continuum = 1 + (self.wavelengths - 4000) / 6000.0
+    self.continuum = continuum
+    flux = []
+    for depth in self.depths:
+      flux.append(continuum * (1 - depth * self.gaussian(4861)) +
+        depth * self.gaussian(6565))
+    self.results = measure.measure(self.wavelengths, flux, self.lines)
+
+  def gaussian(self, centre):
+    return np.exp(-0.5 * ((self.wavelengths - centre) / self.sigma) ** 2)
+
+  def testShape(self):
+    for quantity in measure.QUANTITIES:
+      self.assertEqual(self.results[quantity].shape, (3, 2))
+
+  def testEquivalentWidth(self):
+    expected = self.depths * self.sigma * np.sqrt(2 * np.pi)
+    self.assertTrue(np.allclose(self.results['ew'][:, 0], expected, rtol=1e-3))
+    self.assertTrue(np.all(self.results['ew'][:, 1] < 0))
+
+  def testFlux(self):
+    expected = self.depths * self.sigma * np.sqrt(2 * np.pi)
+    self.assertTrue(np.allclose(self.results['flux'][:, 1], expected,
+      rtol=1e-3))
+    self.assertTrue(np.all(self.results['flux'][:, 0] < 0))
+
+  def testCentroid(self):
+    self.assertTrue(np.allclose(self.results['centroid'][:, 0], 4861,
+      atol=0.05))
+    self.assertTrue(np.allclose(self.results['centroid'][:, 1], 6565,
+      atol=0.05))
+
+  def testFwhm(self):
+    expected = 2 * np.sqrt(2 * np.log(2)) * self.sigma
+    self.assertTrue(np.allclose(self.results['fwhm'], expected, rtol=1e-2))
+
+  def testUnresolved(self):
+    # A line wider than the window never falls to half its peak
+    flux = self.continuum * (1 - 0.5 * np.exp(
+      -0.5 * ((self.wavelengths - 4861) / 200.0) ** 2))
+    results = measure.measure(self.wavelengths, flux, self.lines[:1])
+    self.assertTrue(np.isnan(results['fwhm'][0, 0]))
+
+  def testOutsideSpectra(self):
+    self.assertRaises(ValueError, measure.measure, self.wavelengths,
+      np.ones(len(self.wavelengths)), [specreduce.element_lines['CaK']])
+
+  def testTable(self):
+    rows = measure.table(['a', 'b', 'c'], ['Hb', 'Ha'], self.lines,
+      self.results)
+    self.assertEqual(len(rows), 6)
+    self.assertEqual(rows[3][:3], ['b', 'Ha', 6563])
+
+
+class LoadFilesTests(unittest.TestCase):
+
+  def setUp(self):
+    self.directory = tempfile.mkdtemp()
+    self.filenames = []
+    for i, crval in enumerate((4000.0, 4002.0)):
+      header = pyfits.Header()
+      header.update('CRVAL1', crval)
+      header.update('CRPIX1', 1.0)
+      header.update('CDELT1', 2.0)
+      header.update('DATE-OBS', '2013-08-0%dT21:30:00' % (i + 1))
+      filename = os.path.join(self.directory, 's%d.fit' % (i))
+      pyfits.writeto(filename, np.arange(100, dtype='float32'), header)
+      self.filenames.append(filename)
+
+  def tearDown(self):
+    shutil.rmtree(self.directory)
+
+  def testResampledOntoFirst(self):
+    labels, wavelengths, flux = measure.load_files(self.filenames)
+    self.assertEqual(labels, ['2013-08-01T21:30:00', '2013-08-02T21:30:00'])
+    self.assertEqual(len(wavelengths), 100)
+    # The second spectra starts one pixel further to the red
+    np.testing.assert_allclose(flux[0], np.arange(100))
+    np.testing.assert_allclose(flux[1, 1:], np.arange(99))
+
+
+class ElementLineCatalogueTests(unittest.TestCase):
+
+  def testNamed(self):
+    self.assertEqual(specreduce.element_line('Ha').angstrom, 6563)
+
+  def testCustom(self):
+    line = specreduce.element_line('6678:HeI')
+    self.assertEqual((line.angstrom, line.label), (6678, 'HeI'))
+
+
+def main():
+  unittest.main()
+
+if __name__ == '__main__':
+  main()
@@ -0,0 +1,87 @@
+import unittest
+import argparse
+import os
+import shutil
+import tempfile
+import numpy as np
+import pyfits
+import matplotlib
+matplotlib.use('Agg')
+import quicklook
+import specreduce
+
+class CalibrationArgumentTests(unittest.TestCase):
+
+  def testDoublePoint(self):
+    calibration = quicklook.parse_calibration('100:Ha,200:6663')
+    self.assertTrue(isinstance(calibration, specreduce.DoublePointCalibration))
+    self.assertAlmostEqual(calibration.angstrom(150), 6613)
+
+  def testSinglePoint(self):
+    calibration = quicklook.parse_calibration('100,Hb,10')
+    self.assertTrue(isinstance(calibration, specreduce.SinglePointCalibration))
+    self.assertAlmostEqual(calibration.angstrom(101), 4871)
+
+  def testInvalid(self):
+    self.assertRaises(ValueError, quicklook.parse_calibration, '100,200')
+
+
+class BatchTests(unittest.TestCase):
+
+  def setUp(self):
+    self.directory = tempfile.mkdtemp()
+    header = pyfits.Header()
+    header.update('CRVAL1', 3800.0)
+    header.update('CRPIX1', 1.0)
+    header.update('CDELT1', 10.0)
+    header.update('DATE-OBS', '2013-08-20T21:30:00')
+    for i in range(3):
+      pyfits.writeto(os.path.join(self.directory, 's%d.fit' % (i)),
+        np.sin(np.arange(400) / (20.0 + i)), header)
+    self.args = argparse.Namespace(calibration=None, lines='Ha,Hb',
+      title=None, suptitle=None, crop=False, croprange='3900:7000',
+      headerlabel='DATE-OBS', offset=0.0, grayscale=False,
+      downsample='minmax', preview_pixels=1000000,
+      outdir=os.path.join(self.directory, 'png'), format='png', dpi=50,
+      jobs=1)
+
+  def tearDown(self):
+    shutil.rmtree(self.directory)
+
+  def testExpand(self):
+    filenames = quicklook.expand([os.path.join(self.directory, '*.fit'),
+      'missing.fit'])
+    self.assertEqual([os.path.basename(f) for f in filenames],
+      ['s0.fit', 's1.fit', 's2.fit', 'missing.fit'])
+
+  def testRender(self):
+    filenames = quicklook.expand([os.path.join(self.directory, '*.fit')])
+    results = quicklook.batch(filenames + ['missing.fit'], self.args)
+    self.assertEqual(results[-1], None)
+    self.assertEqual(sorted(os.listdir(self.args.outdir)),
+      ['s0.png', 's1.png', 's2.png'])
+
+  def testOutputNames(self):
+    self.assertEqual(quicklook.output_names(['a/s0.fit', 'b/s1.fit']),
+      ['s0', 's1'])
+    self.assertEqual(
+      quicklook.output_names(['n/a/s0.fit', 'n/b/s0.fit', 'n/b/c/s1.fit']),
+      [os.path.join('a', 's0'), os.path.join('b', 's0'),
+        os.path.join('b', 'c', 's1')])
+
+  def testRenderSameBasename(self):
+    night = os.path.join(self.directory, 'night')
+    os.mkdir(night)
+    shutil.copy(os.path.join(self.directory, 's0.fit'), night)
+    quicklook.batch([os.path.join(self.directory, 's0.fit'),
+      os.path.join(night, 's0.fit')], self.args)
+    self.assertTrue(os.path.exists(os.path.join(self.args.outdir, 's0.png')))
+    self.assertTrue(os.path.exists(
+      os.path.join(self.args.outdir, 'night', 's0.png')))
+
+
+def main():
+  unittest.main()
+
+if __name__ == '__main__':
+  main()
@@ -0,0 +1,149 @@
+import unittest
+import numpy as np
+import resample
+
+class ResamplerTests(unittest.TestCase):
+
+  def setUp(self):
+    self.source = np.arange(20) * 2.0 + 100
+    self.target = np.linspace(95, 145, 33)
+    self.data = np.random.RandomState(0).uniform(size=(3, 20))
+
+  def testLinearMatchesInterp(self):
+    r = resample.Resampler(self.source, self.target)
+    resampled = r.apply(self.data)
+    for row in range(3):
+      np.testing.assert_allclose(
+        resampled[row], np.interp(self.target, self.source, self.data[row]))
+
+  def testOneDimensional(self):
+    r = resample.Resampler(self.source, self.target)
+    self.assertEqual(r.apply(self.data[0]).shape, (33,))
+
+  def testFluxConserving(self):
+    target = np.arange(10) * 4.0 + 101
+    r = resample.Resampler(self.source, target, flux_conserving=True)
+    resampled = r.apply(self.data)
+    np.testing.assert_allclose(resampled.sum(axis=1), self.data.sum(axis=1))
+    np.testing.assert_allclose(resampled[:, 0], self.data[:, 0:2].sum(axis=1))
+
+  def testPixelEdges(self):
+    edges = resample.pixel_edges([1.0, 2.0, 4.0])
+    self.assertEqual(edges.tolist(), [0.5, 1.5, 3.0, 5.0])
+
+
+class MockSpectra:
+
+  def __init__(self, crval, data):
+    self.headers = {'CRPIX1': 0, 'CRVAL1': crval, 'CDELT1': 1.0}
+    self._data = np.asarray(data, dtype=float)
+
+  def get_header(self, header):
+    return self.headers[header]
+
+  def data(self):
+    return self._data
+
+  def wavelengths(self):
+    return self.headers['CRVAL1'] + np.arange(len(self._data))
+
+
+class ResampleManyTests(unittest.TestCase):
+
+  def testGroupsByCalibration(self):
+    target = MockSpectra(0, np.zeros(5))
+    spectra = [
+      MockSpectra(0, [0, 1, 2, 3, 4]),
+      MockSpectra(1, [0, 1, 2, 3, 4]),
+      MockSpectra(0, [4, 3, 2, 1, 0]),
+    ]
+    resampled = resample.resample_many(spectra, target)
+    self.assertEqual(resampled.tolist(), [
+      [0, 1, 2, 3, 4],
+      [0, 0, 1, 2, 3],
+      [4, 3, 2, 1, 0],
+    ])
+
+  def testResamplerCached(self):
+    source = MockSpectra(0, np.zeros(5))
+    target = MockSpectra(0.5, np.zeros(5))
+    self.assertTrue(
+      resample.resampler(source, target) is resample.resampler(source, target))
+
+
+def absorption_spectra(wavelengths):
+  # A sloping continuum with three absorption lines
+  data = 1 + (wavelengths - 4000) / 1000.0
+  for line in (4861.0, 5500.0, 6563.0):
+    data = data * (1 - 0.5 * np.exp(-0.5 * ((wavelengths - line) / 6) ** 2))
+  return data
+
+
+class CrossCorrelationTests(unittest.TestCase):
+
+  def setUp(self):
+    self.wavelengths = np.arange(4000.0, 7000.0, 2.0)
+    self.reference = absorption_spectra(self.wavelengths)
+
+  def testShifts(self):
+    rows = [absorption_spectra(self.wavelengths - 2.0 * shift)
+      for shift in (0, 3, -1.5, 0.25)]
+    shifts = resample.cross_correlation_shifts(self.reference, rows)
+    np.testing.assert_allclose(shifts, [0, 3, -1.5, 0.25], atol=0.05)
+
+  def testMaxShift(self):
+    row = absorption_spectra(self.wavelengths - 2.0 * 10)
+    self.assertTrue(abs(resample.cross_correlation_shifts(
+      self.reference, row, max_shift=3)[0]) <= 3.5)
+
+
+class AlignedResampleTests(unittest.TestCase):
+
+  def setUp(self):
+    wavelengths = 4000 + np.arange(1500) * 2.0
+    self.target = MockSpectra(4000, absorption_spectra(wavelengths))
+    self.target.wavelengths = lambda: wavelengths
+
+  def spectra(self, shift = 0.0, factor = 1.0):
+    # Observed at wavelengths moved by shift or factor, but calibrated as if
+    # they were not
+    wavelengths = 4001 + np.arange(1500) * 2.0
+    s = MockSpectra(4001, absorption_spectra((wavelengths - shift) / factor))
+    s.wavelengths = lambda: wavelengths
+    return s
+
+  def residuals(self, resampled):
+    return np.abs(resampled - self.target.data())[:, 20:-20].max(axis=1)
+
+  def assertAligned(self, spectra, resampled):
+    # Only the error of linear interpolation across the lines remains
+    self.assertTrue(np.all(self.residuals(resampled) < 0.02))
+    self.assertTrue(np.all(self.residuals(
+      resample.resample_many(spectra, self.target)) > 0.1))
+
+  def testLinear(self):
+    spectra = [self.spectra(3.0), self.spectra(-4.5)]
+    resampled, shifts = resample.aligned_resample_many(spectra, self.target)
+    np.testing.assert_allclose(shifts, [1.5, -2.25], atol=0.05)
+    self.assertAligned(spectra, resampled)
+
+  def testLog(self):
+    spectra = [self.spectra(factor=1.001), self.spectra(factor=0.9995)]
+    resampled, shifts = resample.aligned_resample_many(spectra, self.target,
+      method='log')
+    self.assertAligned(spectra, resampled)
+
+  def testNone(self):
+    spectra = [self.spectra(3.0)]
+    resampled, shifts = resample.aligned_resample_many(spectra, self.target,
+      method='none')
+    self.assertEqual(shifts.tolist(), [0])
+    np.testing.assert_allclose(resampled,
+      resample.resample_many(spectra, self.target))
+
+
+def main():
+  unittest.main()
+
+if __name__ == '__main__':
+  main()
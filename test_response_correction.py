@@ -0,0 +1,65 @@
+import unittest
+import numpy as np
+import specreduce
+
+class InterpolateRowsTests(unittest.TestCase):
+
+  def testMatchesInterp(self):
+    x = np.linspace(-1, 12, 40)
+    xp = np.array([np.arange(10) * 1.0, np.arange(10) * 1.2 + 0.5])
+    fp = np.array([np.arange(10) ** 2, np.sin(np.arange(10))])
+    interpolated = specreduce.interpolate_rows(x, xp, fp)
+    for row in range(2):
+      np.testing.assert_allclose(interpolated[row], np.interp(x, xp[row], fp[row]))
+
+
+class MockSpectra(specreduce.Plotable):
+
+  def __init__(self, data):
+    self._data = np.asarray(data, dtype=float)
+
+  def data(self):
+    return self._data
+
+
+class CorrectManyTests(unittest.TestCase):
+
+  def setUp(self):
+    self.reference = MockSpectra(np.ones(50))
+    self.targets = [MockSpectra(np.linspace(1, 2, 50) * i) for i in (1, 2, 3)]
+
+  def tearDown(self):
+    specreduce.clear_response_curves()
+
+  def testMatchesCorrectedSpectra(self):
+    wavelengths, corrected = specreduce.correct_many(self.reference, self.targets)
+    single = specreduce.CorrectedSpectra(self.targets[0], self.reference)
+    self.assertEqual(corrected.shape, (3, 50))
+    np.testing.assert_allclose(corrected[0], single.data())
+
+  def testResponseCurveCached(self):
+    first = specreduce.response_curve(self.targets[0], self.reference)
+    second = specreduce.response_curve(self.targets[0], self.reference)
+    self.assertTrue(first is second)
+
+  def testRefitAfterCalibration(self):
+    first = specreduce.response_curve(self.targets[0], self.reference)
+    self.targets[0].set_calibration(specreduce.DoublePointCalibration(
+      specreduce.CalibrationReference(0, 4000),
+      specreduce.CalibrationReference(49, 7000)))
+    second = specreduce.response_curve(self.targets[0], self.reference)
+    self.assertFalse(first is second)
+
+  def testCacheBounded(self):
+    for i in range(specreduce.MAX_RESPONSE_CURVES + 5):
+      specreduce.response_curve(MockSpectra(np.linspace(1, 2, 50) + i),
+        self.reference)
+    self.assertEqual(len(specreduce._response_curves),
+      specreduce.MAX_RESPONSE_CURVES)
+
+
+def main():
+  unittest.main()
+
+if __name__ == '__main__':
+  main()
@@ -0,0 +1,110 @@
+import unittest
+import os
+import shutil
+import tempfile
+import numpy as np
+import pyfits
+import stacking
+
+class RunningStackTests(unittest.TestCase):
+
+  def setUp(self):
+    self.stack = stacking.RunningStack(squares = True)
+    self.stack.add(np.array([[1, 2], [3, 4]], dtype=np.uint8), {'EXPTIME': 10})
+    self.stack.add(np.array([[3, 2], [5, 8]], dtype=np.uint8), {'EXPTIME': 5})
+
+  def testMean(self):
+    self.assertEqual(self.stack.mean().tolist(), [[2, 2], [4, 6]])
+
+  def testStddev(self):
+    self.assertEqual(self.stack.stddev().tolist(), [[1, 0], [1, 2]])
+
+  def testExptime(self):
+    self.assertEqual(self.stack.exptime, 15.0)
+
+  def testDtype(self):
+    self.assertEqual(self.stack.dtype, np.uint8)
+
+  def testShapeMismatch(self):
+    self.assertRaises(ValueError, self.stack.add, np.zeros((3, 3)))
+
+
+class InputDtypeTests(unittest.TestCase):
+
+  def setUp(self):
+    self.directory = tempfile.mkdtemp()
+    self.filenames = []
+    for i in range(2):
+      filename = os.path.join(self.directory, 'f%d.fit' % (i))
+      # Unsigned 16 bit data is stored with BZERO 32768
+      pyfits.writeto(filename, np.full((4, 3), 40000 + i, dtype='uint16'))
+      self.filenames.append(filename)
+
+  def tearDown(self):
+    shutil.rmtree(self.directory)
+
+  def testSameForEveryMethod(self):
+    stack = stacking.RunningStack()
+    for filename in self.filenames:
+      stack.add_file(filename)
+    self.assertEqual(stack.dtype, np.uint16)
+    self.assertEqual(stack.mean()[0, 0], 40000.5)
+    self.assertFalse('BZERO' in stack.output_header())
+
+    cube = stacking.FrameCube(self.filenames)
+    self.assertEqual(cube.dtype, np.uint16)
+    cube.close()
+
+
+class CastToTests(unittest.TestCase):
+
+  def testIntegerRoundsAndClips(self):
+    cast = stacking.cast_to(np.array([-1.0, 1.6, 300.0]), np.dtype(np.uint8))
+    self.assertEqual(cast.tolist(), [0, 2, 255])
+
+  def testFloat(self):
+    cast = stacking.cast_to(np.array([1.25]), np.dtype(np.float32))
+    self.assertEqual(cast.dtype, np.float32)
+
+
+class CombineTests(unittest.TestCase):
+
+  def setUp(self):
+    self.cube = np.array([
+      [[1, 2], [3, 4]],
+      [[2, 2], [3, 5]],
+      [[3, 2], [3, 6]],
+      [[100, 2], [3, 7]],
+    ], dtype=float)
+
+  def testMedian(self):
+    combined = stacking.combine_array(self.cube, 'median')
+    self.assertEqual(combined.tolist(), [[2.5, 2], [3, 5.5]])
+
+  def testSigmaClipRejectsOutlier(self):
+    combined = stacking.combine_array(self.cube, 'sigclip', sigma=1.5)
+    self.assertEqual(combined[0][0], 2)
+
+  def testMinMax(self):
+    combined = stacking.combine_array(self.cube, 'minmax')
+    self.assertEqual(combined.tolist(), [[2.5, 2], [3, 5.5]])
+
+  def testTiledMatchesUntiled(self):
+    cube = np.random.RandomState(0).normal(size=(5, 37, 11))
+    tiled = stacking.combine_array(cube, 'median', memory=5 * 11 * 8 * 4 * 3,
+      threads=3)
+    np.testing.assert_allclose(tiled, np.median(cube, axis=0))
+
+  def testOneDimensional(self):
+    combined = stacking.combine_array(self.cube[:, 1], 'mean')
+    self.assertEqual(combined.tolist(), [3, 5.5])
+
+  def testUnknownMethod(self):
+    self.assertRaises(ValueError, stacking.combine_tile, self.cube, 'mode')
+
+
+def main():
+  unittest.main()
+
+if __name__ == '__main__':
+  main()
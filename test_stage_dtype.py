@@ -0,0 +1,44 @@
+import unittest
+import numpy as np
+import pyfits
+import pipeline
+
+class StageDtypeTests(unittest.TestCase):
+
+  def setUp(self):
+    self.frame = np.ones((20, 8), dtype=np.float32)
+    self.frame[10:13] = 100.5
+
+  def testBinKeepsFraction(self):
+    binned = pipeline.bin_frame(self.frame, pyfits.Header(), 6)
+    self.assertEqual(binned.dtype, np.float32)
+    self.assertEqual(binned.tolist(), [17 + 3 * 100.5 - 3] * 8)
+
+  def testBinIntegerSums(self):
+    binned = pipeline.bin_sums(np.array([100, 200]), np.ones((6, 2)), 12)
+    self.assertEqual(binned.dtype, np.float32)
+    self.assertEqual(binned.tolist(), [98, 198])
+
+  def testNormaliseInPlace(self):
+    data = np.array([1, 2, 4], dtype=np.float32)
+    normalised = pipeline.normalise(data, pyfits.Header(), out=data)
+    self.assertTrue(normalised is data)
+    self.assertEqual(data.tolist(), [0.25, 0.5, 1])
+
+  def testNormaliseIntegers(self):
+    normalised = pipeline.normalise(np.array([1, 2, 4]), pyfits.Header())
+    self.assertEqual(normalised.dtype, np.float32)
+    self.assertEqual(normalised.tolist(), [0.25, 0.5, 1])
+
+  def testCalibrateKeepsType(self):
+    data = np.arange(400, dtype=np.float32)
+    data[50] = 1000
+    calibrated = pipeline.auto_calibrate(data, pyfits.Header(), 12.1)
+    self.assertTrue(calibrated is data)
+
+
+def main():
+  unittest.main()
+
+if __name__ == '__main__':
+  main()
@@ -0,0 +1,75 @@
+import unittest
+import os
+import shutil
+import tempfile
+import numpy as np
+import pyfits
+import stagecache
+
+class StageCacheTests(unittest.TestCase):
+
+  def setUp(self):
+    self.directory = tempfile.mkdtemp()
+    self.cache = stagecache.StageCache(
+      os.path.join(self.directory, 'cache'), 2 ** 20, [stagecache])
+    self.data = np.arange(1000, dtype=np.float32)
+    self.header = pyfits.Header()
+    self.header.update('EXPTIME', 30.0)
+
+  def tearDown(self):
+    shutil.rmtree(self.directory)
+
+  def testInputKey(self):
+    key = self.cache.input_key(self.data, self.header)
+    self.assertEqual(key, self.cache.input_key(self.data.copy(), self.header))
+    self.assertNotEqual(key, self.cache.input_key(self.data + 1, self.header))
+    header = self.header.copy()
+    header.update('EXPTIME', 60.0)
+    self.assertNotEqual(key, self.cache.input_key(self.data, header))
+
+  def testChain(self):
+    stages = [('crop', {'padding': 30}), ('bin', {'skywidth': 6}),
+      ('calibrate', {'spacing': 12.1})]
+    keys = self.cache.chain('input', stages)
+    stages[1] = ('bin', {'skywidth': 8})
+    changed = self.cache.chain('input', stages)
+    self.assertEqual(keys[0], changed[0])
+    self.assertNotEqual(keys[1], changed[1])
+    self.assertNotEqual(keys[2], changed[2])
+
+  def testCodeVersion(self):
+    other = stagecache.StageCache(self.cache.directory, 2 ** 20, [unittest])
+    self.assertNotEqual(self.cache.key('crop', 'input', {}),
+      other.key('crop', 'input', {}))
+
+  def testPutGet(self):
+    self.assertEqual(self.cache.get('missing'), None)
+    self.cache.put('a', self.data, self.header)
+    data, header = self.cache.get('a')
+    self.assertTrue(np.array_equal(data, self.data))
+    self.assertEqual(header['EXPTIME'], 30.0)
+
+  def testLatest(self):
+    self.assertEqual(self.cache.latest(['a', 'b', 'c']), None)
+    self.cache.put('b', self.data, self.header)
+    index, data, header = self.cache.latest(['a', 'b', 'c'])
+    self.assertEqual(index, 1)
+
+  def testEvictLeastRecentlyUsed(self):
+    for i, key in enumerate(['a', 'b', 'c']):
+      self.cache.put(key, self.data, self.header)
+      os.utime(self.cache.path(key), (i, i))
+    self.cache.max_bytes = 3 * os.path.getsize(self.cache.path('a'))
+    self.cache.get('a')
+    self.cache.put('d', self.data, self.header)
+    self.assertTrue(self.cache.size <= self.cache.max_bytes)
+    self.assertEqual(
+      sorted(os.path.basename(p) for _, _, p in self.cache.entries()),
+      ['a.fit', 'c.fit', 'd.fit'])
+
+
+def main():
+  unittest.main()
+
+if __name__ == '__main__':
+  main()
@@ -0,0 +1,103 @@
+import unittest
+import argparse
+import os
+import shutil
+import sys
+import tempfile
+import pyfits
+import matplotlib
+matplotlib.use('Agg')
+import bench_stages
+import pipeline
+import watch
+
+class WatcherTests(unittest.TestCase):
+
+  def setUp(self):
+    self.directory = tempfile.mkdtemp()
+    self.capture = os.path.join(self.directory, 'capture')
+    self.outdir = os.path.join(self.directory, 'reduced')
+    os.mkdir(self.capture)
+    os.mkdir(self.outdir)
+    parser = argparse.ArgumentParser()
+    pipeline.add_reduction_arguments(parser)
+    self.args = parser.parse_args(['--spacing', str(9000.0 / (640 * 0.85))])
+    self.args.outdir = self.outdir
+    self.watcher = watch.Watcher(self.capture, self.args)
+
+  def tearDown(self):
+    shutil.rmtree(self.directory)
+
+  def capture_frame(self, name, seed = 0):
+    pyfits.writeto(os.path.join(self.capture, name),
+      bench_stages.synthetic_frame(640, 120, 16, seed),
+      bench_stages.exptime_header())
+    return os.path.join(self.capture, name)
+
+  def testReadyOnceSizeIsStable(self):
+    filename = self.capture_frame('a.fit')
+    self.assertEqual(self.watcher.ready(), [])
+    self.assertEqual(self.watcher.ready(), [filename])
+
+  def testGrowingFile(self):
+    filename = os.path.join(self.capture, 'a.fit')
+    with open(filename, 'w') as f:
+      f.write(' ' * 2880)
+    self.assertEqual(self.watcher.ready(), [])
+    with open(filename, 'a') as f:
+      f.write(' ' * 2880)
+    self.assertEqual(self.watcher.ready(), [])
+    self.assertEqual(self.watcher.ready(), [filename])
+
+  def testPattern(self):
+    self.capture_frame('a.fit')
+    self.capture_frame('a.fits')
+    self.assertEqual([os.path.basename(f) for f in self.watcher.candidates()],
+      ['a.fit'])
+
+  def testSkipExisting(self):
+    self.capture_frame('a.fit')
+    self.watcher.skip_existing()
+    filename = self.capture_frame('b.fit')
+    self.assertEqual(self.watcher.candidates(), [filename])
+
+  def testProcess(self):
+    stdout = sys.stdout
+    sys.stdout = open(os.devnull, 'w')
+    try:
+      for seed in range(2):
+        filename = self.capture_frame('f%d.fit' % (seed), seed)
+        self.assertTrue(self.watcher.process(filename) is not None)
+      failed = self.watcher.process(os.path.join(self.capture, 'missing.fit'))
+    finally:
+      sys.stdout.close()
+      sys.stdout = stdout
+
+    self.assertEqual(failed, None)
+    self.assertEqual(self.watcher.candidates(), [])
+    self.assertEqual(sorted(os.listdir(self.outdir)),
+      ['f0.fit', 'f1.fit', watch.QUICKLOOK_NAME, watch.STACK_NAME])
+    header = pyfits.getheader(os.path.join(self.outdir, watch.STACK_NAME))
+    self.assertEqual(header['NCOMBINE'], 2)
+    self.assertEqual(header['EXPTIME'], 60.0)
+
+  def testProcessCarriesOn(self):
+    def fail(latest):
+      raise RuntimeError('no display')
+    self.watcher.write_quicklook = fail
+    stdout = sys.stdout
+    sys.stdout = open(os.devnull, 'w')
+    try:
+      failed = self.watcher.process(self.capture_frame('f0.fit'))
+    finally:
+      sys.stdout.close()
+      sys.stdout = stdout
+    self.assertEqual(failed, None)
+    self.assertEqual(self.watcher.stack.count, 1)
+
+
+def main():
+  unittest.main()
+
+if __name__ == '__main__':
+  main()
@@ -0,0 +1,57 @@
+import unittest
+import numpy as np
+import pipeline
+
+def gaussian_spectra(centres, sigma = 1.5, length = 200):
+  x = np.arange(length, dtype=float)
+  return np.array(
+    [1000 * np.exp(-0.5 * ((x - c) / sigma) ** 2) + 10 for c in centres])
+
+class ZeroOrderTests(unittest.TestCase):
+
+  def setUp(self):
+    self.centres = np.array([50.0, 50.3, 75.5, 99.8, 120.45])
+    self.spectra = gaussian_spectra(self.centres)
+
+  def testDataPeak(self):
+    datamax, positions = pipeline.find_zero_orders(self.spectra)
+    self.assertEqual(datamax.tolist(), [50, 50, 75, 100, 120])
+
+  def testParabolic(self):
+    datamax, positions = pipeline.find_zero_orders(self.spectra)
+    self.assertTrue(np.abs(positions - self.centres).max() < 0.1)
+
+  def testGaussianExact(self):
+    spectra = gaussian_spectra(self.centres) - 10
+    datamax, positions = pipeline.find_zero_orders(spectra, method='gaussian')
+    np.testing.assert_allclose(positions, self.centres, atol=1e-6)
+
+  def testAtLeastAsAccurateAsPoly(self):
+    datamax, poly = pipeline.find_zero_orders(self.spectra, method='poly')
+    datamax, parabolic = pipeline.find_zero_orders(self.spectra)
+    self.assertTrue(np.abs(parabolic - self.centres).max() <=
+      np.abs(poly - self.centres).max())
+
+  def testMaxx(self):
+    # The brighter peak beyond maxx is ignored
+    spectra = gaussian_spectra([30.2, 60.0])
+    spectra[:, 150:] += gaussian_spectra([0.0])[0][:50] * 2
+    datamax, positions = pipeline.find_zero_orders(spectra, maxx=100)
+    self.assertEqual(datamax.tolist(), [30, 60])
+    self.assertTrue(np.abs(positions - [30.2, 60.0]).max() < 0.1)
+
+  def testSingleSpectra(self):
+    datamax, position = pipeline.find_zero_order(self.spectra[2])
+    self.assertEqual(datamax, 75)
+    self.assertTrue(abs(position - 75.5) < 0.1)
+
+  def testUnknownMethod(self):
+    self.assertRaises(ValueError, pipeline.find_zero_orders, self.spectra,
+      method='mode')
+
+
+def main():
+  unittest.main()
+
+if __name__ == '__main__':
+  main()
@@ -0,0 +1,191 @@
+#! /usr/bin/env python
+#
+# Reduce raw frames as they arrive in a capture directory.
+#
+#   watch.py --spacing 12.1 --dark darks/ --outdir reduced capture/
+#
+# The master darks and flats are loaded once, and each new frame is run
+# through the same stages as pipeline.py in this process as soon as the
+# capture software has finished writing it.  The reduced spectra are also
+# resampled onto the first one and averaged into a running stack, and a
+# quicklook PNG of the latest spectra and the stack is redrawn, so the data
+# can be judged during the night.
+#
+import pyfits
+import argparse
+import fnmatch
+import os
+import time
+import matplotlib
+import fitsaccess
+import instrument
+import pipeline
+import resample
+import specreduce
+import stacking
+
+STACK_NAME = 'stack.fit'
+QUICKLOOK_NAME = 'quicklook.png'
+
+
+def spectra_from(data, header):
+  return specreduce.BessSpectra(
+    pyfits.HDUList([pyfits.PrimaryHDU(data, header)]))
+
+
+class Watcher:
+
+  def __init__(self, directory, args, library = None, pattern = '*.fit'):
+    self.directory = directory
+    self.args = args
+    self.library = library
+    self.pattern = pattern
+    self.seen = set()
+    # Sizes at the last poll of files waiting to be reduced
+    self.sizes = {}
+    self.stack = stacking.RunningStack()
+    self.reference = None
+    self.figure = None
+
+  def candidates(self):
+    paths = [os.path.join(self.directory, f) for f in
+      fnmatch.filter(os.listdir(self.directory), self.pattern)]
+    return sorted(p for p in paths if p not in self.seen)
+
+  def skip_existing(self):
+    self.seen.update(self.candidates())
+
+  def ready(self):
+    # New files whose size has not changed since the previous poll, so the
+    # capture software has finished writing them
+    ready = []
+    sizes = {}
+    for path in self.candidates():
+      try:
+        size = os.path.getsize(path)
+      except OSError:
+        continue
+      if size > 0 and self.sizes.get(path) == size:
+        ready.append(path)
+      else:
+        sizes[path] = size
+    self.sizes = sizes
+    return ready
+
+  def process(self, filename):
+    # Returns the time taken to reduce the frame and update the stack and
+    # quicklook, or None if it could not be reduced
+    self.seen.add(filename)
+    start = time.time()
+    # Any error in one frame is reported and the watcher carries on with
+    # the next, rather than stopping in the middle of the night
+    try:
+      data, header = pipeline.reduce_file(filename, self.args, self.library)
+
+      with instrument.stage('write', filename):
+        fitsaccess.write(
+          os.path.join(self.args.outdir, os.path.basename(filename)), data,
+          header, self.args.compress, clobber=True, dtype=self.args.dtype)
+
+      with instrument.stage('watch_stack', filename):
+        latest = self.add_to_stack(data, header)
+
+      with instrument.stage('watch_quicklook', filename):
+        self.write_quicklook(latest)
+    except Exception as e:
+      print 'ERR: %s: %s' % (filename, e)
+      return None
+
+    latency = time.time() - start
+    print '%s: reduced in %.3fs, %d frames stacked' % (filename, latency,
+      self.stack.count)
+    return latency
+
+  def add_to_stack(self, data, header):
+    latest = spectra_from(data, header)
+    if self.reference is None:
+      self.reference = latest
+      resampled = data
+    else:
+      resampled = resample.resample_many([latest], self.reference)[0]
+    self.stack.add(resampled, header.copy())
+
+    header = self.stack.output_header()
+    header.update('NCOMBINE', self.stack.count, 'Number of frames combined')
+    fitsaccess.write(os.path.join(self.args.outdir, STACK_NAME),
+      self.stack.mean(), header, self.args.compress, clobber=True,
+      dtype=self.args.dtype)
+    return latest
+
+  def write_quicklook(self, latest):
+    import matplotlib.pyplot as plt
+    if self.figure is None:
+      self.figure = plt.figure()
+    self.figure.clf()
+    axes = self.figure.add_subplot(111)
+
+    stacked = spectra_from(self.stack.mean(), self.stack.header)
+    stacked.label = 'Stack of %d' % (self.stack.count)
+    for spectra in (latest, stacked):
+      spectra.plot_onto(axes, downsample='minmax')
+
+    axes.set_xlabel(r'Wavelength ($\AA$)')
+    axes.set_ylabel('Relative intensity')
+    axes.legend(loc='best')
+    self.figure.savefig(os.path.join(self.args.outdir, QUICKLOOK_NAME))
+
+
+def main():
+  parser = argparse.ArgumentParser(
+      description='Reduce raw frames as they arrive in a directory')
+  parser.add_argument('directory', type=str, help='Capture directory')
+  parser.add_argument('--outdir', '-o', type=str, default='reduced',
+      help='Directory for reduced files, %s and %s (default: reduced)' % (
+        STACK_NAME, QUICKLOOK_NAME))
+  parser.add_argument('--pattern', '-p', type=str, default='*.fit',
+      help='Raw frame filename pattern (default: *.fit)')
+  parser.add_argument('--interval', type=float, default=0.5,
+      help='Seconds between polls of the directory (default: 0.5)')
+  parser.add_argument('--existing', action='store_true',
+      help='Also reduce frames already in the directory')
+  parser.add_argument('--once', action='store_true',
+      help='Exit once no new frames are waiting')
+  pipeline.add_reduction_arguments(parser)
+  parser.add_argument('--log', type=str,
+      help='Append per stage timings to this JSON lines file')
+
+  args = parser.parse_args()
+  pipeline.check_reduction_arguments(parser, args)
+
+  if os.path.realpath(args.outdir) == os.path.realpath(args.directory):
+    parser.error('--outdir must not be the capture directory')
+
+  if args.log:
+    instrument.set_log(args.log)
+
+  if not os.path.isdir(args.outdir):
+    os.makedirs(args.outdir)
+
+  matplotlib.use('Agg')
+  watcher = Watcher(args.directory, args,
+    pipeline.load_library(args.dark, args.flat), args.pattern)
+  if not args.existing:
+    watcher.skip_existing()
+
+  print 'Watching %s for %s' % (args.directory, args.pattern)
+
+  try:
+    while True:
+      for filename in watcher.ready():
+        watcher.process(filename)
+      if args.once and not watcher.sizes:
+        break
+      time.sleep(args.interval)
+  except KeyboardInterrupt:
+    pass
+
+  print 'Stacked %d frames' % (watcher.stack.count)
+
+
+if __name__ == '__main__':
+  main()
@@ -1,7 +1,8 @@
 #! /usr/bin/env python
-import pyfits
 import argparse
-import specreduce
+import pipeline
+import fitsaccess
+import instrument
 import numpy as np
 
 parser = argparse.ArgumentParser(
@@ -16,20 +17,12 @@ parser.add_argument('--max', type=int, default=8000,
 
 args = parser.parse_args()
 
-f = pyfits.open(args.filename)
-header = f[0].header
+with instrument.stage('wavelength_crop', args.filename) as timer:
+  with fitsaccess.open_image(args.filename) as image:
+    header = image.scaled_header()
+    left, right = pipeline.wavelength_window(header, image.shape[-1],
+        args.min, args.max, args.filename)
+    cropped = image.columns(left, right)
 
-spectra = specreduce.BessSpectra(f)
-calibration = spectra.calibration
-wl = np.array(spectra.wavelengths())
-left = np.argmax(wl>args.min)
-right = np.argmax(wl>args.max)
-
-print '%s: Cropping %d to %d' % (args.filename, left, right)
-
-cropped = spectra.data()[left:right]
-header.update('CRVAL1', calibration.angstrom(left+1))
-header.update('CRPIX1', 1.0)
-header.update('CRPLFT', left, 'Left of crop area from wavelength_crop.py')
-header.update('CRPRGT', right, 'Right of crop area from wavelength_crop.py')
-pyfits.writeto(args.outfile, cropped, header, output_verify='fix')
+  timer.add_history(header)
+  fitsaccess.write(args.outfile, cropped, header)